@@ -0,0 +1,202 @@
+"""Deltas between generations of JSON package archives.
+
+Every mkpkglists run with a segment file publishes a new generation of
+the package archives. Entries are compared against those of the previous
+segment while they are written, which yields the names of packages
+added, changed or removed by the run. The change sets of the last few
+generations are kept in a history file.
+
+For each generation still in the history, a delta file holding the
+current objects of all packages changed since then, and the names of
+all packages removed since then, is published next to each JSON
+archive. Delta files are named after the SHA-256 of their content; an
+index mapping the SHA-256 of the archive a client holds to the delta
+bringing it up to date is kept in `<archive>.deltas`.
+"""
+
+import gzip
+import hashlib
+import os
+from collections.abc import Iterator
+
+import orjson
+
+from aurweb.archives.segment import Entry
+
+# Suffix of delta index files, see index_path().
+INDEX_SUFFIX = ".deltas"
+
+
+def index_path(archive: str) -> str:
+    """Return the path of the delta index of `archive`."""
+    return f"{archive}{INDEX_SUFFIX}"
+
+
+def lookup(archive: str, sha256: str) -> str | None:
+    """Return the name of the delta of `archive` from the generation
+    whose SHA-256 is `sha256`, if any."""
+    try:
+        with open(index_path(archive), "rb") as f:
+            return orjson.loads(f.read()).get(sha256)
+    except FileNotFoundError:
+        return None
+
+
+def load(path: str, options: dict) -> list[dict]:
+    """Load the generation history at `path`.
+
+    :param path: History file path
+    :param options: Generator options the history must have been built with
+    :return: List of generations, oldest first; empty if there is no
+             usable history
+    """
+    try:
+        with open(path, "rb") as f:
+            data = orjson.loads(f.read())
+    except FileNotFoundError:
+        return []
+
+    if data.get("options") != options:
+        return []
+    return data.get("generations")
+
+
+def save(path: str, options: dict, generations: list[dict]) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(orjson.dumps({"options": options, "generations": generations}))
+    os.replace(tmp, path)
+
+
+class Tracker:
+    """Compare entries against those of a previous segment.
+
+    Both must be sorted by key. Fields of changed entries, and of entries
+    named in `names`, are captured for use in deltas.
+    """
+
+    def __init__(self, old: Iterator[Entry], names: set[str]) -> None:
+        self.old = old
+        self.names = names
+        self.changed = set()
+        self.removed = set()
+        self.captured = {}
+
+    def track(self, entries: Iterator[Entry]) -> Iterator[Entry]:
+        old = next(self.old, None)
+        for entry in entries:
+            while old is not None and old.key < entry.key:
+                self.removed.add(old.fields[0].decode())
+                old = next(self.old, None)
+
+            name = entry.fields[0].decode()
+            if old is not None and old.key == entry.key:
+                if old.fields[0] != entry.fields[0]:
+                    self.removed.add(old.fields[0].decode())
+                if old.fields != entry.fields:
+                    self.changed.add(name)
+                old = next(self.old, None)
+            else:
+                self.changed.add(name)
+
+            if name in self.changed or name in self.names:
+                self.captured[name] = entry.fields
+            yield entry
+
+        while old is not None:
+            self.removed.add(old.fields[0].decode())
+            old = next(self.old, None)
+
+        # Packages may be recreated or renamed to a previous name.
+        self.removed -= self.captured.keys()
+
+
+def _prefix(archive: str) -> str:
+    return os.path.basename(archive).removesuffix(".gz") + ".delta-"
+
+
+def _write(archive: str, data: bytes) -> str:
+    name = _prefix(archive) + hashlib.sha256(data).hexdigest() + ".gz"
+    path = os.path.join(os.path.dirname(archive), name)
+    if not os.path.exists(path):
+        # Compress deterministically; the name only depends on `data`.
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(gzip.compress(data, mtime=0))
+        os.replace(f"{path}.tmp", path)
+    return name
+
+
+def _publish_index(archive: str, deltas: dict[str, str]) -> None:
+    path = index_path(archive)
+    with open(f"{path}.tmp", "wb") as f:
+        f.write(orjson.dumps(deltas))
+    os.replace(f"{path}.tmp", path)
+
+    # Remove delta files which are no longer referenced.
+    directory, prefix = os.path.dirname(archive), _prefix(archive)
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name not in deltas.values():
+            os.remove(os.path.join(directory, name))
+
+
+def publish(
+    history: str,
+    options: dict,
+    generations: list[dict],
+    tracker: Tracker | None,
+    archives: dict[str, tuple[str, int]],
+    limit: int,
+) -> None:
+    """Publish deltas of `archives` and record their new generation.
+
+    :param history: History file path
+    :param options: Generator options
+    :param generations: Generations loaded from `history`
+    :param tracker: Tracker which compared the new entries against
+                    those of the previous generation, or None if there
+                    was no previous generation to compare against
+    :param archives: Mapping of JSON archive path to a tuple of its
+                     SHA-256 and the index of the entry field holding
+                     its package objects
+    :param limit: Number of previous generations to publish deltas for
+    """
+    current = {
+        "sha256": {path: sha256 for path, (sha256, _) in archives.items()},
+        "changed": sorted(tracker.changed) if tracker else [],
+        "removed": sorted(tracker.removed) if tracker else [],
+    }
+    if not tracker:
+        generations = []
+    generations = [*generations, current][-(limit + 1) :]
+
+    for path, (sha256, index) in archives.items():
+        deltas = {}
+        changed, removed = set(), set()
+
+        # Walk back from the newest generation, accumulating changes.
+        for i in range(len(generations) - 1, 0, -1):
+            changed.update(generations[i].get("changed"))
+            removed.update(generations[i].get("removed"))
+
+            base = generations[i - 1].get("sha256").get(path)
+            if not base or base == sha256 or base in deltas:
+                continue
+
+            packages = [
+                orjson.Fragment(tracker.captured[name][index])
+                for name in sorted(changed)
+                if name in tracker.captured
+            ]
+            data = orjson.dumps(
+                {
+                    "from": base,
+                    "to": sha256,
+                    "packages": packages,
+                    "removed": sorted(removed - tracker.captured.keys()),
+                }
+            )
+            deltas[base] = _write(path, data)
+
+        _publish_index(path, deltas)
+
+    save(history, options, generations)
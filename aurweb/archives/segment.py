@@ -0,0 +1,181 @@
+"""Sorted on-disk segments of rendered archive entries.
+
+Archive generators which support incremental runs keep the entries they
+rendered in a segment file, sorted by key. The next run only re-renders
+entries of package bases which changed since, see `changed_since()`, and
+splices them into the entries of the previous segment while writing the
+archives and the new segment.
+
+Changes are detected through the high-water marks of
+PackageBases.ModifiedTS and PackageBases.PopularityUpdated. Marks are
+held back by MARGIN seconds, so changes committed a while after their
+timestamp was taken are still picked up. Changes which touch neither
+column, such as flagging or a maintainer change, are picked up by
+periodic full runs.
+"""
+
+import heapq
+import os
+import struct
+from collections.abc import Iterable, Iterator
+from datetime import datetime
+from typing import Any, NamedTuple
+
+import orjson
+from sqlalchemy import func, or_
+
+from aurweb import db, time
+from aurweb.models import PackageBase
+
+MAGIC = b"aurweb-segment 1\n"
+
+# Record header: package base ID and number of fields.
+RECORD = struct.Struct("<QI")
+
+# Field header: field length.
+FIELD = struct.Struct("<I")
+
+# Number of seconds high-water marks are held back.
+MARGIN = 300
+
+
+class Entry(NamedTuple):
+    key: str
+    pkgbase_id: int
+    fields: tuple[bytes, ...]
+
+
+class Segment(NamedTuple):
+    state: dict[str, Any]
+    entries: Iterator[Entry]
+
+
+def high_water_marks() -> dict[str, Any]:
+    """Return the current high-water marks of package base changes."""
+    limit = time.utcnow() - MARGIN
+    modified, popularity = (
+        db.query(PackageBase)
+        .with_entities(
+            func.max(PackageBase.ModifiedTS), func.max(PackageBase.PopularityUpdated)
+        )
+        .one()
+    )
+    popularity = popularity or datetime.fromtimestamp(0)
+    return {
+        "modified": min(modified or 0, limit),
+        "popularity": min(popularity, datetime.fromtimestamp(limit)).isoformat(),
+    }
+
+
+def changed_since(state: dict[str, Any]):
+    """Return a PackageBase criterion matching bases changed since `state`."""
+    return or_(
+        PackageBase.ModifiedTS > state.get("modified"),
+        PackageBase.PopularityUpdated > datetime.fromisoformat(state.get("popularity")),
+    )
+
+
+def read(path: str) -> Segment | None:
+    """Open the segment at `path`.
+
+    :param path: Segment file path
+    :return: Segment whose entries are read lazily, or None if there is
+             no usable segment at `path`
+    """
+    try:
+        with open(path, "rb") as f:
+            if f.readline() != MAGIC:
+                return None
+            state = orjson.loads(f.readline())
+            offset = f.tell()
+    except FileNotFoundError:
+        return None
+
+    def entries() -> Iterator[Entry]:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            while header := f.read(RECORD.size):
+                pkgbase_id, count = RECORD.unpack(header)
+                fields = []
+                for _ in range(count):
+                    (length,) = FIELD.unpack(f.read(FIELD.size))
+                    fields.append(f.read(length))
+                key, *fields = fields
+                yield Entry(key.decode(), pkgbase_id, tuple(fields))
+
+    return Segment(state, entries())
+
+
+class Writer:
+    """Write a segment, replacing the one at `path` on commit()."""
+
+    def __init__(self, path: str, state: dict[str, Any]) -> None:
+        self.path = path
+        self.tmp = f"{path}.tmp"
+        self.f = open(self.tmp, "wb")
+        self.f.write(MAGIC)
+        self.f.write(orjson.dumps(state) + b"\n")
+
+    def add(self, entry: Entry) -> None:
+        f = self.f
+        f.write(RECORD.pack(entry.pkgbase_id, len(entry.fields) + 1))
+        for field in (entry.key.encode(), *entry.fields):
+            f.write(FIELD.pack(len(field)))
+            f.write(field)
+
+    def commit(self) -> None:
+        self.f.close()
+        os.replace(self.tmp, self.path)
+
+    def abort(self) -> None:
+        self.f.close()
+        os.remove(self.tmp)
+
+
+def splice(
+    old: Iterable[Entry],
+    new: Iterable[Entry],
+    changed: set[int],
+    existing: set[int],
+) -> Iterator[Entry]:
+    """Merge re-rendered entries into the entries of a previous segment.
+
+    :param old: Entries of the previous segment, sorted by key
+    :param new: Re-rendered entries, sorted by key
+    :param changed: IDs of package bases whose entries were re-rendered
+    :param existing: IDs of all package bases currently in the database
+    :return: Iterator of entries, sorted by key
+    """
+    old = (
+        entry
+        for entry in old
+        if entry.pkgbase_id not in changed and entry.pkgbase_id in existing
+    )
+    return heapq.merge(old, new, key=lambda entry: entry.key)
+
+
+def prepare(
+    path: str, options: dict[str, Any], interval: int
+) -> tuple[dict[str, Any], Segment | None]:
+    """Prepare an incremental run against the segment at `path`.
+
+    :param path: Segment file path
+    :param options: Generator options the segment must have been built with
+    :param interval: Number of seconds after which a full run is forced
+    :return: Tuple of the state of the new segment and the previous
+             segment, or None for a full run
+    """
+    now = time.utcnow()
+    state = {"options": options, **high_water_marks(), "full": now}
+
+    previous = read(path)
+    if previous:
+        prev_state = previous.state
+        if (
+            prev_state.get("options") != options
+            or now - prev_state.get("full", 0) >= interval
+        ):
+            previous = None
+        else:
+            state["full"] = prev_state.get("full")
+    return state, previous
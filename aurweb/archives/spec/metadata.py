@@ -1,8 +1,10 @@
+import os
 from collections.abc import Iterable
 
 import orjson
 
 from aurweb import config, db
+from aurweb.archives import segment
 from aurweb.models import Package, PackageBase, User
 from aurweb.rpc import RPC
 
@@ -10,6 +12,28 @@ from .base import GitInfo, SpecBase, SpecOutput
 
 ORJSON_OPTS = orjson.OPT_SORT_KEYS | orjson.OPT_INDENT_2
 
+# Segments kept in [git-archive] metadata-segmentdir.
+SEGMENTS = ("pkgname", "pkgbase")
+
+
+def fragment(name: str, data: dict) -> bytes:
+    """Render the `name` member of a JSON object as ORJSON_OPTS would."""
+    value = orjson.dumps(data, option=ORJSON_OPTS).replace(b"\n", b"\n  ")
+    return b"  " + orjson.dumps(name) + b": " + value
+
+
+def join(entries: Iterable[segment.Entry], writer: segment.Writer | None) -> bytes:
+    """Join the fragments of `entries` into a JSON object."""
+    fragments = []
+    for entry in entries:
+        fragments.append(entry.fields[0])
+        if writer:
+            writer.add(entry)
+
+    if not fragments:
+        return b"{}"
+    return b"{\n" + b",\n".join(fragments) + b"\n}"
+
 
 class Spec(SpecBase):
     def __init__(self) -> None:
@@ -17,12 +41,49 @@ class Spec(SpecBase):
             config.get("git-archive", "metadata-repo"),
         )
 
+    def prepare(self) -> tuple[dict, dict]:
+        """Prepare writers and previous segments of an incremental run.
+
+        :return: Tuple of a mapping of segment name to Writer and a
+                 mapping of segment name to previous Segment; the latter
+                 is empty for a full run
+        """
+        segmentdir = config.get("git-archive", "metadata-segmentdir")
+        if not segmentdir:
+            return {}, {}
+
+        os.makedirs(segmentdir, exist_ok=True)
+        interval = config.getint("git-archive", "metadata-full-interval")
+
+        writers, previous = {}, {}
+        for name in SEGMENTS:
+            path = os.path.join(segmentdir, f"{name}.seg")
+            state, previous[name] = segment.prepare(path, {}, interval)
+            writers[name] = segment.Writer(path, state)
+
+        # Both segments have to be spliced from the same point.
+        states = {
+            prev.state.get("full") if prev else None for prev in previous.values()
+        }
+        if len(states) != 1 or None in states:
+            previous = {}
+        return writers, previous
+
     def generate(self) -> Iterable[SpecOutput]:
+        writers, previous = self.prepare()
+        if writers:
+            print(f"performing {'an incremental' if previous else 'a full'} run")
+
+        criteria = []
+        if previous:
+            criteria.append(segment.changed_since(previous["pkgname"].state))
+
         # Base query used by the RPC.
         base_query = (
             db.query(Package)
             .join(PackageBase)
             .join(User, PackageBase.MaintainerUID == User.ID, isouter=True)
+            .filter(*criteria)
         )
 
         # Create an instance of RPC, use it to get entities from
@@ -55,7 +116,7 @@ class Spec(SpecBase):
             # Store the data in `pkgbases` dict. We do this so we only
             # end up processing a single `pkgbase` if repeated after
             # this loop
-            pkgbases[pkgbase_name] = pkgbase_data
+            pkgbases[pkgbase_name] = (package.PackageBaseID, pkgbase_data)
 
             # Remove Popularity and NumVotes from package data.
             # These fields change quite often which causes git data
@@ -68,18 +129,33 @@ class Spec(SpecBase):
 
             # Add the `package`.Name to the pkgnames set
             name = data.get("Name")
-            pkgnames[name] = data
+            pkgnames[name] = (package.PackageBaseID, data)
+
+        entries = {
+            "pkgname": pkgnames,
+            "pkgbase": pkgbases,
+        }
+        for name, items in entries.items():
+            entries[name] = [
+                segment.Entry(key, pkgbase_id, (fragment(key, data),))
+                for key, (pkgbase_id, data) in sorted(items.items())
+            ]
+
+        if previous:
+            # Splice re-rendered entries of changed package bases into
+            # the entries of the previous run.
+            changed = {row.ID for row in db.query(PackageBase.ID).filter(*criteria)}
+            existing = {row.ID for row in db.query(PackageBase.ID)}
+            for name, items in entries.items():
+                old = previous[name].entries
+                entries[name] = segment.splice(old, items, changed, existing)
 
         # Add metadata outputs
-        self.add_output(
-            "pkgname.json",
-            self.metadata_repo,
-            orjson.dumps(pkgnames, option=ORJSON_OPTS),
-        )
-        self.add_output(
-            "pkgbase.json",
-            self.metadata_repo,
-            orjson.dumps(pkgbases, option=ORJSON_OPTS),
-        )
+        for name, items in entries.items():
+            data = join(items, writers.get(name))
+            self.add_output(f"{name}.json", self.metadata_repo, data)
+
+        for writer in writers.values():
+            writer.commit()
 
         return self.outputs
@@ -0,0 +1,100 @@
+"""Compression formats archives are published in.
+
+Archives are always published gzip-compressed. Additional formats listed
+in [mkpkglists] variants are published alongside them, with the .gz
+suffix replaced by the format's suffix. Their compression modules are
+only imported when a format is enabled, and their levels are set by
+[mkpkglists] zstd-level and brotli-quality.
+"""
+
+import gzip
+from typing import BinaryIO
+
+import aurweb.config
+
+# Content types of the supported formats.
+CONTENT_TYPES = {
+    "gz": "application/gzip",
+    "zst": "application/zstd",
+    "br": "application/x-brotli",
+}
+
+
+class BrotliWriter:
+    """A minimal writable file object producing a brotli stream."""
+
+    def __init__(self, fileobj: BinaryIO) -> None:
+        import brotli
+
+        self.fileobj = fileobj
+        quality = aurweb.config.getint("mkpkglists", "brotli-quality")
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def write(self, data: bytes) -> int:
+        self.fileobj.write(self.compressor.process(data))
+        return len(data)
+
+    def close(self) -> None:
+        self.fileobj.write(self.compressor.finish())
+
+
+def _zstd(fileobj: BinaryIO):
+    import zstandard
+
+    level = aurweb.config.getint("mkpkglists", "zstd-level")
+    return zstandard.ZstdCompressor(level=level).stream_writer(fileobj, closefd=False)
+
+
+def _gzip(fileobj: BinaryIO, filename: str):
+    return gzip.GzipFile(filename=filename, mode="wb", fileobj=fileobj)
+
+
+def _supported(fmt: str) -> bool:
+    return fmt != "gz" and fmt in CONTENT_TYPES
+
+
+def enabled() -> list[str]:
+    """Return the formats archives are published in, besides gzip.
+
+    Unsupported entries of [mkpkglists] variants are skipped; mkpkglists
+    rejects them through validate() before publishing anything.
+    """
+    formats = aurweb.config.get("mkpkglists", "variants").split()
+    return [fmt for fmt in formats if _supported(fmt)]
+
+
+def validate() -> list[str]:
+    """Return the formats archives are published in, besides gzip.
+
+    :raises ValueError: If [mkpkglists] variants lists an unsupported format
+    """
+    formats = aurweb.config.get("mkpkglists", "variants").split()
+    for fmt in formats:
+        if not _supported(fmt):
+            raise ValueError(f"unsupported archive variant: {fmt}")
+    return formats
+
+
+def path(archive: str, fmt: str) -> str:
+    """Return the path of the `fmt` variant of the gzip `archive`."""
+    if fmt == "gz":
+        return archive
+    return archive.removesuffix(".gz") + f".{fmt}"
+
+
+def compressor(fmt: str, fileobj: BinaryIO, filename: str):
+    """Return a writable file object compressing into `fileobj`.
+
+    :param fmt: Compression format
+    :param fileobj: Binary file object receiving compressed data
+    :param filename: Archive path, recorded in gzip headers
+    :return: File object; closing it finishes the stream, but leaves
+             `fileobj` open
+    """
+    if fmt == "gz":
+        return _gzip(fileobj, filename)
+    elif fmt == "zst":
+        return _zstd(fileobj)
+    elif fmt == "br":
+        return BrotliWriter(fileobj)
+    raise ValueError(f"unsupported archive variant: {fmt}")
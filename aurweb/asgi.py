@@ -1,3 +1,4 @@
+import asyncio
 import hashlib
 import http
 import io
@@ -22,11 +23,12 @@ from starlette.middleware.sessions import SessionMiddleware
 import aurweb.captcha  # noqa: F401
 import aurweb.config
 import aurweb.filters  # noqa: F401
-from aurweb import aur_logging, prometheus, util
+from aurweb import aur_logging, prometheus, ratelimit, statistics, util
 from aurweb.aur_redis import redis_connection
 from aurweb.auth import BasicAuthBackend
 from aurweb.db import get_engine, query
 from aurweb.models import AcceptedTerm, Term
+from aurweb.packages.index import search_index, suggest_index
 from aurweb.packages.util import get_pkg_or_base
 from aurweb.prometheus import instrumentator
 from aurweb.routers import APP_ROUTES
@@ -39,8 +41,21 @@ session_secret = aurweb.config.get("fastapi", "session_secret")
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await app_startup()
+
+    # Statistics gauges are updated in the background when metrics
+    # are enabled, instead of on every scrape.
+    collector = None
+    interval = aurweb.config.getint("options", "metrics_update_interval")
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR", None) and interval:
+        collector = asyncio.create_task(statistics.collect_metrics(interval))
+
     yield
 
+    if collector:
+        collector.cancel()
+    if not aurweb.config.getboolean("ratelimit", "cache"):
+        ratelimit.flush()
+
 
 # Setup the FastAPI app.
 app = FastAPI(lifespan=lifespan)
@@ -112,6 +127,17 @@ async def app_startup() -> None:
     # Initialize the database engine and ORM.
     get_engine()
 
+    # Without cache, rate limit counts are written to the database by
+    # each worker in the background.
+    if not aurweb.config.getboolean("ratelimit", "cache"):
+        ratelimit.start_flusher()
+
+    # Build in-process lookup indexes ahead of the first request.
+    if index := search_index():
+        index.refresh()
+    if index := suggest_index():
+        index.maybe_refresh()
+
 
 async def internal_server_error(request: Request, exc: Exception) -> Response:
     """
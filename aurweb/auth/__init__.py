@@ -10,6 +10,7 @@ from starlette.requests import HTTPConnection
 
 import aurweb.config
 from aurweb import db, filters, l10n, time, util
+from aurweb.auth import cache
 from aurweb.models import Session, User
 from aurweb.models.account_type import ACCOUNT_TYPE_ID
 
@@ -110,18 +111,27 @@ class BasicAuthBackend(AuthenticationBackend):
 
         # If no session with sid and a LastUpdateTS now or later exists.
         now_ts = time.utcnow()
-        record = db.query(Session).filter(Session.SessionID == sid).first()
-        if not record:
-            return unauthenticated
-        elif record.LastUpdateTS < (now_ts - timeout):
+        if cached := cache.get(sid):
+            last_update_ts, user = cached
+        else:
+            record = db.query(Session).filter(Session.SessionID == sid).first()
+            if not record:
+                return unauthenticated
+            last_update_ts, user = record.LastUpdateTS, None
+
+        if last_update_ts < (now_ts - timeout):
             with db.begin():
-                db.delete_all([record])
+                db.delete_all(db.query(Session).filter(Session.SessionID == sid))
+            cache.invalidate(sids=[sid])
             return unauthenticated
 
-        # At this point, we cannot have an invalid user if the record
-        # exists, due to ForeignKey constraints in the schema upheld
-        # by mysqlclient.
-        user = db.query(User).filter(User.ID == record.UsersID).first()
+        if user is None:
+            # At this point, we cannot have an invalid user if the record
+            # exists, due to ForeignKey constraints in the schema upheld
+            # by mysqlclient.
+            user = db.query(User).filter(User.ID == record.UsersID).first()
+            cache.put(sid, last_update_ts, user)
+
         user.nonce = util.make_nonce()
         user.authenticated = True
 
@@ -0,0 +1,126 @@
+"""Cache of authenticated sessions.
+
+BasicAuthBackend.authenticate() looks up the Sessions record of the
+AURSID cookie and the Users record it belongs to on every request. Both
+are cached in Redis under the session ID for [cache]
+expiry_time_session seconds, so a cached request does not touch the
+database at all. Secrets such as password hashes are left out of the
+cache and loaded from the database when they are used.
+
+Cached sessions are dropped when their Sessions or Users records change
+through a session passed to track(): logins, logouts, password changes,
+suspensions and account edits. Code which modifies them through raw SQL
+or bulk statements has to call invalidate() itself after committing.
+"""
+
+import pickle
+
+from aurweb import config
+from aurweb.aur_redis import redis_connection
+
+KEY = "auth-session:%s"
+
+# Session ID cached for a user.
+USER_KEY = "auth-user:%d"
+
+# Session.info key holding session and user IDs modified in a transaction.
+PENDING = "auth_sessions"
+
+# Users columns which are never cached.
+SECRETS = {"Passwd", "Salt", "ResetKey", "EmailVerificationToken"}
+
+
+def expiry() -> int:
+    return config.getint("cache", "expiry_time_session")
+
+
+def get(sid: str):
+    """Return a cached session.
+
+    :param sid: Session ID
+    :return: (LastUpdateTS, User) tuple, or None if not cached
+    """
+    from sqlalchemy.orm import make_transient_to_detached
+    from sqlalchemy.orm.attributes import set_committed_value
+
+    from aurweb import db
+    from aurweb.models import User
+
+    if not expiry() or not (value := redis_connection().get(KEY % sid)):
+        return None
+
+    last_update_ts, values = pickle.loads(value)
+    user = User.__mapper__.class_manager.new_instance()
+    for key, value in values.items():
+        set_committed_value(user, key, value)
+    make_transient_to_detached(user)
+
+    # Attach the snapshot without reloading it from the database.
+    return last_update_ts, db.get_session().merge(user, load=False)
+
+
+def put(sid: str, last_update_ts: int, user) -> None:
+    """Cache the session `sid` of `user`."""
+    if not (ex := expiry()):
+        return
+
+    values = {
+        attr.key: getattr(user, attr.key)
+        for attr in user.__mapper__.column_attrs
+        if attr.key not in SECRETS
+    }
+    pipeline = redis_connection().pipeline()
+    pipeline.set(KEY % sid, pickle.dumps((last_update_ts, values)), ex=ex)
+    pipeline.set(USER_KEY % user.ID, sid, ex=ex)
+    pipeline.execute()
+
+
+def invalidate(sids=(), user_ids=()) -> None:
+    """Drop cached sessions by session ID and by user ID."""
+    redis = redis_connection()
+    keys = [KEY % sid for sid in sids if sid]
+    if user_ids := list(user_ids):
+        user_keys = [USER_KEY % user_id for user_id in user_ids]
+        keys += [KEY % sid.decode() for sid in redis.mget(user_keys) if sid]
+        keys += user_keys
+    if keys:
+        redis.delete(*keys)
+
+
+def _after_flush(session, flush_context) -> None:
+    from sqlalchemy import inspect
+
+    sids, user_ids = session.info.setdefault(PENDING, (set(), set()))
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        if getattr(instance, "__tablename__", None) not in {"Users", "Sessions"}:
+            continue
+
+        # Users and Sessions are both keyed by user ID. Avoid loading
+        # attributes of deleted or expired instances.
+        state = inspect(instance)
+        if state.identity:
+            user_ids.add(state.identity[0])
+        for sid in (
+            state.dict.get("SessionID"),
+            state.committed_state.get("SessionID"),
+        ):
+            if isinstance(sid, str):
+                sids.add(sid)
+
+
+def _after_commit(session) -> None:
+    sids, user_ids = session.info.pop(PENDING, ((), ()))
+    invalidate(sids, user_ids)
+
+
+def _after_rollback(session) -> None:
+    session.info.pop(PENDING, None)
+
+
+def track(session) -> None:
+    """Drop cached sessions whose records are modified through `session`."""
+    from sqlalchemy import event
+
+    event.listen(session, "after_flush", _after_flush)
+    event.listen(session, "after_commit", _after_commit)
+    event.listen(session, "after_rollback", _after_rollback)
@@ -1,65 +1,309 @@
+"""Cache of values computed from the database.
+
+Values are stored in Redis, shared by all workers. Those which nearly
+every request asks for, like the homepage statistics and RSS feeds, are
+also kept by each worker in a bounded LRU of [cache] local_entries
+values for up to [cache] local_ttl seconds, sparing the round-trip to
+Redis.
+
+Values about to expire are recomputed ahead of time by the worker
+which takes a lock in Redis for up to [cache] lock_timeout seconds,
+while the others keep serving the stored value, so hot values do not
+expire under load. Lookups run on the event loop and never wait for
+the lock: while a missing value is computed by another worker, a worker
+serves its own expired copy if it still has one and computes the value
+itself otherwise.
+
+Lookups are counted by the namespace of their keys, the part before
+the first colon unless given, in aurweb.prometheus.CACHE_REQUESTS and
+CACHE_SECONDS.
+"""
+
 import pickle
-from collections.abc import Callable
+import secrets
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from collections.abc import Callable, Iterable
 from typing import Any
 
 from sqlalchemy import orm
 
 from aurweb import config
 from aurweb.aur_redis import redis_connection
-from aurweb.prometheus import SEARCH_REQUESTS
+from aurweb.prometheus import CACHE_REQUESTS, CACHE_SECONDS, SEARCH_REQUESTS
 
 _redis = redis_connection()
 
+# Sorted set of the keys stored by db_ids_cache, scored by last use.
+IDS_INDEX = "search-index"
+
+LOCK_KEY = "cache-lock:%s"
+
+# Share of its expiry time before which a value is recomputed.
+REFRESH_AHEAD = 0.1
+
+
+class _LocalCache:
+    """Values recently fetched from Redis by this worker.
+
+    Expired values are kept until they are evicted, to be served while
+    another worker computes them again.
+    """
+
+    def __init__(self) -> None:
+        self._entries: OrderedDict[str, tuple[bytes, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, now: float) -> bytes | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= now:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def stale(self, key: str) -> bytes | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[0] if entry else None
+
+    def set(self, key: str, value: bytes, ttl: float, now: float) -> None:
+        size = config.getint("cache", "local_entries")
+        with self._lock:
+            self._entries[key] = (value, now + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+_local = _LocalCache()
+
+
+def clear_local() -> None:
+    """Forget the values cached by this worker."""
+    _local.clear()
+
+
+def _lock(key: str) -> str | None:
+    token = secrets.token_hex(8)
+    timeout = config.getint("cache", "lock_timeout")
+    if _redis.set(LOCK_KEY % key, token, nx=True, ex=timeout):
+        return token
+    return None
+
+
+def _unlock(key: str, token: str) -> None:
+    # Leave the lock alone if it timed out and was taken by another worker.
+    if _redis.get(LOCK_KEY % key) == token.encode():
+        _redis.delete(LOCK_KEY % key)
+
+
+def _compute(key: str, value: Callable[[], bytes], expire: int | None) -> bytes:
+    result = value()
+    store(key, result, expire)
+    return result
+
+
+def _lookup(
+    key: str, value: Callable[[], bytes], expire: int | None, local: bool
+) -> tuple[bytes, str]:
+    local_ttl = config.getint("cache", "local_ttl") if local else 0
+    now = time.time()
+    if local_ttl and (result := _local.get(key, now)) is not None:
+        return result, "local"
+
+    pipeline = _redis.pipeline()
+    pipeline.get(key)
+    pipeline.pttl(key)
+    result, pttl = pipeline.execute()
+
+    if result is not None:
+        tier = "redis"
+        ttl = pttl / 1000 if pttl > 0 else None
+        if expire and ttl is not None and ttl < expire * REFRESH_AHEAD:
+            if token := _lock(key):
+                try:
+                    result = _compute(key, value, expire)
+                finally:
+                    _unlock(key, token)
+                tier, ttl = "miss", expire
+        if local_ttl:
+            _local.set(key, result, min(local_ttl, ttl or local_ttl), now)
+        return result, tier
+
+    token = _lock(key)
+    if not token and local_ttl and (result := _local.stale(key)) is not None:
+        return result, "stale"
+
+    try:
+        result = _compute(key, value, expire)
+    finally:
+        if token:
+            _unlock(key, token)
+    if local_ttl:
+        _local.set(key, result, min(local_ttl, expire or local_ttl), now)
+    return result, "miss"
+
 
-def lambda_cache(key: str, value: Callable[[], Any], expire: int | None = None) -> list:
-    """Store and retrieve lambda results via redis cache.
+def cached(
+    key: str,
+    value: Callable[[], bytes],
+    expire: int | None = None,
+    local: bool = False,
+    namespace: str | None = None,
+) -> bytes:
+    """Store and retrieve a serialized value via the cache.
+
+    :param key: Redis key
+    :param value: Callable returning the serialized value
+    :param expire: Optional expiration in seconds
+    :param local: Whether to also keep the value in this worker
+    :param namespace: Namespace of `key` in metrics
+    :return: Serialized value
+    """
+    namespace = namespace or key.split(":", 1)[0]
+    start = time.perf_counter()
+    result, tier = _lookup(key, value, expire, local)
+    CACHE_REQUESTS.labels(namespace=namespace, cache=tier).inc()
+    CACHE_SECONDS.labels(namespace=namespace, cache=tier).observe(
+        time.perf_counter() - start
+    )
+    return result
+
+
+def store(key: str, value: bytes, expire: int | None = None) -> None:
+    """Store a serialized value regardless of the cached one, e.g. to
+    refresh it ahead of its expiry.
+
+    Workers keep serving their own copy for up to [cache] local_ttl
+    seconds.
+
+    :param key: Redis key
+    :param value: Serialized value
+    :param expire: Optional expiration in seconds
+    """
+    _redis.set(key, value, ex=expire or None)
+
+
+def lambda_cache(
+    key: str,
+    value: Callable[[], Any],
+    expire: int | None = None,
+    local: bool = False,
+    namespace: str | None = None,
+) -> Any:
+    """Store and retrieve lambda results via cache.
 
     :param key: Redis key
     :param value: Lambda callable returning the value
     :param expire: Optional expiration in seconds
+    :param local: Whether to also keep the value in this worker
+    :param namespace: Namespace of `key` in metrics
     :return: result of callable or cache
     """
-    result = _redis.get(key)
-    if result is not None:
-        return pickle.loads(result)
-
-    _redis.set(key, (pickle.dumps(result := value())), ex=expire)
-    return result
+    result = cached(key, lambda: pickle.dumps(value()), expire, local, namespace)
+    return pickle.loads(result)
 
 
-def db_count_cache(key: str, query: orm.Query, expire: int | None = None) -> int:
-    """Store and retrieve a query.count() via redis cache.
+def db_count_cache(
+    key: str,
+    query: orm.Query,
+    expire: int | None = None,
+    local: bool = False,
+    namespace: str | None = None,
+) -> int:
+    """Store and retrieve a query.count() via cache.
 
     :param key: Redis key
     :param query: SQLAlchemy ORM query
     :param expire: Optional expiration in seconds
+    :param local: Whether to also keep the count in this worker
+    :param namespace: Namespace of `key` in metrics
     :return: query.count()
     """
-    result = _redis.get(key)
-    if result is None:
-        _redis.set(key, (result := int(query.count())))
-        if expire:
-            _redis.expire(key, expire)
+    result = cached(key, lambda: b"%d" % query.count(), expire, local, namespace)
     return int(result)
 
 
-def db_query_cache(key: str, query: orm.Query, expire: int | None = None) -> list:
-    """Store and retrieve query results via redis cache.
+def db_query_cache(
+    key: str,
+    query: orm.Query,
+    expire: int | None = None,
+    local: bool = False,
+    namespace: str | None = None,
+) -> list:
+    """Store and retrieve query results via cache.
 
     :param key: Redis key
     :param query: SQLAlchemy ORM query
     :param expire: Optional expiration in seconds
+    :param local: Whether to also keep the results in this worker
+    :param namespace: Namespace of `key` in metrics
+    :return: query.all()
+    """
+    result = cached(key, lambda: pickle.dumps(query.all()), expire, local, namespace)
+    return pickle.loads(result)
+
+
+def _store_ids(key: str, ids: array, expire: int | None) -> None:
+    now = time.time()
+    pipeline = _redis.pipeline()
+    pipeline.set(key, ids.tobytes(), ex=expire)
+    pipeline.zadd(IDS_INDEX, {key: now})
+    if expire:
+        # Keys stored or used before then have expired.
+        pipeline.zremrangebyscore(IDS_INDEX, "-inf", now - expire)
+    pipeline.zcard(IDS_INDEX)
+    count = pipeline.execute()[-1]
+
+    excess = count - config.getint("cache", "max_search_entries", 50000)
+    if excess > 0:
+        evicted = [member for member, _ in _redis.zpopmin(IDS_INDEX, excess)]
+        _redis.delete(*evicted)
+
+
+def db_ids_cache(
+    key: str,
+    query: orm.Query,
+    hydrate: Callable[[list[int]], Iterable],
+    expire: int | None = None,
+) -> list:
+    """Store the IDs of query results via redis cache and retrieve their rows.
+
+    Only the ordered IDs are stored, packed as unsigned 32-bit integers.
+    On a hit, `hydrate` loads their rows at once; rows of records which
+    no longer exist are left out. At most [cache] max_search_entries
+    keys are kept, evicting the least recently used.
+
+    :param key: Redis key
+    :param query: SQLAlchemy ORM query with an ID column
+    :param hydrate: Callable returning the rows of a list of IDs in any order
+    :param expire: Optional expiration in seconds
     :return: query.all()
     """
-    result = _redis.get(key)
+    pipeline = _redis.pipeline()
+    pipeline.get(key)
+    pipeline.zadd(IDS_INDEX, {key: time.time()}, xx=True)
+    result, _ = pipeline.execute()
+
     if result is None:
         SEARCH_REQUESTS.labels(cache="miss").inc()
-        if _redis.dbsize() > config.getint("cache", "max_search_entries", 50000):
-            return query.all()
-        _redis.set(key, (result := pickle.dumps(query.all())))
-        if expire:
-            _redis.expire(key, expire)
-    else:
-        SEARCH_REQUESTS.labels(cache="hit").inc()
+        rows = query.all()
+        _store_ids(key, array("I", [row.ID for row in rows]), expire)
+        return rows
 
-    return pickle.loads(result)
+    SEARCH_REQUESTS.labels(cache="hit").inc()
+    ids = array("I")
+    ids.frombytes(result)
+    if not ids:
+        return []
+    rows = {row.ID: row for row in hydrate(ids.tolist())}
+    return [rows[id] for id in ids if id in rows]
@@ -81,6 +81,13 @@ def get_session(engine=None):
         )
         _sessions[dbname] = Session()
 
+        from aurweb.auth import cache
+        from aurweb.pkgbase import popularity, version
+
+        version.track(_sessions[dbname])
+        popularity.track(_sessions[dbname])
+        cache.track(_sessions[dbname])
+
     return _sessions.get(dbname)
 
 
@@ -370,18 +377,28 @@ class ConnectionExecutor:
     def paramstyle(self):
         return self._paramstyle
 
-    def execute(self, query, params=()):  # pragma: no cover
+    def _query(self, query):
         # TODO: SQLite support has been removed in FastAPI. It remains
         # here to fund its support for the Sharness testsuite.
         if self._paramstyle in ("format", "pyformat"):
-            query = query.replace("%", "%%").replace("?", "%s")
+            return query.replace("%", "%%").replace("?", "%s")
         elif self._paramstyle == "qmark":
-            pass
-        else:
-            raise ValueError("unsupported paramstyle")
+            return query
+        raise ValueError("unsupported paramstyle")
 
+    def execute(self, query, params=()):  # pragma: no cover
         cur = self._conn.cursor()
-        cur.execute(query, params)
+        cur.execute(self._query(query), params)
+
+        return cur
+
+    def executemany(self, query, params):
+        """Execute `query` once for each parameter sequence in `params`.
+
+        MySQLdb sends INSERT statements as a single multi-row INSERT.
+        """
+        cur = self._conn.cursor()
+        cur.executemany(self._query(query), params)
 
         return cur
 
@@ -433,6 +450,9 @@ class Connection:
     def execute(self, query, params=()):
         return self._conn.execute(query, params)
 
+    def executemany(self, query, params):
+        return self._conn.executemany(query, params)
+
     def commit(self) -> None:
         self._conn.commit()
 
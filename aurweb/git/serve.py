@@ -3,15 +3,15 @@
 import os
 import re
 import shlex
-import subprocess
 import sys
 import time
 
 import aurweb.config
 import aurweb.db
 import aurweb.exceptions
-
-notify_cmd = aurweb.config.get("notifications", "notify-cmd")
+import aurweb.outbox
+import aurweb.pkgbase.popularity
+import aurweb.pkgbase.version
 
 repo_path = aurweb.config.get("serve", "repo-path")
 repo_regex = aurweb.config.get("serve", "repo-regex")
@@ -105,17 +105,9 @@ def pkgreq_open_adoption(pkgbase_id, pkgbase, userid):
     reqid = cur.lastrowid
     conn.commit()
     conn.close()
+    aurweb.pkgbase.version.bump(pkgbase_id)
 
-    subprocess.run(
-        (
-            notify_cmd,
-            "request-open",
-            str(userid),
-            str(reqid),
-            "adoption",
-            str(pkgbase_id),
-        )
-    )
+    aurweb.outbox.notify("request-open", userid, reqid, "adoption", pkgbase_id)
 
     return reqid
 
@@ -211,9 +203,7 @@ def pkgbase_set_comaintainers(pkgbase, userlist, user, privileged):
                 + "VALUES (?, ?, ?)",
                 [pkgbase_id, userid, i],
             )
-            subprocess.run(
-                (notify_cmd, "comaintainer-add", str(userid), str(pkgbase_id))
-            )
+            aurweb.outbox.notify("comaintainer-add", userid, pkgbase_id)
         else:
             cur = conn.execute(
                 "UPDATE PackageComaintainers "
@@ -229,12 +219,11 @@ def pkgbase_set_comaintainers(pkgbase, userlist, user, privileged):
             + "WHERE PackageBaseID = ? AND UsersID = ?",
             [pkgbase_id, userid],
         )
-        subprocess.run(
-            (notify_cmd, "comaintainer-remove", str(userid), str(pkgbase_id))
-        )
+        aurweb.outbox.notify("comaintainer-remove", userid, pkgbase_id)
 
     conn.commit()
     conn.close()
+    aurweb.pkgbase.version.bump(pkgbase_id)
 
 
 def pkgreq_by_pkgbase(pkgbase_id, reqtype):
@@ -269,6 +258,11 @@ def pkgreq_close(reqid, user, reason, comments, autoclose=False):
         if userid == 0:
             raise aurweb.exceptions.InvalidUserException(user)
 
+    cur = conn.execute(
+        "SELECT PackageBaseID FROM PackageRequests WHERE ID = ?", [reqid]
+    )
+    pkgbase_id = cur.fetchone()[0]
+
     now = int(time.time())
     conn.execute(
         "UPDATE PackageRequests SET Status = ?, ClosedTS = ?, "
@@ -278,10 +272,11 @@ def pkgreq_close(reqid, user, reason, comments, autoclose=False):
     )
     conn.commit()
     conn.close()
+    aurweb.pkgbase.version.bump(pkgbase_id)
 
     if not userid:
         userid = 0
-    subprocess.run((notify_cmd, "request-close", str(userid), str(reqid), reason))
+    aurweb.outbox.notify("request-close", userid, reqid, reason)
 
 
 def pkgbase_disown(pkgbase, user, privileged):
@@ -324,13 +319,14 @@ def pkgbase_disown(pkgbase, user, privileged):
     )
 
     conn.commit()
+    aurweb.pkgbase.version.bump(pkgbase_id)
 
     cur = conn.execute("SELECT ID FROM Users WHERE Username = ?", [user])
     userid = cur.fetchone()[0]
     if userid == 0:
         raise aurweb.exceptions.InvalidUserException(user)
 
-    subprocess.run((notify_cmd, "disown", str(userid), str(pkgbase_id)))
+    aurweb.outbox.notify("disown", userid, pkgbase_id)
 
     conn.close()
 
@@ -358,8 +354,9 @@ def pkgbase_flag(pkgbase, user, comment):
     )
 
     conn.commit()
+    aurweb.pkgbase.version.bump(pkgbase_id)
 
-    subprocess.run((notify_cmd, "flag", str(userid), str(pkgbase_id)))
+    aurweb.outbox.notify("flag", userid, pkgbase_id)
 
 
 def pkgbase_unflag(pkgbase, user):
@@ -386,6 +383,7 @@ def pkgbase_unflag(pkgbase, user):
         )
 
     conn.commit()
+    aurweb.pkgbase.version.bump(pkgbase_id)
 
 
 def pkgbase_vote(pkgbase, user):
@@ -414,11 +412,11 @@ def pkgbase_vote(pkgbase, user):
         + "VALUES (?, ?, ?)",
         [userid, pkgbase_id, now],
     )
-    conn.execute(
-        "UPDATE PackageBases SET NumVotes = NumVotes + 1 " + "WHERE ID = ?",
-        [pkgbase_id],
+    aurweb.pkgbase.popularity.update_votes(
+        conn, pkgbase_id, 1, aurweb.pkgbase.popularity.weight(now), now
     )
     conn.commit()
+    aurweb.pkgbase.version.bump(pkgbase_id)
 
 
 def pkgbase_unvote(pkgbase, user):
@@ -434,22 +432,24 @@ def pkgbase_unvote(pkgbase, user):
         raise aurweb.exceptions.InvalidUserException(user)
 
     cur = conn.execute(
-        "SELECT COUNT(*) FROM PackageVotes "
-        + "WHERE UsersID = ? AND PackageBaseID = ?",
+        "SELECT VoteTS FROM PackageVotes " + "WHERE UsersID = ? AND PackageBaseID = ?",
         [userid, pkgbase_id],
     )
-    if cur.fetchone()[0] == 0:
+    row = cur.fetchone()
+    if not row:
         raise aurweb.exceptions.NotVotedException(pkgbase)
+    vote_ts = row[0]
 
+    now = int(time.time())
     conn.execute(
         "DELETE FROM PackageVotes WHERE UsersID = ? AND " + "PackageBaseID = ?",
         [userid, pkgbase_id],
     )
-    conn.execute(
-        "UPDATE PackageBases SET NumVotes = NumVotes - 1 " + "WHERE ID = ?",
-        [pkgbase_id],
+    aurweb.pkgbase.popularity.update_votes(
+        conn, pkgbase_id, -1, -aurweb.pkgbase.popularity.weight(vote_ts), now
     )
     conn.commit()
+    aurweb.pkgbase.version.bump(pkgbase_id)
 
 
 def pkgbase_set_keywords(pkgbase, keywords):
@@ -468,6 +468,7 @@ def pkgbase_set_keywords(pkgbase, keywords):
 
     conn.commit()
     conn.close()
+    aurweb.pkgbase.version.bump(pkgbase_id)
 
 
 def pkgbase_has_write_access(pkgbase, user):
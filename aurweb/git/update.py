@@ -21,11 +21,16 @@ from alpm.type_aliases import RelationOrSoname, SourceInfo
 
 import aurweb.config
 import aurweb.db
+import aurweb.pkgbase.version
 from aurweb.git.update_common import (
+    PackageInfo,
     create_pkgbase,
     die,
     die_commit,
+    get_pkgnames,
+    save_packages,
     update_notify,
+    update_pkgnames,
     validate_blob_size,
     warn,
 )
@@ -96,7 +101,7 @@ def sql_architecture(arch: Architecture) -> str | None:
     return None if arch.is_any else str(arch)
 
 
-def save_metadata(metadata: SourceInfo, conn, user):  # noqa: C901
+def save_metadata(metadata: SourceInfo, conn, user):
     # Obtain package base ID and previous maintainer.
     cur = conn.execute(
         "SELECT ID, MaintainerUID FROM PackageBases WHERE Name = ?",
@@ -109,7 +114,7 @@ def save_metadata(metadata: SourceInfo, conn, user):  # noqa: C901
     cur = conn.execute("SELECT ID FROM Users WHERE Username = ?", [user])
     user_id = int(cur.fetchone()[0])
 
-    # Update package base details and delete current packages.
+    # Update package base details.
     now = int(time.time())
     conn.execute(
         "UPDATE PackageBases SET ModifiedTS = ?, "
@@ -121,42 +126,24 @@ def save_metadata(metadata: SourceInfo, conn, user):  # noqa: C901
         + "WHERE ID = ? AND MaintainerUID IS NULL",
         [user_id, pkgbase_id],
     )
-    for table in ("Sources", "Depends", "Relations", "Licenses", "Groups"):
-        conn.execute(
-            "DELETE FROM Package"
-            + table
-            + " WHERE EXISTS ("
-            + "SELECT * FROM Packages "
-            + "WHERE Packages.PackageBaseID = ? AND "
-            + "Package"
-            + table
-            + ".PackageID = Packages.ID)",
-            [pkgbase_id],
-        )
-    conn.execute("DELETE FROM Packages WHERE PackageBaseID = ?", [pkgbase_id])
-
     version: str = str(metadata.base.version)
 
+    packages = []
     for package in metadata.packages:
         # Architecture doesn't matter here, as we are only reading
         # non-arch-specific fields from merged_pkg.
         merged_pkg = MergedPackage(Architecture(), metadata.base, package)
-
-        # Create a new package.
-        cur = conn.execute(
-            "INSERT INTO Packages (PackageBaseID, Name, "
-            + "Version, Description, URL) "
-            + "VALUES (?, ?, ?, ?, ?)",
-            [
-                pkgbase_id,
-                merged_pkg.name,
-                version,
-                merged_pkg.description,
-                str(merged_pkg.url),
-            ],
+        info = PackageInfo(
+            name=merged_pkg.name,
+            version=version,
+            description=merged_pkg.description,
+            url=str(merged_pkg.url),
+            sources=[],
+            depends=[],
+            relations=[],
+            licenses=[],
+            groups=[],
         )
-        conn.commit()
-        pkgid = cur.lastrowid
 
         for arch in metadata.base.architectures:
             # Arch-specific merged_pkg
@@ -164,11 +151,7 @@ def save_metadata(metadata: SourceInfo, conn, user):  # noqa: C901
 
             # Add package sources.
             for merged_source in merged_pkg.sources:
-                conn.execute(
-                    "INSERT INTO PackageSources (PackageID, Source, "
-                    + "SourceArch) VALUES (?, ?, ?)",
-                    [pkgid, str(merged_source.source), sql_architecture(arch)],
-                )
+                info.sources.append((str(merged_source.source), sql_architecture(arch)))
 
             # Add package dependencies.
             dependency_groups: dict[str, list[GenericRelation]] = {
@@ -178,24 +161,15 @@ def save_metadata(metadata: SourceInfo, conn, user):  # noqa: C901
                 "optdepends": merged_pkg.optional_dependencies,
             }
             for deptype, dependencies in dependency_groups.items():
-                cur = conn.execute(
-                    "SELECT ID FROM DependencyTypes WHERE Name = ?", [deptype]
-                )
-                deptypeid = cur.fetchone()[0]
-
                 for dep in dependencies:
-                    conn.execute(
-                        "INSERT INTO PackageDepends (PackageID, "
-                        + "DepTypeID, DepName, DepDesc, DepCondition, "
-                        + "DepArch) VALUES (?, ?, ?, ?, ?, ?)",
-                        [
-                            pkgid,
-                            deptypeid,
+                    info.depends.append(
+                        (
+                            deptype,
                             sql_rel_name(dep),
                             sql_rel_description(dep),
                             sql_rel_requirement(dep),
                             sql_architecture(arch),
-                        ],
+                        )
                     )
 
             # Add package relations (conflicts, provides, replaces).
@@ -205,55 +179,22 @@ def save_metadata(metadata: SourceInfo, conn, user):  # noqa: C901
                 "replaces": merged_pkg.replaces,
             }
             for reltype, relations in relation_groups.items():
-                cur = conn.execute(
-                    "SELECT ID FROM RelationTypes WHERE Name = ?", [reltype]
-                )
-                reltypeid = cur.fetchone()[0]
                 for rel in relations:
-                    conn.execute(
-                        "INSERT INTO PackageRelations (PackageID, "
-                        + "RelTypeID, RelName, RelCondition, RelArch) "
-                        + "VALUES (?, ?, ?, ?, ?)",
-                        [
-                            pkgid,
-                            reltypeid,
+                    info.relations.append(
+                        (
+                            reltype,
                             sql_rel_name(rel),
                             sql_rel_requirement(rel),
                             sql_architecture(arch),
-                        ],
+                        )
                     )
 
-        # Add package licenses.
-        for lic in merged_pkg.licenses:
-            cur = conn.execute("SELECT ID FROM Licenses WHERE Name = ?", [str(lic)])
-            row = cur.fetchone()
-            if row:
-                licenseid = row[0]
-            else:
-                cur = conn.execute(
-                    "INSERT INTO Licenses (Name) " + "VALUES (?)", [str(lic)]
-                )
-                conn.commit()
-                licenseid = cur.lastrowid
-            conn.execute(
-                "INSERT INTO PackageLicenses (PackageID, " + "LicenseID) VALUES (?, ?)",
-                [pkgid, licenseid],
-            )
+        # Add package licenses and groups.
+        info.licenses.extend(str(lic) for lic in merged_pkg.licenses)
+        info.groups.extend(merged_pkg.groups)
+        packages.append(info)
 
-        # Add package groups.
-        for group in merged_pkg.groups:
-            cur = conn.execute("SELECT ID FROM `Groups` WHERE Name = ?", [group])
-            row = cur.fetchone()
-            if row:
-                groupid = row[0]
-            else:
-                cur = conn.execute("INSERT INTO `Groups` (Name) VALUES (?)", [group])
-                conn.commit()
-                groupid = cur.lastrowid
-            conn.execute(
-                "INSERT INTO PackageGroups (PackageID, GroupID) VALUES (?, ?)",
-                [pkgid, groupid],
-            )
+    save_packages(conn, pkgbase_id, packages)
 
     # Add user to notification list on adoption.
     if was_orphan:
@@ -507,6 +448,7 @@ def main() -> None:  # noqa: C901
         pkgbase_id = create_pkgbase(conn, pkgbase.name, user)
 
     # Store package base details in the database.
+    old_pkgnames = get_pkgnames(conn, pkgbase_id)
     save_metadata(metadata, conn, user)
 
     # Create (or update) a branch with the name of the package base for better
@@ -522,6 +464,10 @@ def main() -> None:  # noqa: C901
     headref = "refs/namespaces/" + pkgbase.name + "/HEAD"
     repo.create_reference(headref, sha1_new, True)
 
+    # Let web workers know about the update once the push is complete.
+    update_pkgnames(conn, pkgbase_id, old_pkgnames)
+    aurweb.pkgbase.version.bump(pkgbase_id)
+
     # Send package update notifications.
     update_notify(conn, user, pkgbase_id)
 
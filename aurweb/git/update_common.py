@@ -1,14 +1,14 @@
 """Common logic for both legacy and new git update hook."""
 
-import subprocess
 import sys
 import time
+from collections import Counter, defaultdict
+from typing import NamedTuple
 
 import pygit2
 
 import aurweb.config
-
-notify_cmd = aurweb.config.get("notifications", "notify-cmd")
+import aurweb.outbox
 
 max_blob_size = aurweb.config.getint("update", "max-blob-size")
 
@@ -47,13 +47,202 @@ def create_pkgbase(conn, pkgbase, user):
     return pkgbase_id
 
 
+# Columns of package detail tables, excluding PackageID.
+DETAIL_COLUMNS = {
+    "PackageSources": ("Source", "SourceArch"),
+    "PackageDepends": ("DepTypeID", "DepName", "DepDesc", "DepCondition", "DepArch"),
+    "PackageRelations": ("RelTypeID", "RelName", "RelCondition", "RelArch"),
+    "PackageLicenses": ("LicenseID",),
+    "PackageGroups": ("GroupID",),
+}
+
+
+class PackageInfo(NamedTuple):
+    """Package details parsed from .SRCINFO, as stored by save_packages()."""
+
+    name: str
+    version: str
+    description: str | None
+    url: str | None
+    # (source, arch) tuples.
+    sources: list[tuple]
+    # (type, name, description, condition, arch) tuples.
+    depends: list[tuple]
+    # (type, name, condition, arch) tuples.
+    relations: list[tuple]
+    licenses: list[str]
+    groups: list[str]
+
+
+def _placeholders(values) -> str:
+    return ", ".join("?" for _ in values)
+
+
+def _type_ids(conn, table):
+    cur = conn.execute(f"SELECT Name, ID FROM {table}")
+    return dict(cur.fetchall())
+
+
+def _name_ids(conn, table, names):
+    """Return IDs of `names` in the Licenses or Groups `table`, creating
+    missing records."""
+    names = sorted(set(names))
+    if not names:
+        return {}
+
+    cur = conn.execute(
+        f"SELECT Name, ID FROM {table} WHERE Name IN ({_placeholders(names)})",
+        names,
+    )
+    ids = dict(cur.fetchall())
+
+    # Names may also match existing records which differ in case only.
+    for name in names:
+        if name in ids:
+            continue
+        cur = conn.execute(f"SELECT ID FROM {table} WHERE Name = ?", [name])
+        row = cur.fetchone()
+        if row:
+            ids[name] = row[0]
+        else:
+            cur = conn.execute(f"INSERT INTO {table} (Name) VALUES (?)", [name])
+            ids[name] = cur.lastrowid
+    return ids
+
+
+def _save_details(conn, table, old_ids, rows):
+    """Store the detail `rows` of packages in `table`.
+
+    Only packages whose rows changed are rewritten.
+
+    :param conn: Database connection
+    :param table: Detail table name, see DETAIL_COLUMNS
+    :param old_ids: IDs of packages which were stored before
+    :param rows: Mapping of package ID to a Counter of row tuples
+    """
+    columns = DETAIL_COLUMNS[table]
+    old = defaultdict(Counter)
+    if old_ids:
+        cur = conn.execute(
+            f"SELECT PackageID, {', '.join(columns)} FROM {table} "
+            f"WHERE PackageID IN ({_placeholders(old_ids)})",
+            list(old_ids),
+        )
+        for pkgid, *row in cur.fetchall():
+            old[pkgid][tuple(row)] += 1
+
+    changed = [pkgid for pkgid in rows if old[pkgid] != rows[pkgid]]
+    deleted = [(pkgid,) for pkgid in changed if old[pkgid]]
+    if deleted:
+        conn.executemany(f"DELETE FROM {table} WHERE PackageID = ?", deleted)
+
+    inserted = [(pkgid, *row) for pkgid in changed for row in rows[pkgid].elements()]
+    if inserted:
+        conn.executemany(
+            f"INSERT INTO {table} (PackageID, {', '.join(columns)}) "
+            f"VALUES (?, {_placeholders(columns)})",
+            inserted,
+        )
+
+
+def save_packages(conn, pkgbase_id, packages):
+    """Store `packages` as the packages of the package base `pkgbase_id`.
+
+    Existing records are diffed against `packages`, so records of
+    unchanged packages are left alone, keeping lock contention to a
+    minimum. The caller has to commit.
+
+    :param conn: Database connection
+    :param pkgbase_id: Package base ID
+    :param packages: List of PackageInfo
+    """
+    cur = conn.execute(
+        "SELECT Name, ID, Version, Description, URL FROM Packages "
+        + "WHERE PackageBaseID = ?",
+        [pkgbase_id],
+    )
+    old = {name: (pkgid, tuple(fields)) for name, pkgid, *fields in cur.fetchall()}
+    new = {package.name: package for package in packages}
+
+    # Remove packages which are gone, along with their details.
+    removed = [(old[name][0],) for name in old.keys() - new.keys()]
+    if removed:
+        for table in DETAIL_COLUMNS:
+            conn.executemany(f"DELETE FROM {table} WHERE PackageID = ?", removed)
+        conn.executemany("DELETE FROM Packages WHERE ID = ?", removed)
+
+    # Update changed packages and create new ones.
+    ids, updated = {}, []
+    for package in new.values():
+        fields = (package.version, package.description, package.url)
+        if package.name in old:
+            pkgid, old_fields = old[package.name]
+            if old_fields != fields:
+                updated.append((*fields, pkgid))
+        else:
+            cur = conn.execute(
+                "INSERT INTO Packages (PackageBaseID, Name, "
+                + "Version, Description, URL) "
+                + "VALUES (?, ?, ?, ?, ?)",
+                [pkgbase_id, package.name, *fields],
+            )
+            pkgid = cur.lastrowid
+        ids[package.name] = pkgid
+    if updated:
+        conn.executemany(
+            "UPDATE Packages SET Version = ?, Description = ?, URL = ? "
+            + "WHERE ID = ?",
+            updated,
+        )
+
+    deptypes = _type_ids(conn, "DependencyTypes")
+    reltypes = _type_ids(conn, "RelationTypes")
+    licenses = _name_ids(conn, "Licenses", (x for p in packages for x in p.licenses))
+    groups = _name_ids(conn, "`Groups`", (x for p in packages for x in p.groups))
+
+    rows = {table: {} for table in DETAIL_COLUMNS}
+    for package in new.values():
+        pkgid = ids[package.name]
+        rows["PackageSources"][pkgid] = Counter(package.sources)
+        rows["PackageDepends"][pkgid] = Counter(
+            (deptypes[type_], *dep) for type_, *dep in package.depends
+        )
+        rows["PackageRelations"][pkgid] = Counter(
+            (reltypes[type_], *rel) for type_, *rel in package.relations
+        )
+        rows["PackageLicenses"][pkgid] = Counter(
+            {(licenses[name],) for name in package.licenses}
+        )
+        rows["PackageGroups"][pkgid] = Counter(
+            {(groups[name],) for name in package.groups}
+        )
+
+    old_ids = [pkgid for name, (pkgid, _) in old.items() if name in new]
+    for table, table_rows in rows.items():
+        _save_details(conn, table, old_ids, table_rows)
+
+
+def get_pkgnames(conn, pkgbase_id):
+    cur = conn.execute(
+        "SELECT Name FROM Packages WHERE PackageBaseID = ?", [pkgbase_id]
+    )
+    return {row[0] for row in cur.fetchall()}
+
+
+def update_pkgnames(conn, pkgbase_id, old_pkgnames):
+    # Let web workers reload their suggestions if names were added or removed.
+    if get_pkgnames(conn, pkgbase_id) != old_pkgnames:
+        from aurweb.packages.index import bump_generation
+
+        bump_generation()
+
+
 def update_notify(conn, user, pkgbase_id):
     # Obtain the user ID of the new maintainer.
     cur = conn.execute("SELECT ID FROM Users WHERE Username = ?", [user])
     user_id = int(cur.fetchone()[0])
 
-    # Execute the notification script.
-    subprocess.run((notify_cmd, "update", str(user_id), str(pkgbase_id)))
+    aurweb.outbox.notify("update", user_id, pkgbase_id)
 
 
 def die(msg):
@@ -11,11 +11,16 @@ import srcinfo.utils
 
 import aurweb.config
 import aurweb.db
+import aurweb.pkgbase.version
 from aurweb.git.update_common import (
+    PackageInfo,
     create_pkgbase,
     die,
     die_commit,
+    get_pkgnames,
+    save_packages,
     update_notify,
+    update_pkgnames,
     validate_blob_size,
     warn,
 )
@@ -49,7 +54,7 @@ def parse_dep(depstring):
     return depname, desc, depcond
 
 
-def save_metadata(metadata, conn, user):  # noqa: C901
+def save_metadata(metadata, conn, user):
     # Obtain package base ID and previous maintainer.
     pkgbase = metadata["pkgbase"]
     cur = conn.execute(
@@ -62,7 +67,7 @@ def save_metadata(metadata, conn, user):  # noqa: C901
     cur = conn.execute("SELECT ID FROM Users WHERE Username = ?", [user])
     user_id = int(cur.fetchone()[0])
 
-    # Update package base details and delete current packages.
+    # Update package base details.
     now = int(time.time())
     conn.execute(
         "UPDATE PackageBases SET ModifiedTS = ?, "
@@ -74,20 +79,7 @@ def save_metadata(metadata, conn, user):  # noqa: C901
         + "WHERE ID = ? AND MaintainerUID IS NULL",
         [user_id, pkgbase_id],
     )
-    for table in ("Sources", "Depends", "Relations", "Licenses", "Groups"):
-        conn.execute(
-            "DELETE FROM Package"
-            + table
-            + " WHERE EXISTS ("
-            + "SELECT * FROM Packages "
-            + "WHERE Packages.PackageBaseID = ? AND "
-            + "Package"
-            + table
-            + ".PackageID = Packages.ID)",
-            [pkgbase_id],
-        )
-    conn.execute("DELETE FROM Packages WHERE PackageBaseID = ?", [pkgbase_id])
-
+    packages = []
     for pkgname in srcinfo.utils.get_package_names(metadata):
         pkginfo = srcinfo.utils.get_merged_package(pkgname, metadata)
 
@@ -98,94 +90,39 @@ def save_metadata(metadata, conn, user):  # noqa: C901
         else:
             ver = "{:s}-{:s}".format(pkginfo["pkgver"], pkginfo["pkgrel"])
 
-        for field in ("pkgdesc", "url"):
-            if field not in pkginfo:
-                pkginfo[field] = None
-
-        # Create a new package.
-        cur = conn.execute(
-            "INSERT INTO Packages (PackageBaseID, Name, "
-            + "Version, Description, URL) "
-            + "VALUES (?, ?, ?, ?, ?)",
-            [pkgbase_id, pkginfo["pkgname"], ver, pkginfo["pkgdesc"], pkginfo["url"]],
+        info = PackageInfo(
+            name=pkginfo["pkgname"],
+            version=ver,
+            description=pkginfo.get("pkgdesc"),
+            url=pkginfo.get("url"),
+            sources=[],
+            depends=[],
+            relations=[],
+            licenses=pkginfo.get("license", []),
+            groups=pkginfo.get("groups", []),
         )
-        conn.commit()
-        pkgid = cur.lastrowid
 
         # Add package sources.
         for source_info in extract_arch_fields(pkginfo, "source"):
-            conn.execute(
-                "INSERT INTO PackageSources (PackageID, Source, "
-                + "SourceArch) VALUES (?, ?, ?)",
-                [pkgid, source_info["value"], source_info["arch"]],
-            )
+            info.sources.append((source_info["value"], source_info["arch"]))
 
         # Add package dependencies.
         for deptype in ("depends", "makedepends", "checkdepends", "optdepends"):
-            cur = conn.execute(
-                "SELECT ID FROM DependencyTypes WHERE Name = ?", [deptype]
-            )
-            deptypeid = cur.fetchone()[0]
             for dep_info in extract_arch_fields(pkginfo, deptype):
                 depname, depdesc, depcond = parse_dep(dep_info["value"])
                 deparch = dep_info["arch"]
-                conn.execute(
-                    "INSERT INTO PackageDepends (PackageID, "
-                    + "DepTypeID, DepName, DepDesc, DepCondition, "
-                    + "DepArch) VALUES (?, ?, ?, ?, ?, ?)",
-                    [pkgid, deptypeid, depname, depdesc, depcond, deparch],
-                )
+                info.depends.append((deptype, depname, depdesc, depcond, deparch))
 
         # Add package relations (conflicts, provides, replaces).
         for reltype in ("conflicts", "provides", "replaces"):
-            cur = conn.execute("SELECT ID FROM RelationTypes WHERE Name = ?", [reltype])
-            reltypeid = cur.fetchone()[0]
             for rel_info in extract_arch_fields(pkginfo, reltype):
                 relname, _, relcond = parse_dep(rel_info["value"])
                 relarch = rel_info["arch"]
-                conn.execute(
-                    "INSERT INTO PackageRelations (PackageID, "
-                    + "RelTypeID, RelName, RelCondition, RelArch) "
-                    + "VALUES (?, ?, ?, ?, ?)",
-                    [pkgid, reltypeid, relname, relcond, relarch],
-                )
+                info.relations.append((reltype, relname, relcond, relarch))
 
-        # Add package licenses.
-        if "license" in pkginfo:
-            for license in pkginfo["license"]:
-                cur = conn.execute("SELECT ID FROM Licenses WHERE Name = ?", [license])
-                row = cur.fetchone()
-                if row:
-                    licenseid = row[0]
-                else:
-                    cur = conn.execute(
-                        "INSERT INTO Licenses (Name) " + "VALUES (?)", [license]
-                    )
-                    conn.commit()
-                    licenseid = cur.lastrowid
-                conn.execute(
-                    "INSERT INTO PackageLicenses (PackageID, "
-                    + "LicenseID) VALUES (?, ?)",
-                    [pkgid, licenseid],
-                )
+        packages.append(info)
 
-        # Add package groups.
-        if "groups" in pkginfo:
-            for group in pkginfo["groups"]:
-                cur = conn.execute("SELECT ID FROM `Groups` WHERE Name = ?", [group])
-                row = cur.fetchone()
-                if row:
-                    groupid = row[0]
-                else:
-                    cur = conn.execute(
-                        "INSERT INTO `Groups` (Name) VALUES (?)", [group]
-                    )
-                    conn.commit()
-                    groupid = cur.lastrowid
-                conn.execute(
-                    "INSERT INTO PackageGroups (PackageID, GroupID) VALUES (?, ?)",
-                    [pkgid, groupid],
-                )
+    save_packages(conn, pkgbase_id, packages)
 
     # Add user to notification list on adoption.
     if was_orphan:
@@ -449,6 +386,7 @@ def main() -> None:  # noqa: C901
         pkgbase_id = create_pkgbase(conn, pkgbase, user)
 
     # Store package base details in the database.
+    old_pkgnames = get_pkgnames(conn, pkgbase_id)
     save_metadata(metadata, conn, user)
 
     # Create (or update) a branch with the name of the package base for better
@@ -464,6 +402,10 @@ def main() -> None:  # noqa: C901
     headref = "refs/namespaces/" + pkgbase + "/HEAD"
     repo.create_reference(headref, sha1_new, True)
 
+    # Let web workers know about the update once the push is complete.
+    update_pkgnames(conn, pkgbase_id, old_pkgnames)
+    aurweb.pkgbase.version.bump(pkgbase_id)
+
     # Send package update notifications.
     update_notify(conn, user, pkgbase_id)
 
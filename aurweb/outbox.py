@@ -0,0 +1,222 @@
+"""Durable queue of outgoing notifications.
+
+With [notifications] queue enabled, Notification.send() and send_all()
+store notifications in the NotificationQueue table instead of delivering
+them, and the git hooks enqueue their notify-cmd actions rather than
+running it. aurweb-notify-worker delivers queued notifications.
+
+Rows hold the class name of a notification in Type and JSON in Payload:
+either a list of constructor arguments, resolved by the worker, or the
+attributes of a notification already resolved by its producer. The web
+application uses the latter, as its notifications may refer to records
+which are deleted right after they are sent. Notifications carrying
+secrets, such as password reset keys and verification tokens, are
+queued with their constructor arguments instead (see
+Notification.get_args()), so the secrets never end up in the queue.
+
+A worker claims rows by setting ClaimToken and moving AvailableTS to the
+end of a lease, so any number of workers can run at once; rows claimed
+by a worker which dies become available again once their lease ends.
+Delivered rows are deleted. Failed rows are retried with exponential
+backoff and kept with Failed set after [notifications]
+queue-max-attempts attempts.
+
+Delivery is at least once: a notification which fails after some of its
+messages were sent is sent in full again.
+"""
+
+import json
+import secrets
+import subprocess
+
+from sqlalchemy import and_, delete, insert, select, update
+
+from aurweb import config, db, schema, time
+
+NotificationQueue = schema.NotificationQueue
+
+
+def enabled() -> bool:
+    return config.getboolean("notifications", "queue")
+
+
+def _row(type_: str, payload) -> dict:
+    return {
+        "Type": type_,
+        "Payload": json.dumps(payload),
+        "AvailableTS": time.utcnow(),
+    }
+
+
+def _payload(notification):
+    args = notification.get_args()
+    return vars(notification) if args is None else args
+
+
+def enqueue(notifications) -> None:
+    """Queue resolved `notifications`.
+
+    The rows are inserted in the current transaction of the session, if
+    any, and committed right away otherwise.
+    """
+    rows = [_row(type(n).__name__, _payload(n)) for n in notifications]
+    if not rows:
+        return
+
+    session = db.get_session()
+    if session.in_transaction():
+        session.execute(insert(NotificationQueue), rows)
+    else:
+        with db.begin():
+            session.execute(insert(NotificationQueue), rows)
+
+
+def notify(action: str, *args) -> None:
+    """Send the notify-cmd `action` with `args`.
+
+    Used by the git hooks. With the queue enabled, the action is queued
+    through a database connection of its own instead of running
+    notify-cmd.
+    """
+    args = [str(arg) for arg in args]
+    if not enabled():
+        subprocess.run((config.get("notifications", "notify-cmd"), action, *args))
+        return
+
+    from aurweb.scripts.notify import ACTIONS
+
+    row = _row(ACTIONS[action].__name__, args)
+    conn = db.Connection()
+    conn.execute(
+        "INSERT INTO NotificationQueue (Type, Payload, AvailableTS) "
+        + "VALUES (?, ?, ?)",
+        [row["Type"], row["Payload"], row["AvailableTS"]],
+    )
+    conn.commit()
+    conn.close()
+
+
+def resolve(type_: str, payload: str):
+    """Return the notification of a queued row.
+
+    Constructor arguments are resolved against the database, so this
+    has to be called within a transaction.
+    """
+    from aurweb.scripts import notify
+
+    cls = getattr(notify, type_, None)
+    if not isinstance(cls, type) or not issubclass(cls, notify.Notification):
+        raise ValueError(f"Unknown notification type: {type_}")
+
+    value = json.loads(payload)
+    if isinstance(value, list):
+        return cls(*value)
+    return cls.from_attrs(value)
+
+
+def _available(now: int):
+    return and_(NotificationQueue.c.Failed == 0, NotificationQueue.c.AvailableTS <= now)
+
+
+def claim(limit: int) -> tuple[str, list]:
+    """Claim up to `limit` available rows, oldest first.
+
+    :return: (claim token, list of rows)
+    """
+    now = time.utcnow()
+    lease = config.getint("notifications", "queue-lease")
+    token = secrets.token_hex(16)
+
+    with db.begin():
+        session = db.get_session()
+        ids = [
+            row.ID
+            for row in session.execute(
+                select(NotificationQueue.c.ID)
+                .where(_available(now))
+                .order_by(NotificationQueue.c.ID)
+                .limit(limit)
+            )
+        ]
+        if not ids:
+            return token, []
+
+        # Rows claimed by another worker in the meantime no longer match.
+        session.execute(
+            update(NotificationQueue)
+            .where(and_(NotificationQueue.c.ID.in_(ids), _available(now)))
+            .values(
+                ClaimToken=token,
+                AvailableTS=now + lease,
+                Attempts=NotificationQueue.c.Attempts + 1,
+            )
+        )
+        rows = session.execute(
+            select(NotificationQueue)
+            .where(NotificationQueue.c.ClaimToken == token)
+            .order_by(NotificationQueue.c.ID)
+        ).fetchall()
+
+    return token, rows
+
+
+def complete(token: str, ids: list[int]) -> None:
+    """Remove delivered rows `ids` claimed with `token`."""
+    if not ids:
+        return
+
+    with db.begin():
+        db.get_session().execute(
+            delete(NotificationQueue).where(
+                and_(
+                    NotificationQueue.c.ID.in_(ids),
+                    NotificationQueue.c.ClaimToken == token,
+                )
+            )
+        )
+
+
+def fail(token: str, failures: list[tuple]) -> None:
+    """Release failed rows claimed with `token` for a later attempt.
+
+    :param failures: List of (row, error message) tuples
+    """
+    if not failures:
+        return
+
+    now = time.utcnow()
+    delay = config.getint("notifications", "queue-retry-delay")
+    max_attempts = config.getint("notifications", "queue-max-attempts")
+
+    with db.begin():
+        session = db.get_session()
+        for row, error in failures:
+            values = {"ClaimToken": None, "Error": error}
+            if row.Attempts >= max_attempts:
+                values["Failed"] = 1
+            else:
+                values["AvailableTS"] = now + delay * 2 ** (row.Attempts - 1)
+            session.execute(
+                update(NotificationQueue)
+                .where(
+                    and_(
+                        NotificationQueue.c.ID == row.ID,
+                        NotificationQueue.c.ClaimToken == token,
+                    )
+                )
+                .values(**values)
+            )
+
+
+def requeue_failed() -> int:
+    """Make failed rows available again.
+
+    :return: Number of rows requeued
+    """
+    with db.begin():
+        result = db.get_session().execute(
+            update(NotificationQueue)
+            .where(NotificationQueue.c.Failed == 1)
+            .values(Failed=0, Attempts=0, AvailableTS=time.utcnow())
+        )
+    return result.rowcount
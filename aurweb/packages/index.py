@@ -0,0 +1,362 @@
+"""In-process package lookup indexes.
+
+These indexes are built per worker from the Packages and PackageBases
+tables so that high-volume RPC lookups can be answered without a full
+table scan, or without touching the database at all.
+
+The search index is refreshed incrementally by following the high-water
+mark of PackageBases.ModifiedTS, which is bumped on every git push. The
+mark is held back by MARGIN seconds so that pushes which commit after a
+newer one has been indexed are still picked up. Bases which no longer
+exist are pruned when a refresh sees the generation counter stored in
+Redis change, or at least every [rpc] search_index_prune_interval
+seconds. The index only ever narrows down candidate IDs; the database
+remains the source of truth for the final search results.
+
+The suggest index is reloaded whenever the generation counter changes.
+The counter is bumped by every mutation which adds or removes package
+or package base names.
+"""
+
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
+
+from redis.exceptions import RedisError
+
+from aurweb import aur_logging, config, db
+from aurweb.aur_redis import redis_connection
+from aurweb.models import Package, PackageBase
+
+logger = aur_logging.get_logger(__name__)
+
+# Characters which carry special meaning in SQL LIKE patterns. Keywords
+# containing them cannot be answered by plain substring matching.
+LIKE_SPECIAL = frozenset("%_\\")
+
+# Redis key of the package name generation counter.
+GENERATION_KEY = "pkgnames-generation"
+
+# Number of seconds the search index high-water mark is held back.
+MARGIN = 300
+
+# Maximum number of names returned by suggest lookups.
+SUGGEST_LIMIT = 20
+
+
+def bump_generation() -> None:
+    """Signal all workers that the set of package names has changed.
+
+    Redis errors are logged; workers then pick up the change once their
+    suggest index reaches [rpc] suggest_index_max_age and their search
+    index reaches [rpc] search_index_prune_interval.
+    """
+    try:
+        redis_connection().incr(GENERATION_KEY)
+    except RedisError:
+        logger.exception("Unable to bump the package name generation.")
+
+
+def get_generation() -> bytes | None:
+    """Return the package name generation counter, or None if unknown."""
+    try:
+        return redis_connection().get(GENERATION_KEY)
+    except RedisError:
+        logger.exception("Unable to read the package name generation.")
+        return None
+
+
+def normalize(text: str | None) -> str:
+    """Fold `text` for case and accent insensitive matching.
+
+    This loosely mirrors the utf8mb4_general_ci collation used by the
+    database, so the index yields a superset of what LIKE would match.
+
+    :param text: Text to normalize
+    :return: Lowercased `text` stripped of combining characters
+    """
+    if not text:
+        return str()
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def trigrams(text: str) -> set[str]:
+    """Return the set of three-character substrings of `text`."""
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    """A trigram inverted index over normalized text keyed by ID."""
+
+    def __init__(self) -> None:
+        self._postings: dict[str, set[int]] = defaultdict(set)
+        self._text: dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._text)
+
+    def add(self, id: int, text: str | None) -> None:
+        self.remove(id)
+        text = normalize(text)
+        self._text[id] = text
+        for trigram in trigrams(text):
+            self._postings[trigram].add(id)
+
+    def remove(self, id: int) -> None:
+        text = self._text.pop(id, None)
+        if text is None:
+            return
+        for trigram in trigrams(text):
+            postings = self._postings[trigram]
+            postings.discard(id)
+            if not postings:
+                del self._postings[trigram]
+
+    def search(self, keywords: str) -> set[int] | None:
+        """Return IDs whose text contains `keywords`.
+
+        :param keywords: Substring to search for
+        :return: Set of matching IDs, or None if `keywords` cannot be
+                 answered by the index
+        """
+        keywords = normalize(keywords)
+        if len(keywords) < 3 or LIKE_SPECIAL.intersection(keywords):
+            return None
+
+        postings = []
+        for trigram in trigrams(keywords):
+            if trigram not in self._postings:
+                return set()
+            postings.append(self._postings[trigram])
+        postings.sort(key=len)
+
+        candidates = postings[0].intersection(*postings[1:])
+        return {id for id in candidates if keywords in self._text[id]}
+
+
+class PackageSearchIndex:
+    """Name and description trigram indexes of all packages."""
+
+    def __init__(self) -> None:
+        self.names = TrigramIndex()
+        self.descriptions = TrigramIndex()
+
+        # PackageBase.ID -> {Package.ID, ...}
+        self._pkgbases: dict[int, set[int]] = defaultdict(set)
+
+        # Highest PackageBase.ModifiedTS seen so far.
+        self.modified = 0
+
+        # Generation counter value and time of the last prune.
+        self.generation = None
+        self._pruned = None
+
+        self._refreshed = None
+        self._lock = threading.Lock()
+
+    def _update(self, rows) -> None:
+        by_pkgbase = defaultdict(list)
+        for row in rows:
+            by_pkgbase[row.PackageBaseID].append(row)
+            self.modified = max(self.modified, row.ModifiedTS)
+
+        for pkgbase_id, packages in by_pkgbase.items():
+            # A push recreates all packages of a base, so drop the
+            # previous generation before indexing the new one.
+            for id in self._pkgbases.pop(pkgbase_id, set()):
+                self.names.remove(id)
+                self.descriptions.remove(id)
+
+            for pkg in packages:
+                self.names.add(pkg.ID, pkg.Name)
+                self.descriptions.add(pkg.ID, pkg.Description)
+                self._pkgbases[pkgbase_id].add(pkg.ID)
+
+    def _prune(self) -> None:
+        pkgbase_ids = {
+            row.ID for row in db.query(PackageBase).with_entities(PackageBase.ID)
+        }
+        for pkgbase_id in set(self._pkgbases) - pkgbase_ids:
+            for id in self._pkgbases.pop(pkgbase_id):
+                self.names.remove(id)
+                self.descriptions.remove(id)
+
+    def refresh(self) -> None:
+        """Index packages of bases modified since the last refresh."""
+        with self._lock:
+            rows = (
+                db.query(Package)
+                .join(PackageBase)
+                .filter(PackageBase.ModifiedTS >= self.modified - MARGIN)
+                .with_entities(
+                    Package.ID,
+                    Package.Name,
+                    Package.Description,
+                    Package.PackageBaseID,
+                    PackageBase.ModifiedTS,
+                )
+                .all()
+            )
+            now = time.monotonic()
+            generation = get_generation()
+            interval = config.getint("rpc", "search_index_prune_interval")
+            # The first refresh indexes everything, so it needs no prune.
+            # After that, deletions bump the generation; the interval
+            # covers those which could not reach Redis.
+            if self._pruned is None:
+                self._pruned = now
+            elif generation != self.generation or now - self._pruned >= interval:
+                self._prune()
+                self._pruned = now
+            self.generation = generation
+            self._update(rows)
+            self._refreshed = now
+        logger.debug("Refreshed search index with %d packages.", len(rows))
+
+    def maybe_refresh(self) -> None:
+        interval = config.getint("rpc", "search_index_refresh")
+        if self._refreshed is None or time.monotonic() - self._refreshed >= interval:
+            self.refresh()
+
+    def search(self, by: str, keywords: str) -> set[int] | None:
+        """Return candidate Package IDs for a name or name-desc search.
+
+        :param by: RPC `by` alias; "n" or "nd"
+        :param keywords: Search keywords
+        :return: Set of candidate Package IDs, or None if the index
+                 cannot answer this search
+        """
+        self.maybe_refresh()
+
+        ids = self.names.search(keywords)
+        if ids is None or by == "n":
+            return ids
+        return ids | self.descriptions.search(keywords)
+
+
+class PrefixIndex:
+    """A sorted array of names answering prefix lookups by bisection.
+
+    Names are ordered the way the utf8mb4_general_ci collation orders
+    them, so lookups match `LIKE 'prefix%' ORDER BY Name`.
+    """
+
+    def __init__(self, names: list[str]) -> None:
+        names = sorted(names, key=str.upper)
+        self._keys = [name.upper() for name in names]
+        self._names = names
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def lookup(self, prefix: str, limit: int = SUGGEST_LIMIT) -> list[str] | None:
+        """Return up to `limit` names starting with `prefix`.
+
+        :param prefix: Name prefix
+        :param limit: Maximum number of names returned
+        :return: List of names, or None if `prefix` cannot be answered
+                 by the index
+        """
+        if LIKE_SPECIAL.intersection(prefix):
+            return None
+
+        prefix = prefix.upper()
+        start = bisect_left(self._keys, prefix)
+        end = start
+        while (
+            end < len(self._keys)
+            and end - start < limit
+            and self._keys[end].startswith(prefix)
+        ):
+            end += 1
+        return self._names[start:end]
+
+
+class SuggestIndex:
+    """Package and package base names used for RPC suggestions."""
+
+    def __init__(self) -> None:
+        self.packages = PrefixIndex([])
+        self.pkgbases = PrefixIndex([])
+
+        # Generation counter value the indexes were built at.
+        self.generation = None
+
+        self._checked = None
+        self._refreshed = None
+        self._lock = threading.Lock()
+
+    def refresh(self, generation: bytes | None = None) -> None:
+        """Reload all names from the database."""
+        with self._lock:
+            packages = db.query(Package).join(PackageBase).with_entities(Package.Name)
+            pkgbases = db.query(PackageBase).with_entities(PackageBase.Name)
+            self.packages = PrefixIndex([row.Name for row in packages])
+            self.pkgbases = PrefixIndex([row.Name for row in pkgbases])
+            self.generation = generation
+            self._refreshed = time.monotonic()
+        logger.debug("Refreshed suggest index with %d packages.", len(self.packages))
+
+    def maybe_refresh(self) -> None:
+        now = time.monotonic()
+        interval = config.getint("rpc", "suggest_index_refresh")
+        if self._checked is not None and now - self._checked < interval:
+            return
+        self._checked = now
+
+        # Reload if names changed, or if our copy is older than max_age;
+        # the latter covers mutations which could not reach Redis.
+        generation = redis_connection().get(GENERATION_KEY)
+        max_age = config.getint("rpc", "suggest_index_max_age")
+        if (
+            self._refreshed is None
+            or generation != self.generation
+            or now - self._refreshed >= max_age
+        ):
+            self.refresh(generation)
+
+    def suggest(self, prefix: str) -> list[str] | None:
+        self.maybe_refresh()
+        return self.packages.lookup(prefix)
+
+    def suggest_pkgbase(self, prefix: str) -> list[str] | None:
+        self.maybe_refresh()
+        return self.pkgbases.lookup(prefix)
+
+
+_search_index = None
+_suggest_index = None
+
+
+def search_index() -> PackageSearchIndex | None:
+    """Return this worker's PackageSearchIndex, or None if disabled."""
+    global _search_index
+
+    if not config.getboolean("rpc", "search_index"):
+        return None
+
+    if _search_index is None:
+        _search_index = PackageSearchIndex()
+    return _search_index
+
+
+def suggest_index() -> SuggestIndex | None:
+    """Return this worker's SuggestIndex, or None if disabled."""
+    global _suggest_index
+
+    if not config.getboolean("rpc", "suggest_index"):
+        return None
+
+    if _suggest_index is None:
+        _suggest_index = SuggestIndex()
+    return _suggest_index
+
+
+def reset() -> None:
+    """Drop this worker's indexes; they are rebuilt on next use."""
+    global _search_index, _suggest_index
+    _search_index = None
+    _suggest_index = None
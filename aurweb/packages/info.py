@@ -0,0 +1,87 @@
+"""Store of serialized RPC info documents.
+
+Documents are kept in Redis under the name of the package they describe
+and are tagged with the version of their package base they were built
+at (see aurweb.pkgbase.version). A document is only served while that
+version is still current; otherwise it is rebuilt from the database by
+the RPC and stored again.
+"""
+
+import calendar
+from collections.abc import Iterable
+from datetime import datetime
+from typing import NamedTuple
+
+from aurweb import config
+from aurweb.aur_redis import redis_connection
+from aurweb.pkgbase import version
+
+KEY = "rpc-info:%s"
+
+
+class Document(NamedTuple):
+    ID: int
+    PackageBaseID: int
+    version: int
+    data: bytes
+
+    def dumps(self) -> bytes:
+        header = b"%d %d %d\n" % (self.ID, self.PackageBaseID, self.version)
+        return header + self.data
+
+    @classmethod
+    def loads(cls, value: bytes) -> "Document":
+        header, data = value.split(b"\n", 1)
+        return cls(*map(int, header.split()), data)
+
+
+def get(names: Iterable[str]) -> dict[str, Document]:
+    """Return up-to-date stored documents of packages named `names`.
+
+    :param names: Package names
+    :return: Mapping of package name to Document; names without an
+             up-to-date document are left out
+    """
+    names = list(names)
+    if not names:
+        return {}
+
+    values = redis_connection().mget([KEY % name for name in names])
+    docs = {name: Document.loads(value) for name, value in zip(names, values) if value}
+
+    current = version.get(doc.PackageBaseID for doc in docs.values())
+    return {
+        name: doc
+        for name, doc in docs.items()
+        if doc.version == current[doc.PackageBaseID]
+    }
+
+
+def ttl(popularity_updated: datetime, now: int) -> int:
+    """Return the number of seconds to keep a document.
+
+    Popularity decays in steps of a day since its last update, so the
+    document expires when the next step is due, or after [rpc]
+    info_store_ttl seconds, whichever comes first.
+
+    :param popularity_updated: Naive UTC PackageBases.PopularityUpdated
+    :param now: Current UTC timestamp
+    :return: Number of seconds
+    """
+    elapsed = now - calendar.timegm(popularity_updated.utctimetuple())
+    return min(config.getint("rpc", "info_store_ttl"), 86400 - elapsed % 86400)
+
+
+def put(docs: dict[str, tuple[Document, int]]) -> None:
+    """Store documents.
+
+    :param docs: Mapping of package name to a (Document, ttl) tuple,
+                 where ttl is the number of seconds to keep it
+    """
+    if not docs:
+        return
+
+    pipeline = redis_connection().pipeline()
+    for name, (doc, ttl) in docs.items():
+        pipeline.set(KEY % name, doc.dumps(), ex=ttl)
+    pipeline.execute()
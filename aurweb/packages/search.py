@@ -1,8 +1,10 @@
+import hashlib
 from typing import Set
 
+import orjson
 from sqlalchemy import and_, case, or_, orm
 
-from aurweb import db, models
+from aurweb import config, db, models
 from aurweb.models import Group, Package, PackageBase, User
 from aurweb.models.dependency_type import (
     CHECKDEPENDS_ID,
@@ -16,6 +18,7 @@ from aurweb.models.package_keyword import PackageKeyword
 from aurweb.models.package_notification import PackageNotification
 from aurweb.models.package_vote import PackageVote
 from aurweb.models.relation_type import CONFLICTS_ID, PROVIDES_ID, REPLACES_ID
+from aurweb.packages.index import search_index
 
 
 class PackageSearch:
@@ -76,6 +79,11 @@ class PackageSearch:
         self._joined_keywords = False
         self._joined_comaint = False
 
+        # Normalized parameters applied so far, see cache_key().
+        self._terms = set()
+        self._filters = set()
+        self._sort = None
+
     def _join_user(self, outer: bool = True) -> orm.Query:
         """Centralized joining of a package base's maintainer."""
         if not self._joined_user:
@@ -184,6 +192,9 @@ class PackageSearch:
     def search_by(self, search_by: str, keywords: str) -> orm.Query:
         if search_by not in self.search_by_cb:
             search_by = "nd"  # Default: Name, Description
+        # Keyword filters are ANDed, so their order does not matter.
+        term = sorted(keywords) if isinstance(keywords, set) else keywords
+        self._terms.add(orjson.dumps([search_by, term]))
         callback = self.search_by_cb.get(search_by)
         result = callback(keywords)
         return result
@@ -246,9 +257,49 @@ class PackageSearch:
         callback = self.sort_by_cb.get(sort_by)
         if ordering not in self.FULL_SORT_ORDER:
             ordering = "d"  # Default: Descending
+        self._sort = [sort_by, ordering]
+        if sort_by in ("w", "o"):
+            # Ordered by the user's votes or notifications.
+            self._sort.append(self.user.ID)
         ordering = self.FULL_SORT_ORDER.get(ordering)
         return callback(ordering)
 
+    def filter_outdated(self, outdated: bool) -> "PackageSearch":
+        """Only match packages which are (not) flagged out-of-date."""
+        self._filters.add("outdated" if outdated else "current")
+        if outdated:
+            self.query = self.query.filter(PackageBase.OutOfDateTS.isnot(None))
+        else:
+            self.query = self.query.filter(PackageBase.OutOfDateTS.is_(None))
+        return self
+
+    def filter_ids(self, ids: list[int]) -> "PackageSearch":
+        """Only match packages with IDs `ids`."""
+        self._join_user()
+        self.query = self.query.filter(Package.ID.in_(ids))
+        return self
+
+    def filter_orphans(self) -> "PackageSearch":
+        """Only match packages without a maintainer."""
+        self._filters.add("orphans")
+        self.query = self.query.filter(PackageBase.MaintainerUID.is_(None))
+        return self
+
+    def cache_key(self, *args) -> str:
+        """Return a cache key for the query built so far.
+
+        The key is derived from the normalized search parameters, which
+        is much cheaper than compiling the query's SQL (see
+        aurweb.util.hash_query). Queries built from equivalent
+        parameters share their key.
+
+        :param args: Other JSON-serializable values the results depend on
+        :return: Cache key
+        """
+        terms = b",".join(sorted(self._terms))
+        params = [sorted(self._filters), self._sort, *args]
+        return "search:" + hashlib.sha1(terms + orjson.dumps(params)).hexdigest()
+
     def count(self) -> int:
         """Return internal query's count."""
         return self.query.count()
@@ -333,6 +384,33 @@ class RPCSearch(PackageSearch):
         self.query = self.query.join(PackageGroup).join(Group)
         return self.query
 
+    def _restrict_to_index(self, by: str, keywords: str) -> "RPCSearch":
+        """Narrow a LIKE search down to the candidates found in the
+        in-process search index, if it is enabled and can answer it.
+
+        Common keywords can match a large share of all packages; their
+        candidates are not passed on, as a long ID list would cost more
+        than the LIKE scan it replaces.
+
+        :param by: RPC `by` alias; "n" or "nd"
+        :param keywords: RPC `arg` argument
+        :returns: self
+        """
+        index = search_index()
+        ids = index.search(by, keywords) if index else None
+        limit = config.getint("rpc", "search_index_max_candidates")
+        if ids is not None and len(ids) <= limit:
+            self.query = self.query.filter(Package.ID.in_(sorted(ids)))
+        return self
+
+    def _search_by_namedesc(self, keywords: str) -> "RPCSearch":
+        super()._search_by_namedesc(keywords)
+        return self._restrict_to_index("nd", keywords)
+
+    def _search_by_name(self, keywords: str) -> "RPCSearch":
+        super()._search_by_name(keywords)
+        return self._restrict_to_index("n", keywords)
+
     def _search_by_depends(self, keywords: str) -> "RPCSearch":
         self.query = self._join_depends(DEPENDS_ID).filter(
             models.PackageDependency.DepName == keywords
@@ -8,7 +8,7 @@ from fastapi import HTTPException
 from sqlalchemy import and_, literal, orm
 
 from aurweb import config, db, models
-from aurweb.aur_redis import redis_connection
+from aurweb.cache import cached
 from aurweb.models import Package
 from aurweb.models.official_provider import OFFICIAL_BASE, OfficialProvider
 from aurweb.models.package_dependency import PackageDependency
@@ -128,39 +128,34 @@ def updated_packages(limit: int = 0, cache_ttl: int = 600) -> list[models.Packag
     :param cache_ttl: Cache expiration time (in seconds)
     :return: A list of Packages
     """
-    redis = redis_connection()
-    packages = redis.get("package_updates")
-    if packages:
-        # If we already have a cache, deserialize it and return.
-        return orjson.loads(packages)
 
-    query = (
-        db.query(models.Package)
-        .join(models.PackageBase)
-        .order_by(models.PackageBase.ModifiedTS.desc())
-    )
-
-    if limit:
-        query = query.limit(limit)
-
-    packages = []
-    for pkg in query:
-        # For each Package returned by the query, append a dict
-        # containing Package columns we're interested in.
-        packages.append(
-            {
-                "Name": pkg.Name,
-                "Version": pkg.Version,
-                "PackageBase": {"ModifiedTS": pkg.PackageBase.ModifiedTS},
-            }
+    def value() -> bytes:
+        query = (
+            db.query(models.Package)
+            .join(models.PackageBase)
+            .order_by(models.PackageBase.ModifiedTS.desc())
         )
 
-    # Store the JSON serialization of the package_updates key into Redis.
-    redis.set("package_updates", orjson.dumps(packages))
-    redis.expire("package_updates", cache_ttl)
+        if limit:
+            query = query.limit(limit)
+
+        packages = []
+        for pkg in query:
+            # For each Package returned by the query, append a dict
+            # containing Package columns we're interested in.
+            packages.append(
+                {
+                    "Name": pkg.Name,
+                    "Version": pkg.Version,
+                    "PackageBase": {"ModifiedTS": pkg.PackageBase.ModifiedTS},
+                }
+            )
+
+        # Store the JSON serialization of the packages in the cache.
+        return orjson.dumps(packages)
 
     # Return the deserialized list of packages.
-    return packages
+    return orjson.loads(cached("package_updates", value, cache_ttl, local=True))
 
 
 def query_voted(query: list[models.Package], user: models.User) -> dict[int, bool]:
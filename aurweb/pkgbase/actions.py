@@ -1,7 +1,7 @@
 from fastapi import Request
 from sqlalchemy import and_
 
-from aurweb import aur_logging, db, time, util
+from aurweb import aur_logging, db, time
 from aurweb.auth import creds
 from aurweb.models import PackageBase, PackageRequest, User
 from aurweb.models.package_comaintainer import PackageComaintainer
@@ -14,9 +14,10 @@ from aurweb.models.request_type import (
     MERGE_ID,
     ORPHAN_ID,
 )
+from aurweb.packages.index import bump_generation
 from aurweb.packages.requests import handle_request, update_closure_comment
 from aurweb.pkgbase import util as pkgbaseutil
-from aurweb.scripts import notify, popupdate
+from aurweb.scripts import notify
 
 logger = aur_logging.get_logger(__name__)
 
@@ -115,7 +116,7 @@ def pkgbase_disown_instance(request: Request, pkgbase: PackageBase) -> None:
     disowner = request.user
     notifs = [notify.DisownNotification(disowner.ID, pkgbase.ID)]
     notifs += _retry_disown(request, pkgbase)
-    util.apply_all(notifs, lambda n: n.send())
+    notify.send_all(notifs)
 
 
 @db.retry_deadlock
@@ -156,7 +157,7 @@ def pkgbase_adopt_instance(
         _retry_adopt(pkgbase, new_maintainer)
         notifs = handle_request(request, ADOPTION_ID, pkgbase, accept_ids=accept_ids)
         notifs.append(notify.AdoptNotification(new_maintainer.ID, pkgbase.ID))
-        util.apply_all(notifs, lambda n: n.send())
+        notify.send_all(notifs)
         return
 
     pending = pkgbase.requests.filter(
@@ -188,6 +189,7 @@ def pkgbase_delete_instance(
     notifs = handle_request(request, DELETION_ID, pkgbase, comments=comments) + [notif]
 
     _retry_delete(pkgbase, comments)
+    bump_generation()
 
     return notifs
 
@@ -214,9 +216,6 @@ def _retry_merge(pkgbase: PackageBase, target: PackageBase) -> None:
             if vote.UsersID not in target_votes:
                 vote.PackageBase = target
 
-    # Run popupdate.
-    popupdate.run_single(target)
-
     with db.begin():
         # Delete pkgbase and its packages now that everything's merged.
         for pkg in pkgbase.packages:
@@ -236,6 +235,7 @@ def pkgbase_merge_instance(
     notifs = handle_request(request, MERGE_ID, pkgbase, target, comments)
 
     _retry_merge(pkgbase, target)
+    bump_generation()
 
     # Log this out for accountability purposes.
     logger.info(
@@ -246,4 +246,4 @@ def pkgbase_merge_instance(
     )
 
     # Send notifications.
-    util.apply_all(notifs, lambda n: n.send())
+    notify.send_all(notifs)
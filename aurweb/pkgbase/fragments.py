@@ -0,0 +1,86 @@
+"""Cache of rendered package base page fragments.
+
+Parts of the package and package base pages which look the same to
+every viewer in a language and timezone are rendered once and stored in
+Redis. Their keys include the fragment's template, package base ID,
+language, timezone and any other arguments it depends on. A stored
+fragment is tagged with the version of its package base (see
+aurweb.pkgbase.version) and the package name generation (see
+aurweb.packages.index) at the time it was rendered. It is only served
+while both are unchanged.
+
+Fragments also depend on data which neither counter tracks: dependants
+and providers in other package bases, and popularity decaying over
+time. They are therefore cached for at most [cache]
+expiry_time_fragment seconds.
+"""
+
+import hashlib
+from collections.abc import Callable
+from typing import Any
+
+import orjson
+from fastapi import Request
+
+from aurweb import config
+from aurweb.aur_redis import redis_connection
+from aurweb.packages.index import GENERATION_KEY
+from aurweb.pkgbase import version
+from aurweb.prometheus import FRAGMENT_REQUESTS
+from aurweb.templates import render_raw_template
+
+KEY = "pkgbase-fragment:%s"
+
+
+def expiry() -> int:
+    return config.getint("cache", "expiry_time_fragment")
+
+
+def render(
+    request: Request,
+    template: str,
+    context: dict[str, Any],
+    pkgbase_id: int,
+    *args,
+    update: Callable[[dict[str, Any]], None] | None = None,
+) -> str:
+    """Return `template` rendered with `context`.
+
+    :param request: FastAPI request
+    :param template: Path of the fragment's template
+    :param context: Template context
+    :param pkgbase_id: ID of the package base the fragment shows
+    :param args: Other JSON-serializable values the fragment depends on
+    :param update: Callable adding the values only `template` needs to
+                   `context`; only called when it has to be rendered
+    :return: Rendered fragment, to be included with the safe filter
+    """
+
+    def _render() -> str:
+        if update:
+            update(context)
+        return render_raw_template(request, template, context)
+
+    if not (ex := expiry()):
+        return _render()
+
+    name = [template, pkgbase_id, context["language"], context["timezone"], *args]
+    key = KEY % hashlib.sha1(orjson.dumps(name)).hexdigest()
+    redis = redis_connection()
+    value, current, generation = redis.mget(
+        [key, version.KEY % pkgbase_id, GENERATION_KEY]
+    )
+
+    tag = b"%d %d" % (int(current or 0), int(generation or 0))
+    if value is not None:
+        header, html = value.split(b"\n", 1)
+        if header == tag:
+            FRAGMENT_REQUESTS.labels(cache="hit").inc()
+            return html.decode()
+
+    FRAGMENT_REQUESTS.labels(cache="miss").inc()
+    html = _render()
+    # The tag was read before rendering; should the package base change
+    # in the meantime, the fragment is stale on its next lookup.
+    redis.set(key, tag + b"\n" + html.encode(), ex=ex)
+    return html
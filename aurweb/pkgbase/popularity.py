@@ -0,0 +1,323 @@
+"""Incremental package base popularity.
+
+The popularity of a package base is the sum of the weights of its votes,
+where a vote cast at VoteTS weighs DECAY ** ((now - VoteTS) / DAY).
+Since all weights decay by the same factor, each package base stores its
+score at the fixed reference time EPOCH in PackageBases.PopularityScore:
+
+    Popularity(now) = PopularityScore * factor(now)
+
+A vote adds its reference-time weight, see weight(), to the score and an
+unvote subtracts it, so no other votes ever have to be read. Popularity
+is rescaled from the score whenever votes change, and by popupdate for
+package bases whose popularity has not been updated in a while.
+
+ORM vote changes are picked up automatically once a session has been
+passed to track(). Code which modifies votes through raw SQL, such as
+the git serve hook, has to call update_votes() itself.
+"""
+
+from collections import defaultdict
+from collections.abc import Callable, Iterator
+from datetime import datetime
+from time import perf_counter
+
+from sqlalchemy import and_, case, func, true, update
+from sqlalchemy.sql.functions import coalesce
+from sqlalchemy.sql.functions import sum as _sum
+
+from aurweb import aur_logging, config, db, schema, time
+from aurweb.pkgbase import version
+
+logger = aur_logging.get_logger(__name__)
+
+# Daily decay of vote weights.
+DECAY = 0.98
+
+DAY = 86400
+
+# Reference time of popularity scores, 2020-01-01T00:00:00Z. Scores grow
+# by 1 / DECAY a day; doubles hold them well beyond the year 2100.
+EPOCH = 1577836800
+
+# Relative difference tolerated by check().
+TOLERANCE = 1e-6
+
+PackageBases = schema.PackageBases
+PackageVotes = schema.PackageVotes
+
+
+def weight(vote_ts: int) -> float:
+    """Return the reference-time weight of a vote cast at `vote_ts`."""
+    return DECAY ** ((EPOCH - vote_ts) / DAY)
+
+
+def factor(now: int) -> float:
+    """Return the factor scaling reference-time scores to `now`."""
+    return DECAY ** ((now - EPOCH) / DAY)
+
+
+def _rescaled(score, factor_: float):
+    # Scores of package bases which lost their last vote may be left
+    # with a tiny negative rounding error.
+    return case([(score > 0, score * factor_)], else_=0)
+
+
+def _adjust(pkgbase_id: int, votes: int, score: float, now: int):
+    remaining = PackageBases.c.NumVotes + votes > 0
+    new_score = PackageBases.c.PopularityScore + score
+    # Values are assigned in order; MySQL evaluates each expression
+    # against the columns assigned before it.
+    return (
+        update(PackageBases)
+        .where(PackageBases.c.ID == pkgbase_id)
+        .ordered_values(
+            (
+                PackageBases.c.Popularity,
+                case([(remaining, _rescaled(new_score, factor(now)))], else_=0),
+            ),
+            (PackageBases.c.PopularityScore, case([(remaining, new_score)], else_=0)),
+            (PackageBases.c.NumVotes, PackageBases.c.NumVotes + votes),
+            (PackageBases.c.PopularityUpdated, datetime.fromtimestamp(now)),
+        )
+    )
+
+
+# Raw SQL equivalent of _adjust() for aurweb.db.Connection.
+UPDATE_VOTES = (
+    "UPDATE PackageBases SET "
+    + "Popularity = CASE WHEN NumVotes + ? > 0 AND PopularityScore + ? > 0 "
+    + "THEN (PopularityScore + ?) * ? ELSE 0 END, "
+    + "PopularityScore = CASE WHEN NumVotes + ? > 0 "
+    + "THEN PopularityScore + ? ELSE 0 END, "
+    + "NumVotes = NumVotes + ?, PopularityUpdated = ? WHERE ID = ?"
+)
+
+
+def update_votes(conn, pkgbase_id: int, votes: int, score: float, now: int) -> None:
+    """Apply vote changes made through a raw database connection.
+
+    :param conn: aurweb.db.Connection
+    :param pkgbase_id: Package base ID
+    :param votes: Number of votes added, negative for removed votes
+    :param score: Sum of weight() of added votes, minus that of removed votes
+    :param now: Current UTC timestamp
+    """
+    conn.execute(
+        UPDATE_VOTES,
+        [votes, score, score, factor(now), votes, score, votes]
+        + [datetime.fromtimestamp(now), pkgbase_id],
+    )
+
+
+def _votes_subquery():
+    return (
+        db.get_session()
+        .query(func.count("*"))
+        .select_from(PackageVotes)
+        .filter(PackageVotes.c.PackageBaseID == PackageBases.c.ID)
+    )
+
+
+def _popularity_subquery(now: int):
+    return (
+        db.get_session()
+        .query(
+            coalesce(_sum(func.pow(DECAY, (now - PackageVotes.c.VoteTS) / DAY)), 0.0)
+        )
+        .select_from(PackageVotes)
+        .filter(
+            and_(
+                PackageVotes.c.PackageBaseID == PackageBases.c.ID,
+                PackageVotes.c.VoteTS.isnot(None),
+            )
+        )
+    )
+
+
+def _recompute_values(now: int) -> dict:
+    popularity = _popularity_subquery(now).scalar_subquery()
+    return {
+        "NumVotes": _votes_subquery().scalar_subquery(),
+        "Popularity": popularity,
+        # VoteTS is unsigned; derive the score from the popularity now
+        # rather than subtracting it from EPOCH.
+        "PopularityScore": popularity / factor(now),
+        "PopularityUpdated": datetime.fromtimestamp(now),
+    }
+
+
+def _rescale_values(now: int) -> dict:
+    return {
+        "Popularity": _rescaled(PackageBases.c.PopularityScore, factor(now)),
+        "PopularityUpdated": datetime.fromtimestamp(now),
+    }
+
+
+def recompute(pkgbase_ids: set[int], now: int) -> None:
+    """Recompute votes and popularity of `pkgbase_ids` from their votes.
+
+    The caller has to bump the versions of `pkgbase_ids`.
+    """
+    with db.begin():
+        db.get_session().execute(
+            update(PackageBases)
+            .where(PackageBases.c.ID.in_(pkgbase_ids))
+            .values(**_recompute_values(now))
+        )
+
+
+def _chunks(chunk_size: int) -> Iterator[tuple[int, int]]:
+    low, high = (
+        db.get_session()
+        .query(func.min(PackageBases.c.ID), func.max(PackageBases.c.ID))
+        .one()
+    )
+    if low is None:
+        return
+    for start in range(low, high + 1, chunk_size):
+        yield start, start + chunk_size - 1
+
+
+@db.retry_deadlock
+def _update_chunk(criterion, values: Callable[[int], dict]) -> set[int]:
+    # Each chunk is stamped with its own time, so its PopularityUpdated
+    # is never much older than its commit; see aurweb.archives.segment.
+    now = time.utcnow()
+    with db.begin():
+        session = db.get_session()
+        ids = {row[0] for row in session.query(PackageBases.c.ID).filter(criterion)}
+        if ids:
+            session.execute(
+                update(PackageBases)
+                .where(PackageBases.c.ID.in_(ids))
+                .values(**values(now))
+            )
+    return ids
+
+
+def update_chunked(criterion, values: Callable[[int], dict]) -> int:
+    """Update package bases matching `criterion` in chunks of ID ranges.
+
+    Every chunk is updated in a transaction of its own, retried on
+    deadlocks, so rows are only locked for the duration of a chunk.
+    Versions of updated package bases are bumped after each chunk, and
+    the size and duration of each chunk are logged.
+
+    :param criterion: PackageBases criterion
+    :param values: Callable returning the values to set at a timestamp
+    :return: Number of package bases updated
+    """
+    chunk_size = config.getint("git-archive", "popularity-chunk-size")
+    rows, start = 0, perf_counter()
+    for low, high in _chunks(chunk_size):
+        chunk_start = perf_counter()
+        ids = _update_chunk(
+            and_(criterion, PackageBases.c.ID.between(low, high)), values
+        )
+        logger.info(
+            "Updated %d package bases with IDs %d to %d in %.3fs.",
+            len(ids),
+            low,
+            high,
+            perf_counter() - chunk_start,
+        )
+        version.bump(*ids)
+        rows += len(ids)
+
+    elapsed = perf_counter() - start
+    logger.info(
+        "Updated %d package bases in %.3fs (%.1f rows/s).",
+        rows,
+        elapsed,
+        rows / elapsed if elapsed else 0,
+    )
+    return rows
+
+
+def recompute_all() -> int:
+    """Recompute votes and popularity of all package bases from their votes."""
+    return update_chunked(true(), _recompute_values)
+
+
+def rescale(criterion) -> int:
+    """Rescale the popularity of package bases matching `criterion`."""
+    return update_chunked(criterion, _rescale_values)
+
+
+def check(now: int) -> list[tuple[int, int, float, int, float]]:
+    """Compare incremental scores against popularity computed from votes.
+
+    :param now: Current UTC timestamp
+    :return: List of (ID, NumVotes, incremental popularity, number of
+             votes, popularity) tuples of package bases which differ
+    """
+    query = db.get_session().query(
+        PackageBases.c.ID,
+        PackageBases.c.NumVotes,
+        PackageBases.c.PopularityScore,
+        _votes_subquery().scalar_subquery(),
+        _popularity_subquery(now).scalar_subquery(),
+    )
+
+    output = []
+    scale = factor(now)
+    for pkgbase_id, num_votes, score, votes, expected in query:
+        popularity = max(float(score), 0.0) * scale
+        expected = float(expected)
+        tolerance = TOLERANCE * max(expected, 1.0)
+        if num_votes != votes or abs(popularity - expected) > tolerance:
+            output.append((pkgbase_id, num_votes, popularity, votes, expected))
+    return output
+
+
+def _pkgbase_id(instance) -> int:
+    pkgbase = instance.PackageBase
+    return pkgbase.ID if pkgbase else instance.PackageBaseID
+
+
+def _vote_changes(session) -> dict[int, list]:
+    from sqlalchemy import inspect
+
+    changes = defaultdict(lambda: [0, 0.0])
+
+    def add(pkgbase_id: int, votes: int, vote_ts: int) -> None:
+        changes[pkgbase_id][0] += votes
+        changes[pkgbase_id][1] += votes * weight(vote_ts)
+
+    for instance in session.new:
+        if getattr(instance, "__tablename__", None) == "PackageVotes":
+            add(_pkgbase_id(instance), 1, instance.VoteTS)
+
+    for instance in session.deleted:
+        if getattr(instance, "__tablename__", None) == "PackageVotes":
+            add(instance.PackageBaseID, -1, instance.VoteTS)
+
+    # Votes may be moved to another package base when merging.
+    for instance in session.dirty:
+        if getattr(instance, "__tablename__", None) == "PackageVotes":
+            committed = inspect(instance).committed_state
+            old = committed.get("PackageBaseID", instance.PackageBaseID)
+            if "PackageBase" in committed:
+                new = _pkgbase_id(instance)
+            else:
+                new = instance.PackageBaseID
+            if old != new:
+                add(old, -1, instance.VoteTS)
+                add(new, 1, instance.VoteTS)
+
+    return changes
+
+
+def _before_flush(session, flush_context, instances) -> None:
+    now = time.utcnow()
+    for pkgbase_id, (votes, score) in sorted(_vote_changes(session).items()):
+        if votes or score:
+            session.execute(_adjust(pkgbase_id, votes, score, now))
+
+
+def track(session) -> None:
+    """Update popularity of package bases whose votes change in `session`."""
+    from sqlalchemy import event
+
+    event.listen(session, "before_flush", _before_flush)
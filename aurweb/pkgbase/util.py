@@ -137,7 +137,7 @@ def remove_comaintainers(pkgbase: PackageBase, usernames: list[str]) -> None:
         rotate_comaintainers(pkgbase)
 
     # Send out notifications.
-    util.apply_all(notifications, lambda n: n.send())
+    notify.send_all(notifications)
 
 
 def latest_priority(pkgbase: PackageBase) -> int:
@@ -158,7 +158,7 @@ def latest_priority(pkgbase: PackageBase) -> int:
 class NoopComaintainerNotification:
     """A noop notification stub used as an error-state return value."""
 
-    def send(self) -> None:
+    def send(self, mailer=None) -> None:
         """noop"""
         return
 
@@ -225,7 +225,7 @@ def add_comaintainers(
     util.apply_all(users, add_comaint)
 
     # Send out notifications.
-    util.apply_all(notifications, lambda n: n.send())
+    notify.send_all(notifications)
 
 
 def rotate_comaintainers(pkgbase: PackageBase) -> None:
@@ -0,0 +1,142 @@
+"""Per-package base version counters.
+
+Each package base has a counter in Redis which is incremented whenever
+data exposed for it changes: a push, a vote, a flag, a (co-)maintainer
+change, a request and so on. Caches holding data derived from a package
+base record the counter value they were built at, and treat themselves
+as stale once it has moved on. Nothing ever has to be purged explicitly.
+
+ORM mutations are picked up automatically once a session has been
+passed to track(). Code which modifies package bases through raw SQL or
+bulk ORM statements, such as the git hooks and popupdate, has to call
+bump() itself after committing.
+
+As bumps happen after the database changes they reflect have been
+committed, a Redis error while bumping is logged rather than raised.
+Caches which missed a bump are corrected once their entries expire.
+"""
+
+from collections.abc import Iterable
+
+from redis.exceptions import RedisError
+
+from aurweb import aur_logging
+from aurweb.aur_redis import redis_connection
+
+logger = aur_logging.get_logger(__name__)
+
+KEY = "pkgbase-version:%d"
+
+# Counter incremented along with any package base version.
+GLOBAL_KEY = "pkgbase-version"
+
+# Session.info key holding package base IDs modified in a transaction.
+PENDING = "pkgbase_versions"
+
+# Tables which reference package bases without affecting their data.
+IGNORED_TABLES = {"PackageNotifications"}
+
+
+def bump(*pkgbase_ids: int) -> None:
+    """Increment the version counters of `pkgbase_ids`."""
+    if not pkgbase_ids:
+        return
+
+    try:
+        pipeline = redis_connection().pipeline()
+        for pkgbase_id in set(pkgbase_ids):
+            pipeline.incr(KEY % pkgbase_id)
+        pipeline.incr(GLOBAL_KEY)
+        pipeline.execute()
+    except RedisError:
+        logger.exception("Unable to bump package base versions.")
+
+
+def get(pkgbase_ids: Iterable[int]) -> dict[int, int]:
+    """Return a mapping of package base ID to its current version."""
+    pkgbase_ids = list(set(pkgbase_ids))
+    if not pkgbase_ids:
+        return {}
+
+    values = redis_connection().mget([KEY % id for id in pkgbase_ids])
+    return {id: int(value or 0) for id, value in zip(pkgbase_ids, values)}
+
+
+def _pkgbase_ids(instance) -> set[int]:
+    table = getattr(instance, "__tablename__", None)
+    if table == "PackageBases":
+        return {instance.ID}
+    if table in IGNORED_TABLES:
+        return set()
+
+    pkgbase_id = getattr(instance, "PackageBaseID", None)
+    return {pkgbase_id} if pkgbase_id else set()
+
+
+def _user_pkgbase_ids(session, user_ids: set[int]) -> set[int]:
+    from sqlalchemy import or_
+
+    from aurweb.models import PackageBase, PackageComaintainer
+
+    pkgbases = session.query(PackageBase.ID).filter(
+        or_(
+            PackageBase.MaintainerUID.in_(user_ids),
+            PackageBase.SubmitterUID.in_(user_ids),
+            PackageBase.PackagerUID.in_(user_ids),
+        )
+    )
+    comaintained = session.query(PackageComaintainer.PackageBaseID).filter(
+        PackageComaintainer.UsersID.in_(user_ids)
+    )
+    return {row[0] for row in pkgbases.union(comaintained)}
+
+
+def _before_flush(session, flush_context, instances) -> None:
+    # Usernames are shown in package base data; collect bases of
+    # renamed or deleted users while their relations are still intact.
+    from sqlalchemy import inspect
+
+    user_ids = set()
+    for instance in session.deleted:
+        if getattr(instance, "__tablename__", None) == "Users":
+            user_ids.add(instance.ID)
+    for instance in session.dirty:
+        if getattr(instance, "__tablename__", None) == "Users":
+            if inspect(instance).attrs.Username.history.has_changes():
+                user_ids.add(instance.ID)
+
+    if user_ids:
+        pending = session.info.setdefault(PENDING, set())
+        pending.update(_user_pkgbase_ids(session, user_ids))
+
+
+def _after_flush(session, flush_context) -> None:
+    # Relationship changes also mark their targets dirty; only count
+    # instances whose own columns changed.
+    dirty = (
+        instance
+        for instance in session.dirty
+        if session.is_modified(instance, include_collections=False)
+    )
+
+    pending = session.info.setdefault(PENDING, set())
+    for instance in (*session.new, *dirty, *session.deleted):
+        pending.update(_pkgbase_ids(instance))
+
+
+def _after_commit(session) -> None:
+    bump(*session.info.pop(PENDING, set()))
+
+
+def _after_rollback(session) -> None:
+    session.info.pop(PENDING, None)
+
+
+def track(session) -> None:
+    """Bump versions of package bases modified through `session`."""
+    from sqlalchemy import event
+
+    event.listen(session, "before_flush", _before_flush)
+    event.listen(session, "after_flush", _after_flush)
+    event.listen(session, "after_commit", _after_commit)
+    event.listen(session, "after_rollback", _after_rollback)
@@ -1,7 +1,7 @@
 from collections.abc import Callable
 from typing import Any, Optional
 
-from prometheus_client import Counter, Gauge
+from prometheus_client import Counter, Gauge, Histogram
 from prometheus_fastapi_instrumentator import Instrumentator
 from prometheus_fastapi_instrumentator.metrics import Info
 from starlette.routing import Match, Route
@@ -16,6 +16,31 @@ _instrumentator = Instrumentator()
 SEARCH_REQUESTS = Counter(
     "aur_search_requests", "Number of search requests by cache hit/miss", ["cache"]
 )
+RPC_RESPONSES = Counter(
+    "aur_rpc_responses", "Number of RPC responses by cache hit/miss", ["cache"]
+)
+FRAGMENT_REQUESTS = Counter(
+    "aur_fragment_requests",
+    "Number of package page fragments rendered by cache hit/miss",
+    ["cache"],
+)
+CACHE_REQUESTS = Counter(
+    "aur_cache_requests",
+    "Number of cache lookups by key namespace and tier hit, stale or miss",
+    ["namespace", "cache"],
+)
+CACHE_SECONDS = Histogram(
+    "aur_cache_seconds",
+    "Time spent on cache lookups, including computing missing values",
+    ["namespace", "cache"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0),
+)
+RPC_STAGE_SECONDS = Histogram(
+    "aur_rpc_stage_seconds",
+    "Time spent in each stage of handling RPC info requests",
+    ["stage"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0),
+)
 USERS = Gauge(
     "aur_users", "Number of AUR users by type", ["type"], multiprocess_mode="livemax"
 )
@@ -31,6 +56,11 @@ REQUESTS = Gauge(
     ["type", "status"],
     multiprocess_mode="livemax",
 )
+RATELIMIT_CHECKS = Counter(
+    "aur_ratelimit_checks",
+    "Number of rate limit checks by the tier which decided them",
+    ["tier"],
+)
 
 
 def instrumentator():
@@ -1,13 +1,182 @@
+"""Rate limiting of RPC requests.
+
+With [ratelimit] cache enabled, requests are counted in Redis by a
+server-side script, which checks and updates the limit of a host
+atomically in a single round-trip. [ratelimit] algorithm selects it:
+
+- fixed-window: up to request_limit requests per window_length seconds,
+  counted from the first request of a window;
+- sliding-log: up to request_limit requests during any window_length
+  seconds; keeps a sorted set of up to request_limit timestamps per host;
+- gcra: the generic cell rate algorithm, which lets request_limit
+  requests burst and then replenishes them evenly over window_length
+  seconds, using a single key per host.
+
+With [ratelimit] local_sync_interval set, each worker serves requests
+of a host from an in-memory token bucket and only reconciles the
+requests it served with Redis when the bucket runs empty or is older
+than local_sync_interval seconds. A bucket holds at most
+local_error_budget * request_limit tokens, bounded by the quota Redis
+reported at the last sync, so a host may exceed its limit by at most
+that many requests per worker.
+
+Without the cache, each worker counts requests in memory and flush()es
+its counts to the ApiRateLimit table in a single upsert every
+[ratelimit] flush_interval seconds, from a background thread started by
+start_flusher(). Requests are checked against the counts read back at
+the last flush plus those buffered since. Rows of expired windows are
+deleted by the same thread rather than on every request.
+"""
+
+import importlib.util
+import math
+import os
+import threading
+import time as _time
+from typing import NamedTuple
+
+import fakeredis
 from fastapi import Request
 from redis.client import Pipeline
+from sqlalchemy import case, select
 
-from aurweb import aur_logging, config, db, time
+from aurweb import aur_logging, config, db, schema, time
 from aurweb.aur_redis import redis_connection
-from aurweb.models import ApiRateLimit
 from aurweb.util import get_client_ip
 
 logger = aur_logging.get_logger(__name__)
 
+# All scripts count `cost` requests, the last of which is checked, and
+# return {allowed, remaining, reset}, where reset is the number of
+# seconds until the host's quota is fully restored.
+
+# KEYS: window start, request count. ARGV: now (s), window (s), limit, cost.
+FIXED_WINDOW = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+
+local start = tonumber(redis.call("GET", KEYS[1]))
+local count
+if not start or start < now - window then
+    start = now
+    redis.call("SET", KEYS[1], now, "EX", window)
+    redis.call("SET", KEYS[2], cost, "EX", window)
+    count = cost
+else
+    count = redis.call("INCRBY", KEYS[2], cost)
+end
+return {count <= limit and 1 or 0, math.max(limit - count, 0), start + window - now}
+"""
+
+# KEYS: request log. ARGV: now (ms), window (ms), limit, cost, unique prefix.
+SLIDING_LOG = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+
+redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", now - window)
+local count = redis.call("ZCARD", KEYS[1])
+local allowed = count + cost <= limit
+for i = 1, math.min(cost, limit - count) do
+    redis.call("ZADD", KEYS[1], now, ARGV[5] .. "-" .. i)
+    count = count + 1
+end
+redis.call("PEXPIRE", KEYS[1], window)
+
+local reset = window
+local oldest = redis.call("ZRANGE", KEYS[1], 0, 0, "WITHSCORES")
+if oldest[2] then
+    reset = tonumber(oldest[2]) + window - now
+end
+return {allowed and 1 or 0, limit - count, math.ceil(reset / 1000)}
+"""
+
+# KEYS: theoretical arrival time. ARGV: now (ms), window (ms), limit, cost.
+GCRA = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local interval = window / limit
+
+local tat = math.max(tonumber(redis.call("GET", KEYS[1])) or now, now)
+local new_tat = tat + interval * cost
+if new_tat - window > now then
+    -- Requests served before the checked one still count.
+    tat = math.min(tat + interval * (cost - 1), now + window)
+    if cost > 1 then
+        redis.call("SET", KEYS[1], math.floor(tat), "PX", math.ceil(tat - now))
+    end
+    return {0, 0, math.ceil((tat - now) / 1000)}
+end
+
+redis.call("SET", KEYS[1], math.floor(new_tat), "PX", math.ceil(new_tat - now))
+local remaining = math.floor((now - (new_tat - window)) / interval)
+return {1, remaining, math.ceil((new_tat - now) / 1000)}
+"""
+
+SCRIPTS = {
+    "fixed-window": FIXED_WINDOW,
+    "sliding-log": SLIDING_LOG,
+    "gcra": GCRA,
+}
+
+# Registered scripts, by algorithm.
+_scripts = {}
+
+
+class RateLimit(NamedTuple):
+    allowed: bool
+    limit: int
+    remaining: int
+    reset: int
+
+
+def headers(ratelimit: RateLimit) -> dict[str, str]:
+    """Return X-RateLimit-* headers describing `ratelimit`."""
+    output = {
+        "X-RateLimit-Limit": str(ratelimit.limit),
+        "X-RateLimit-Remaining": str(ratelimit.remaining),
+        "X-RateLimit-Reset": str(ratelimit.reset),
+    }
+    if not ratelimit.allowed:
+        output["Retry-After"] = str(ratelimit.reset)
+    return output
+
+
+def _scripting_supported(redis) -> bool:
+    # fakeredis can only run scripts with its optional Lua runtime.
+    if isinstance(redis, fakeredis.FakeStrictRedis):
+        return importlib.util.find_spec("lupa") is not None
+    return True
+
+
+def _script(algorithm: str):
+    if algorithm not in SCRIPTS:
+        raise ValueError(f"unsupported ratelimit algorithm: {algorithm}")
+    if algorithm not in _scripts:
+        _scripts[algorithm] = redis_connection().register_script(SCRIPTS[algorithm])
+    return _scripts[algorithm]
+
+
+def _ratelimit_script(
+    host: str, algorithm: str, window: int, limit: int, cost: int = 1
+) -> tuple:
+    script = _script(algorithm)
+    if algorithm == "fixed-window":
+        keys = [f"ratelimit-ws:{host}", f"ratelimit:{host}"]
+        args = [time.utcnow(), window, limit, cost]
+    else:
+        now = int(_time.time() * 1000)
+        keys = [f"ratelimit-{algorithm}:{host}"]
+        args = [now, window * 1000, limit, cost]
+        if algorithm == "sliding-log":
+            args.append(f"{now}-{os.urandom(4).hex()}")
+    return script(keys=keys, args=args, client=redis_connection())
+
 
 def _update_ratelimit_redis(request: Request, pipeline: Pipeline):
     window_length = config.getint("ratelimit", "window_length")
@@ -34,84 +203,288 @@ def _update_ratelimit_redis(request: Request, pipeline: Pipeline):
         pipeline.execute()
 
 
-def _update_ratelimit_db(request: Request):
-    window_length = config.getint("ratelimit", "window_length")
+def _ratelimit_pipeline(request: Request, window: int, limit: int) -> RateLimit:
+    # Used with Redis servers which cannot run scripts.
+    pipeline = redis_connection().pipeline()
+    _update_ratelimit_redis(request, pipeline)
+
+    host = get_client_ip(request)
+    pipeline.get(f"ratelimit:{host}")
+    pipeline.get(f"ratelimit-ws:{host}")
+    requests, start = (int(value.decode()) for value in pipeline.execute())
+
+    reset = max(start + window - time.utcnow(), 0)
+    return RateLimit(requests <= limit, limit, max(limit - requests, 0), reset)
+
+
+# Seconds between deletions of expired ApiRateLimit rows.
+CLEANUP_INTERVAL = 300
+
+ApiRateLimit = schema.ApiRateLimit
+
+
+class _Window:
+    """Requests of a host counted by this worker, see flush()."""
+
+    def __init__(self, start: int) -> None:
+        self.start = start
+        # Requests counted in ApiRateLimit at the last flush.
+        self.requests = 0
+        # Requests counted since.
+        self.pending = 0
+
+
+# Request windows of this worker, by host.
+_windows: dict[str, _Window] = {}
+_windows_lock = threading.Lock()
+_flusher = None
+
+
+def _limit_buffered(host: str, window: int, limit: int) -> RateLimit:
     now = time.utcnow()
-    time_to_delete = now - window_length
+    with _windows_lock:
+        record = _windows.get(host)
+        if not record or record.start < now - window:
+            record = _windows[host] = _Window(now)
+        record.pending += 1
+        requests = record.requests + record.pending
+        reset = max(record.start + window - now, 0)
+    return RateLimit(requests <= limit, limit, max(limit - requests, 0), reset)
 
-    @db.retry_deadlock
-    def retry_delete(records: list[ApiRateLimit]) -> None:
-        with db.begin():
-            db.delete_all(records)
 
-    records = db.query(ApiRateLimit).filter(ApiRateLimit.WindowStart < time_to_delete)
-    retry_delete(records)
+def _upsert(rows: list[dict], cutoff: int):
+    # Counts of expired windows are replaced rather than added to.
+    expired = ApiRateLimit.c.WindowStart < cutoff
+    if db.get_engine().dialect.name == "mysql":
+        from sqlalchemy.dialects.mysql import insert
 
-    @db.retry_deadlock
-    def retry_create(record: ApiRateLimit, now: int, host: str) -> ApiRateLimit:
-        with db.begin():
-            if not record:
-                record = db.create(ApiRateLimit, WindowStart=now, IP=host, Requests=1)
-            else:
-                record.Requests += 1
-        return record
+        stmt = insert(ApiRateLimit).values(rows)
+        # Values are assigned in order; Requests depends on WindowStart.
+        return stmt.on_duplicate_key_update(
+            [
+                (
+                    "Requests",
+                    case(
+                        [(expired, stmt.inserted.Requests)],
+                        else_=ApiRateLimit.c.Requests + stmt.inserted.Requests,
+                    ),
+                ),
+                (
+                    "WindowStart",
+                    case(
+                        [(expired, stmt.inserted.WindowStart)],
+                        else_=ApiRateLimit.c.WindowStart,
+                    ),
+                ),
+            ]
+        )
 
-    host = get_client_ip(request)
-    record = db.query(ApiRateLimit, ApiRateLimit.IP == host).first()
-    record = retry_create(record, now, host)
+    from sqlalchemy.dialects.sqlite import insert
 
-    logger.debug(record.Requests)
-    return record
+    stmt = insert(ApiRateLimit).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[ApiRateLimit.c.IP],
+        set_={
+            "Requests": case(
+                [(expired, stmt.excluded.Requests)],
+                else_=ApiRateLimit.c.Requests + stmt.excluded.Requests,
+            ),
+            "WindowStart": case(
+                [(expired, stmt.excluded.WindowStart)],
+                else_=ApiRateLimit.c.WindowStart,
+            ),
+        },
+    )
 
 
-def update_ratelimit(request: Request, pipeline: Pipeline):
-    """Update the ratelimit stored in Redis or the database depending
-    on AUR_CONFIG's [options] cache setting.
+@db.retry_deadlock
+def _flush_rows(rows: list[dict], cutoff: int) -> list:
+    # Flushes may run in a background thread, so they use a connection
+    # of their own rather than the global session.
+    with db.get_engine().begin() as conn:
+        conn.execute(_upsert(rows, cutoff))
+        hosts = [row["IP"] for row in rows]
+        return conn.execute(
+            select(ApiRateLimit).where(ApiRateLimit.c.IP.in_(hosts))
+        ).fetchall()
 
-    This Redis-capable function is slightly different than most. If Redis
-    is not configured to use a real server, this function instead uses
-    the database to persist tracking of a particular host.
 
-    :param request: FastAPI request
-    :param pipeline: redis.client.Pipeline
-    :returns: ApiRateLimit record when Redis cache is not configured, else None
+def flush() -> int:
+    """Write request counts buffered by this worker to ApiRateLimit.
+
+    :return: Number of hosts flushed
     """
-    if config.getboolean("ratelimit", "cache"):
-        return _update_ratelimit_redis(request, pipeline)
-    return _update_ratelimit_db(request)
+    window = config.getint("ratelimit", "window_length")
+    with _windows_lock:
+        rows = [
+            {"IP": host, "Requests": record.pending, "WindowStart": record.start}
+            for host, record in sorted(_windows.items())
+            if record.pending
+        ]
+        for row in rows:
+            _windows[row["IP"]].pending = 0
+    if not rows:
+        return 0
 
+    now = time.utcnow()
+    try:
+        results = _flush_rows(rows, now - window)
+    except Exception:
+        # Keep the counts for the next flush.
+        with _windows_lock:
+            for row in rows:
+                if record := _windows.get(row["IP"]):
+                    record.pending += row["Requests"]
+        raise
 
-def check_ratelimit(request: Request):
-    """Increment and check to see if request has exceeded their rate limit.
+    with _windows_lock:
+        for host, requests, start in results:
+            if record := _windows.get(host):
+                record.requests, record.start = requests, start
+        # Forget hosts whose windows expired without further requests.
+        for host in [
+            host
+            for host, record in _windows.items()
+            if record.start < now - window and not record.pending
+        ]:
+            del _windows[host]
+    return len(rows)
 
-    :param request: FastAPI request
-    :returns: True if the request host has exceeded the rate limit else False
+
+def cleanup() -> int:
+    """Delete ApiRateLimit rows of expired windows.
+
+    :return: Number of rows deleted
     """
-    redis = redis_connection()
-    pipeline = redis.pipeline()
+    cutoff = time.utcnow() - config.getint("ratelimit", "window_length")
+    with db.get_engine().begin() as conn:
+        result = conn.execute(
+            ApiRateLimit.delete().where(ApiRateLimit.c.WindowStart < cutoff)
+        )
+    return result.rowcount
+
+
+def _flush_loop() -> None:
+    interval = config.getint("ratelimit", "flush_interval")
+    cleaned = _time.monotonic()
+    while True:
+        _time.sleep(interval)
+        try:
+            flush()
+            if _time.monotonic() - cleaned >= CLEANUP_INTERVAL:
+                cleanup()
+                cleaned = _time.monotonic()
+        except Exception:
+            logger.exception("Unable to flush ratelimit counts.")
+
+
+def start_flusher() -> None:
+    """Start flushing request counts of this worker in the background."""
+    global _flusher
+    if _flusher is None:
+        _flusher = threading.Thread(
+            target=_flush_loop, name="ratelimit-flush", daemon=True
+        )
+        _flusher.start()
+
+
+def _limit_shared(host: str, window: int, limit: int, cost: int = 1) -> RateLimit:
+    algorithm = config.get("ratelimit", "algorithm")
+    allowed, remaining, reset = _ratelimit_script(host, algorithm, window, limit, cost)
+    return RateLimit(bool(allowed), limit, remaining, reset)
+
+
+class _Bucket:
+    """Requests of a host served by this worker since the last sync."""
+
+    def __init__(self, ratelimit: RateLimit, tokens: int, synced: float) -> None:
+        self.ratelimit = ratelimit
+        self.tokens = tokens
+        self.pending = 0
+        self.synced = synced
+
+
+# In-memory token buckets of this worker, by host.
+_buckets: dict[str, _Bucket] = {}
+_buckets_lock = threading.Lock()
+_buckets_pruned = 0.0
+
+
+def _prune_buckets(now: float, interval: int) -> None:
+    global _buckets_pruned
 
-    record = update_ratelimit(request, pipeline)
+    # Buckets left behind by hosts which stopped sending requests only
+    # hold requests served during a single sync interval; forget them.
+    if now - _buckets_pruned < interval:
+        return
+    _buckets_pruned = now
+    for host in [h for h, b in _buckets.items() if now - b.synced >= interval]:
+        del _buckets[host]
+
+
+def _limit_local(host: str, window: int, limit: int) -> RateLimit:
+    from aurweb.prometheus import RATELIMIT_CHECKS
+
+    interval = config.getint("ratelimit", "local_sync_interval")
+    budget = float(config.get("ratelimit", "local_error_budget"))
+    now = _time.monotonic()
+
+    with _buckets_lock:
+        bucket = _buckets.get(host)
+        if bucket and now - bucket.synced < interval:
+            if bucket.tokens:
+                bucket.tokens -= 1
+                bucket.pending += 1
+                remaining = max(bucket.ratelimit.remaining - bucket.pending, 0)
+                RATELIMIT_CHECKS.labels(tier="local").inc()
+                return bucket.ratelimit._replace(remaining=remaining)
+            if not bucket.ratelimit.allowed:
+                RATELIMIT_CHECKS.labels(tier="local").inc()
+                return bucket.ratelimit
+
+        # Reconcile the requests served locally along with this one.
+        cost = bucket.pending + 1 if bucket else 1
+        _buckets.pop(host, None)
+        _prune_buckets(now, interval)
+
+    result = _limit_shared(host, window, limit, cost)
+    RATELIMIT_CHECKS.labels(tier="redis").inc()
+
+    tokens = min(max(math.floor(limit * budget), 1), result.remaining)
+    with _buckets_lock:
+        _buckets[host] = _Bucket(result, tokens if result.allowed else 0, now)
+    return result
+
+
+def limit_request(request: Request) -> RateLimit:
+    """Count a request and check it against the rate limit of its host.
+
+    :param request: FastAPI request
+    :returns: RateLimit
+    """
+    window = config.getint("ratelimit", "window_length")
+    limit = config.getint("ratelimit", "request_limit")
 
-    # Get cache value, else None.
     host = get_client_ip(request)
-    pipeline.get(f"ratelimit:{host}")
-    requests = pipeline.execute()[0]
-
-    # Take into account the split paths. When Redis is used, a
-    # valid cache value will be returned which must be converted
-    # to an int. Otherwise, use the database record returned
-    # by update_ratelimit.
-    if not config.getboolean("ratelimit", "cache") or requests is None:
-        # If we got nothing from pipeline.get, we did not use
-        # the Redis path of logic: use the DB record's count.
-        requests = record.Requests
+    if not config.getboolean("ratelimit", "cache"):
+        result = _limit_buffered(host, window, limit)
+    elif _scripting_supported(redis_connection()):
+        if config.getint("ratelimit", "local_sync_interval"):
+            result = _limit_local(host, window, limit)
+        else:
+            result = _limit_shared(host, window, limit)
     else:
-        # Otherwise, just case Redis results over to an int.
-        requests = int(requests.decode())
+        result = _ratelimit_pipeline(request, window, limit)
 
-    limit = config.getint("ratelimit", "request_limit")
-    exceeded_ratelimit = requests > limit
-    if exceeded_ratelimit:
+    if not result.allowed:
         logger.debug("%s has exceeded the ratelimit.", host)
+    return result
+
 
-    return exceeded_ratelimit
+def check_ratelimit(request: Request):
+    """Increment and check to see if request has exceeded their rate limit.
+
+    :param request: FastAPI request
+    :returns: True if the request host has exceeded the rate limit else False
+    """
+    return not limit_request(request).allowed
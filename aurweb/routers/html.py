@@ -18,6 +18,7 @@ from sqlalchemy import case, or_
 import aurweb.config
 import aurweb.models.package_request
 from aurweb import aur_logging, cookies, db, models, statistics, time, util
+from aurweb.archives import delta, variants
 from aurweb.exceptions import handle_form_exceptions
 from aurweb.models.package_request import PENDING_ID
 from aurweb.packages.util import query_notified, query_voted, updated_packages
@@ -201,6 +202,23 @@ async def archive_sha256(request: Request, archive: str):
     with open(hashfile) as f:
         hash_value = f.read()
     headers = {"Content-Type": "text/plain"}
+
+    # Advertise variants of the archive and, for clients passing the
+    # SHA-256 of the archive they hold, the delta bringing it up to date.
+    path = os.path.join(archivedir, archive)
+    links = [
+        f'</{os.path.basename(variant)}>; rel="alternate"; '
+        f'type="{variants.CONTENT_TYPES.get(fmt)}"'
+        for fmt in variants.enabled()
+        if os.path.exists(variant := variants.path(path, fmt))
+    ]
+    if (base := request.query_params.get("from")) and (
+        name := delta.lookup(path, base)
+    ):
+        links.append(f'</{name}>; rel="delta"')
+    if links:
+        headers["Link"] = ", ".join(links)
+
     return Response(hash_value, headers=headers)
 
 
@@ -212,8 +230,10 @@ async def metrics(request: Request):
             status_code=HTTPStatus.SERVICE_UNAVAILABLE,
         )
 
-    # update prometheus gauges for packages and users
-    statistics.update_prometheus_metrics()
+    # update prometheus gauges for packages and users, unless they are
+    # updated in the background (see aurweb.asgi.lifespan)
+    if not aurweb.config.getint("options", "metrics_update_interval"):
+        statistics.update_prometheus_metrics()
 
     registry = CollectorRegistry()
     multiprocess.MultiProcessCollector(registry)
@@ -6,16 +6,17 @@ from fastapi import APIRouter, Form, Query, Request, Response
 import aurweb.filters  # noqa: F401
 from aurweb import aur_logging, config, db, defaults, models, util
 from aurweb.auth import creds, requires_auth
-from aurweb.cache import db_count_cache, db_query_cache
+from aurweb.cache import db_count_cache, db_ids_cache
 from aurweb.exceptions import InvariantError, handle_form_exceptions
 from aurweb.models.relation_type import CONFLICTS_ID, PROVIDES_ID, REPLACES_ID
 from aurweb.packages import util as pkgutil
 from aurweb.packages.search import PackageSearch
 from aurweb.packages.util import get_pkg_or_base
 from aurweb.pkgbase import actions as pkgbase_actions
+from aurweb.pkgbase import fragments
 from aurweb.pkgbase import util as pkgbaseutil
+from aurweb.scripts import notify
 from aurweb.templates import make_context, make_variable_context, render_template
-from aurweb.util import hash_query
 
 logger = aur_logging.get_logger(__name__)
 router = APIRouter()
@@ -78,33 +79,27 @@ async def packages_get(
         # When outdated is set to "on," we filter records which do have
         # an OutOfDateTS. When it's set to "off," we filter out any which
         # do **not** have OutOfDateTS.
-        criteria = None
-        if flagged == "on":
-            criteria = models.PackageBase.OutOfDateTS.isnot
-        else:
-            criteria = models.PackageBase.OutOfDateTS.is_
-
-        # Apply the flag criteria to our PackageSearch.query.
-        search.query = search.query.filter(criteria(None))
+        search.filter_outdated(flagged == "on")
 
     submit = request.query_params.get("submit", "Go")
     if submit == "Orphans":
         # If the user clicked the "Orphans" button, we only want
         # orphaned packages.
-        search.query = search.query.filter(models.PackageBase.MaintainerUID.is_(None))
+        search.filter_orphans()
 
     # Collect search result count here; we've applied our keywords.
     # Including more query operations below, like ordering, will
     # increase the amount of time required to collect a count.
-    # we use redis for caching the results of the query
+    # we use redis for caching the results of the query, keyed on
+    # the search parameters (see PackageSearch.cache_key).
     cache_expire = config.getint("cache", "expiry_time_search", 600)
-    num_packages = db_count_cache(hash_query(search.query), search.query, cache_expire)
+    num_packages = db_count_cache(search.cache_key("count"), search.query, cache_expire)
 
     # Apply user-specified sort column and ordering.
     search.sort_by(sort_by, sort_order)
 
     # Insert search results into the context.
-    results = search.results().with_entities(
+    columns = (
         models.Package.ID,
         models.Package.Name,
         models.Package.PackageBaseID,
@@ -118,12 +113,20 @@ async def packages_get(
         models.PackageVote.PackageBaseID.label("Voted"),
         models.PackageNotification.PackageBaseID.label("Notify"),
     )
+    results = search.results().with_entities(*columns)
 
     # paging
     results = results.limit(per_page).offset(offset)
 
-    # we use redis for caching the results of the query
-    packages = db_query_cache(hash_query(results), results, cache_expire)
+    # we use redis for caching the IDs of the results; rows of cached
+    # results are looked up by ID, with Voted and Notify of the user
+    # viewing them.
+    def hydrate(ids: list[int]):
+        lookup = PackageSearch(request.user).filter_ids(ids)
+        return lookup.results().with_entities(*columns)
+
+    key = search.cache_key("results", per_page, offset)
+    packages = db_ids_cache(key, results, hydrate, cache_expire)
 
     context["packages"] = packages
     context["packages_count"] = num_packages
@@ -163,18 +166,6 @@ async def package(
     pkg = get_pkg_or_base(name, models.Package)
     pkgbase = pkg.PackageBase
 
-    conflicts = []
-    provides = []
-    replaces = []
-    relations = pkg.package_relations.order_by(models.PackageRelation.RelName.asc())
-    for relation in relations:
-        if relation.RelTypeID == CONFLICTS_ID:
-            conflicts.append(relation)
-        elif relation.RelTypeID == PROVIDES_ID:
-            provides.append(relation)
-        elif relation.RelTypeID == REPLACES_ID:
-            replaces.append(relation)
-
     # Add our base information.
     context = pkgbaseutil.make_context(request, pkgbase)
     context["q"] = dict(request.query_params)
@@ -182,43 +173,93 @@ async def package(
     context.update({"all_deps": all_deps, "all_reqs": all_reqs})
 
     context["package"] = pkg
-    context["conflicts"] = conflicts
-    context["provides"] = provides
-    context["replaces"] = replaces
-
-    # Package sources.
-    context["sources"] = pkg.package_sources.order_by(
-        models.PackageSource.Source.asc()
-    ).all()
+    context["show_package_details"] = True
 
     # Listing metadata.
     context["max_listing"] = max_listing = 20
 
-    # Package dependencies.
-    dependencies, dependencies_count = pkgutil.query_package_dependencies(
-        pkg, all_deps, max_listing
-    )
-    context["dependencies"] = dependencies
-    context["dependencies_count"] = dependencies_count
+    def update_relations(context: dict[str, Any]) -> None:
+        if "provides" in context:
+            return
+
+        conflicts = context["conflicts"] = []
+        provides = context["provides"] = []
+        replaces = context["replaces"] = []
+        relations = pkg.package_relations.order_by(models.PackageRelation.RelName.asc())
+        for relation in relations:
+            if relation.RelTypeID == CONFLICTS_ID:
+                conflicts.append(relation)
+            elif relation.RelTypeID == PROVIDES_ID:
+                provides.append(relation)
+            elif relation.RelTypeID == REPLACES_ID:
+                replaces.append(relation)
+
+    def update_details(context: dict[str, Any]) -> None:
+        update_relations(context)
+        context["licenses"] = pkg.package_licenses.all()
+        context["groups"] = pkg.package_groups.all()
+
+    def update_metadata(context: dict[str, Any]) -> None:
+        update_relations(context)
+
+        # Package sources.
+        context["sources"] = pkg.package_sources.order_by(
+            models.PackageSource.Source.asc()
+        ).all()
+
+        # Package dependencies.
+        dependencies, dependencies_count = pkgutil.query_package_dependencies(
+            pkg, all_deps, max_listing
+        )
+        context["dependencies"] = dependencies
+        context["dependencies_count"] = dependencies_count
 
-    # Packages requiring this package (other packages depend on this one).
-    required_by, required_by_count = pkgutil.query_required_by_package_dependencies(
-        pkg, provides, all_reqs, max_listing
-    )
-    context["required_by"] = required_by
-    context["required_by_count"] = required_by_count
+        # Packages requiring this package (other packages depend on this one).
+        required_by, required_by_count = pkgutil.query_required_by_package_dependencies(
+            pkg, context["provides"], all_reqs, max_listing
+        )
+        context["required_by"] = required_by
+        context["required_by_count"] = required_by_count
 
-    context["licenses"] = pkg.package_licenses.all()
-    context["groups"] = pkg.package_groups.all()
+        # Collect all dependency names for batched lookups
+        dependency_names = {dep.DepName for dep in dependencies}
+        aur_packages, official_packages, dependency_providers = (
+            pkgutil.lookup_dependencies(dependency_names)
+        )
+        context["aur_packages"] = aur_packages
+        context["official_packages"] = official_packages
+        context["dependency_providers"] = dependency_providers
+
+    # Details only differ between anonymous viewers by language and
+    # timezone; dependency listings are the same for everyone.
+    if request.user.is_authenticated():
+        update_details(context)
+    else:
+        context["details"] = fragments.render(
+            request,
+            "partials/packages/details.html",
+            context,
+            pkgbase.ID,
+            pkg.ID,
+            update=update_details,
+        )
 
-    # Collect all dependency names for batched lookups
-    dependency_names = {dep.DepName for dep in dependencies}
-    aur_packages, official_packages, dependency_providers = pkgutil.lookup_dependencies(
-        dependency_names
+    # The metadata fragment only varies by the listing parameters, so its
+    # links are built from those alone; other query parameters must not
+    # create fragments of their own.
+    context["listing_q"] = {
+        key: "1" for key in ("all_deps", "all_reqs") if context[key]
+    }
+    context["metadata"] = fragments.render(
+        request,
+        "partials/packages/package_metadata.html",
+        context,
+        pkgbase.ID,
+        pkg.ID,
+        all_deps,
+        all_reqs,
+        update=update_metadata,
     )
-    context["aur_packages"] = aur_packages
-    context["official_packages"] = official_packages
-    context["dependency_providers"] = dependency_providers
 
     return render_template(request, "packages/show.html", context)
 
@@ -462,7 +503,7 @@ async def packages_delete(
         deleted_bases,
     )
 
-    util.apply_all(notifs, lambda n: n.send())
+    notify.send_all(notifs)
     return True, ["The selected packages have been deleted."]
 
 
@@ -4,7 +4,7 @@ from fastapi import APIRouter, Form, HTTPException, Query, Request, Response
 from fastapi.responses import JSONResponse, RedirectResponse
 from sqlalchemy import and_
 
-from aurweb import aur_logging, config, db, l10n, templates, time, util
+from aurweb import aur_logging, config, db, l10n, templates, time
 from aurweb.auth import creds, requires_auth
 from aurweb.exceptions import InvariantError, ValidationError, handle_form_exceptions
 from aurweb.models import PackageBase, User
@@ -16,9 +16,9 @@ from aurweb.models.package_vote import PackageVote
 from aurweb.models.request_type import ADOPTION_ID, DELETION_ID, MERGE_ID, ORPHAN_ID
 from aurweb.packages.requests import update_closure_comment
 from aurweb.packages.util import get_pkg_or_base, get_pkgbase_comment
-from aurweb.pkgbase import actions, validate
+from aurweb.pkgbase import actions, fragments, validate
 from aurweb.pkgbase import util as pkgbaseutil
-from aurweb.scripts import notify, popupdate
+from aurweb.scripts import notify
 from aurweb.scripts.rendercomment import update_comment_render_fastapi
 from aurweb.templates import make_variable_context, render_template
 
@@ -51,6 +51,11 @@ async def pkgbase(request: Request, name: str) -> Response:
     context = pkgbaseutil.make_context(request, pkgbase)
     context["packages"] = packages
 
+    if not request.user.is_authenticated():
+        context["details"] = fragments.render(
+            request, "partials/packages/details.html", context, pkgbase.ID
+        )
+
     return render_template(request, "pkgbase/index.html", context)
 
 
@@ -522,9 +527,6 @@ async def pkgbase_vote(request: Request, name: str):
         with db.begin():
             db.create(PackageVote, User=request.user, PackageBase=pkgbase, VoteTS=now)
 
-        # Update NumVotes/Popularity.
-        popupdate.run_single(pkgbase)
-
     return RedirectResponse(f"/pkgbase/{name}", status_code=HTTPStatus.SEE_OTHER)
 
 
@@ -541,9 +543,6 @@ async def pkgbase_unvote(request: Request, name: str):
         with db.begin():
             db.delete(vote)
 
-        # Update NumVotes/Popularity.
-        popupdate.run_single(pkgbase)
-
     return RedirectResponse(f"/pkgbase/{name}", status_code=HTTPStatus.SEE_OTHER)
 
 
@@ -885,7 +884,7 @@ async def pkgbase_request_post(
     elif type == "deletion" and is_maintainer and outdated:
         # This request should be auto-accepted.
         notifs = actions.pkgbase_delete_instance(request, pkgbase, comments=comments)
-        util.apply_all(notifs, lambda n: n.send())
+        notify.send_all(notifs)
         logger.debug("New request #%s is marked for auto-deletion.", pkgreq.ID)
 
     # Redirect the submitting user to /packages.
@@ -950,7 +949,7 @@ async def pkgbase_delete_post(
                 pkgreq.ClosureComment = comments
 
     notifs = actions.pkgbase_delete_instance(request, pkgbase, comments=comments)
-    util.apply_all(notifs, lambda n: n.send())
+    notify.send_all(notifs)
     return RedirectResponse(next, status_code=HTTPStatus.SEE_OTHER)
 
 
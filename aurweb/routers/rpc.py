@@ -34,9 +34,10 @@ import orjson
 from fastapi import APIRouter, Form, Query, Request, Response
 from fastapi.responses import JSONResponse
 
-from aurweb import defaults
+from aurweb import config, defaults, rpc_cache
 from aurweb.exceptions import handle_form_exceptions
-from aurweb.ratelimit import check_ratelimit
+from aurweb.ratelimit import headers as ratelimit_headers
+from aurweb.ratelimit import limit_request
 from aurweb.rpc import RPC, documentation
 
 router = APIRouter()
@@ -101,10 +102,12 @@ async def rpc_request(
     rpc = RPC(version=v, type=type)
 
     # If ratelimit was exceeded, return a 429 Too Many Requests.
-    if check_ratelimit(request):
+    ratelimit = limit_request(request)
+    if not ratelimit.allowed:
         return JSONResponse(
             rpc.error("Rate limit reached"),
             status_code=int(HTTPStatus.TOO_MANY_REQUESTS),
+            headers=ratelimit_headers(ratelimit),
         )
 
     # If `callback` was provided, produce a text/javascript response
@@ -127,20 +130,34 @@ async def rpc_request(
             arguments.append(arg)
         arguments += args
 
-    data = rpc.handle(by=by, args=arguments)
+    def build() -> rpc_cache.Response:
+        data = rpc.handle(by=by, args=arguments)
 
-    # Serialize `data` into JSON in a sorted fashion. This way, our
-    # ETag header produced below will never end up changed.
-    content = orjson.dumps(data, option=orjson.OPT_SORT_KEYS)
+        # Serialize `data` into JSON in a sorted fashion. This way, our
+        # ETag header produced below will never end up changed.
+        content = orjson.dumps(data, option=orjson.OPT_SORT_KEYS)
 
-    # Produce an md5 hash based on `output`.
-    md5 = hashlib.md5()
-    md5.update(content)
-    etag = md5.hexdigest()
+        # Produce an md5 hash based on `output`.
+        md5 = hashlib.md5()
+        md5.update(content)
+        return rpc_cache.Response(content, md5.hexdigest())
+
+    content, etag = rpc_cache.cached(rpc, by, arguments, build)
 
     # The ETag header expects quotes to surround any identifier.
     # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/ETag
-    headers = {"Content-Type": content_type, "ETag": f'"{etag}"'}
+    headers = {
+        "Content-Type": content_type,
+        "ETag": f'"{etag}"',
+        **ratelimit_headers(ratelimit),
+    }
+
+    # Expose the stages of a freshly built response for debugging; they
+    # reveal cache misses and database latency to clients.
+    if rpc.timings and config.getboolean("rpc", "server_timing"):
+        headers["Server-Timing"] = ", ".join(
+            f"{name};dur={seconds * 1000:.3f}" for name, seconds in rpc.timings.items()
+        )
 
     if_none_match = request.headers.get("If-None-Match", str())
     if if_none_match and if_none_match.strip('\t\n\r" ') == etag:
@@ -61,7 +61,9 @@ async def rss(request: Request):
 
     # we use redis for caching the results of the feedgen
     cache_expire = config.getint("cache", "expiry_time_rss", 300)
-    feed = lambda_cache("rss", lambda: make_rss_feed(request, packages), cache_expire)
+    feed = lambda_cache(
+        "rss", lambda: make_rss_feed(request, packages), cache_expire, local=True
+    )
 
     latest_timestamp = None
     if packages.count() > 0:
@@ -101,7 +103,11 @@ async def rss_modified(request: Request):
     # we use redis for caching the results of the feedgen
     cache_expire = config.getint("cache", "expiry_time_rss", 300)
     feed = lambda_cache(
-        "rss_modified", lambda: make_rss_feed(request, packages), cache_expire
+        "rss_modified",
+        lambda: make_rss_feed(request, packages),
+        cache_expire,
+        local=True,
+        namespace="rss",
     )
 
     latest_timestamp = None
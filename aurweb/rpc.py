@@ -1,18 +1,27 @@
 import os
 from collections import defaultdict
-from collections.abc import Callable
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from operator import attrgetter
 from typing import Any, NewType, Union
 
+import orjson
 from fastapi.responses import HTMLResponse
-from sqlalchemy import and_, func, literal, orm
+from sqlalchemy import and_, literal, orm
+from sqlalchemy.engine import Row
 
 import aurweb.config as config
 from aurweb import db, defaults, models, time
+from aurweb.benchmark import Benchmark
 from aurweb.exceptions import RPCError
 from aurweb.filters import number_format
 from aurweb.models.package_base import popularity
 from aurweb.models.package_request import PENDING_ID
+from aurweb.packages import info
+from aurweb.packages.index import SUGGEST_LIMIT, suggest_index
 from aurweb.packages.search import RPCSearch
+from aurweb.pkgbase import version
+from aurweb.prometheus import RPC_STAGE_SECONDS
 
 TYPE_MAPPING = {
     "depends": "Depends",
@@ -108,6 +117,12 @@ class RPC:
         self.version = version
         self.type = RPC.TYPE_ALIASES.get(type, type)
 
+        # IDs of package bases in info results.
+        self.pkgbase_ids = set()
+
+        # Duration in seconds of each stage of handling the request.
+        self.timings = {}
+
     def error(self, message: str) -> dict[str, Any]:
         return {
             "version": self.version,
@@ -305,8 +320,11 @@ class RPC:
             .join(models.User, models.User.ID == models.PackageComaintainer.UsersID)
             .join(
                 models.Package,
-                models.Package.PackageBaseID
-                == models.PackageComaintainer.PackageBaseID,
+                and_(
+                    models.Package.PackageBaseID
+                    == models.PackageComaintainer.PackageBaseID,
+                    models.Package.ID.in_(ids),
+                ),
             )
             .with_entities(
                 models.Package.ID,
@@ -316,6 +334,23 @@ class RPC:
             )
             .distinct()  # A package could have the same co-maintainer multiple times
             .order_by("Name"),
+            # Open requests, one record each; they are counted below.
+            db.query(models.PackageRequest)
+            .join(
+                models.Package,
+                models.Package.PackageBaseID == models.PackageRequest.PackageBaseID,
+            )
+            .filter(
+                models.Package.ID.in_(ids),
+                models.PackageRequest.Status == PENDING_ID,
+                models.PackageRequest.ClosedTS.is_(None),
+            )
+            .with_entities(
+                models.Package.ID.label("ID"),
+                literal("PendingRequests").label("Type"),
+                literal(str()).label("Name"),
+                literal(str()).label("Cond"),
+            ),
         ]
 
         # Union all subqueries together.
@@ -324,7 +359,12 @@ class RPC:
         # Store our extra information in a class-wise dictionary,
         # which contains package id -> extra info dict mappings.
         self.extra_info = defaultdict(lambda: defaultdict(list))
+        pending = defaultdict(int)
         for record in query:
+            if record.Type == "PendingRequests":
+                pending[record.ID] += 1
+                continue
+
             type_ = TYPE_MAPPING.get(record.Type, record.Type)
 
             name = record.Name
@@ -334,32 +374,11 @@ class RPC:
             self.extra_info[record.ID][type_].append(name)
 
         # Open request count per package.
-        open_requests = (
-            db.query(models.PackageRequest)
-            .join(
-                models.Package,
-                models.Package.PackageBaseID == models.PackageRequest.PackageBaseID,
-            )
-            .filter(
-                models.Package.ID.in_(ids),
-                models.PackageRequest.Status == PENDING_ID,
-                models.PackageRequest.ClosedTS.is_(None),
-            )
-            .with_entities(
-                models.Package.ID.label("ID"),
-                func.count(models.PackageRequest.ID).label("Count"),
-            )
-            .group_by(models.Package.ID)
-        )
-        for record in open_requests:
-            self.extra_info[record.ID]["PendingRequests"] = record.Count
-
-    def _handle_multiinfo_type(
-        self, args: list[str] = [], **kwargs
-    ) -> list[dict[str, Any]]:
-        self._enforce_args(args)
-        args = set(args)
+        for id, count in pending.items():
+            self.extra_info[id]["PendingRequests"] = count
 
+    def _info_query(self, *criteria) -> orm.Query:
+        """Return an RPC entities query of packages matching `criteria`."""
         packages = (
             db.query(models.Package)
             .join(models.PackageBase)
@@ -368,19 +387,106 @@ class RPC:
                 models.User.ID == models.PackageBase.MaintainerUID,
                 isouter=True,
             )
-            .filter(models.Package.Name.in_(args))
+            .filter(*criteria)
         )
+        return self.entities(packages)
+
+    @contextmanager
+    def _stage(self, name: str) -> Iterator[None]:
+        """Record the duration of a request handling stage in `timings`
+        and the aur_rpc_stage_seconds histogram."""
+        bench = Benchmark()
+        yield
+        self.timings[name] = bench.end()
+        RPC_STAGE_SECONDS.labels(stage=name).observe(self.timings[name])
+
+    def _fetch_info(self, criteria, max_results: int) -> list[Row]:
+        """Fetch info rows and extra info of packages matching `criteria`.
+
+        Both are fetched in a single round-trip each.
+
+        :param criteria: Filter criteria of the packages
+        :param max_results: Maximum number of packages
+        :raises RPCError: If more than `max_results` packages match
+        :return: List of package rows
+        """
+        with self._stage("packages"):
+            packages = self._info_query(criteria).limit(max_results + 1).all()
+
+        if len(packages) > max_results:
+            raise RPCError("Too many package results.")
+
+        with self._stage("extra_info"):
+            self.subquery({pkg.ID for pkg in packages})
+        self.pkgbase_ids = {pkg.PackageBaseID for pkg in packages}
+
+        return packages
+
+    def _handle_multiinfo_type(
+        self, args: list[str] = [], **kwargs
+    ) -> list[dict[str, Any]]:
+        self._enforce_args(args)
+        args = set(args)
+
+        if config.getboolean("rpc", "info_store"):
+            return self._handle_stored_multiinfo(args)
 
         max_results = config.getint("options", "max_rpc_results")
-        packages = self.entities(packages).limit(max_results + 1)
+        packages = self._fetch_info(models.Package.Name.in_(args), max_results)
 
-        if packages.count() > max_results:
-            raise RPCError("Too many package results.")
+        with self._stage("assemble"):
+            data = self._assemble_json_data(packages, self.get_info_json_data)
+        return data
 
-        ids = {pkg.ID for pkg in packages}
-        self.subquery(ids)
+    def _handle_stored_multiinfo(self, args: set[str]) -> list[orjson.Fragment]:
+        """Serve info documents from the store, building missing ones."""
+        max_results = config.getint("options", "max_rpc_results")
+        with self._stage("store"):
+            docs = info.get(args)
+
+        missing = []
+        if args - docs.keys():
+            with self._stage("missing"):
+                missing = (
+                    db.query(models.Package)
+                    .filter(models.Package.Name.in_(args - docs.keys()))
+                    .with_entities(models.Package.ID, models.Package.PackageBaseID)
+                    .limit(max_results + 1)
+                    .all()
+                )
+
+        if len(docs) + len(missing) > max_results:
+            raise RPCError("Too many package results.")
 
-        return self._assemble_json_data(packages, self.get_info_json_data)
+        if missing:
+            # Take versions before reading package data, so documents
+            # built from it are outdated by any change committed since.
+            versions = version.get(row.PackageBaseID for row in missing)
+
+            ids = {row.ID for row in missing}
+            packages = self._fetch_info(models.Package.ID.in_(ids), max_results)
+
+            now = time.utcnow()
+            built = {}
+            with self._stage("assemble"):
+                for package in packages:
+                    data = self.get_info_json_data(package)
+                    doc = info.Document(
+                        package.ID,
+                        package.PackageBaseID,
+                        versions[package.PackageBaseID],
+                        orjson.dumps(data, option=orjson.OPT_SORT_KEYS),
+                    )
+                    ttl = info.ttl(package.PopularityUpdated, now)
+                    built[package.Name] = (doc, ttl)
+
+            with self._stage("store"):
+                info.put(built)
+            docs.update({name: doc for name, (doc, _) in built.items()})
+
+        docs = sorted(docs.values(), key=attrgetter("ID"))
+        self.pkgbase_ids = {doc.PackageBaseID for doc in docs}
+        return [orjson.Fragment(doc.data) for doc in docs]
 
     def _handle_search_type(
         self, by: str = defaults.RPC_SEARCH_BY, args: list[str] = []
@@ -432,12 +538,16 @@ class RPC:
             return []
 
         arg = args[0]
+        index = suggest_index()
+        if index and (names := index.suggest(arg)) is not None:
+            return names
+
         packages = (
             db.query(models.Package.Name)
             .join(models.PackageBase)
             .filter(models.Package.Name.like(f"{arg}%"))
             .order_by(models.Package.Name.asc())
-            .limit(20)
+            .limit(SUGGEST_LIMIT)
         )
         return [pkg.Name for pkg in packages]
 
@@ -446,11 +556,15 @@ class RPC:
             return []
 
         arg = args[0]
+        index = suggest_index()
+        if index and (names := index.suggest_pkgbase(arg)) is not None:
+            return names
+
         packages = (
             db.query(models.PackageBase.Name)
             .filter(models.PackageBase.Name.like(f"{arg}%"))
             .order_by(models.PackageBase.Name.asc())
-            .limit(20)
+            .limit(SUGGEST_LIMIT)
         )
         return [pkg.Name for pkg in packages]
 
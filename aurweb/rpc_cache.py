@@ -0,0 +1,119 @@
+"""Cache of serialized RPC responses.
+
+Responses are cached under a key derived from the normalized request,
+along with the counters they were built at. A cached response is only
+served while those counters are unchanged:
+
+- info responses depend on the versions of the package bases they
+  contain, and on the package name generation, which moves when a
+  requested package appears or disappears;
+- suggest responses depend on the package name generation;
+- all other responses depend on the global package base version.
+
+Validation only involves Redis, so cache hits, including conditional
+requests answered with 304 Not Modified, never touch the database.
+"""
+
+import hashlib
+from collections.abc import Callable
+from typing import NamedTuple
+
+import orjson
+
+from aurweb import config
+from aurweb.aur_redis import redis_connection
+from aurweb.packages.index import GENERATION_KEY
+from aurweb.pkgbase import version
+from aurweb.prometheus import RPC_RESPONSES
+from aurweb.rpc import RPC
+
+KEY = "rpc-response:%s"
+
+SUGGEST_TYPES = {"suggest", "suggest-pkgbase"}
+
+
+class Response(NamedTuple):
+    content: bytes
+    etag: str
+
+
+def cache_key(rpc: RPC, by: str, args: list[str]) -> str:
+    """Return the cache key of an RPC request."""
+    # Info requests are answered for the set of their arguments; all
+    # other types only look at the first one.
+    args = sorted(set(args)) if rpc.type == "multiinfo" else args[:1]
+    request = orjson.dumps([rpc.version, rpc.type, by, args])
+    return KEY % hashlib.sha1(request).hexdigest()
+
+
+def _values(keys: list[str]) -> list[int]:
+    return [int(value or 0) for value in redis_connection().mget(keys)]
+
+
+def get(key: str) -> Response | None:
+    """Return the cached response at `key` if it is still valid."""
+    value = redis_connection().get(key)
+    if value is None:
+        return None
+
+    header, content = value.split(b"\n", 1)
+    keys, values, etag = orjson.loads(header)
+    if _values(keys) != values:
+        return None
+    return Response(content, etag)
+
+
+def put(key: str, rpc: RPC, counters: list[int], response: Response) -> None:
+    """Cache `response` built by `rpc`.
+
+    :param key: Cache key of the request
+    :param rpc: RPC instance which handled the request
+    :param counters: Package name generation and global package base
+                     version, as read before the request was handled
+    :param response: Serialized response
+    """
+    generation, global_version = counters
+    if rpc.type == "multiinfo":
+        pkgbase_ids = sorted(rpc.pkgbase_ids)
+        keys = [version.GLOBAL_KEY] + [version.KEY % id for id in pkgbase_ids]
+        values = _values(keys)
+
+        # Versions read after a concurrent change may be ahead of the
+        # data in the response; leave it uncached.
+        if values[0] != global_version:
+            return
+        keys[0], values[0] = GENERATION_KEY, generation
+    elif rpc.type in SUGGEST_TYPES:
+        keys, values = [GENERATION_KEY], [generation]
+    else:
+        keys, values = [version.GLOBAL_KEY], [global_version]
+
+    header = orjson.dumps([keys, values, response.etag])
+    ttl = config.getint("rpc", "response_cache_ttl")
+    redis_connection().set(key, header + b"\n" + response.content, ex=ttl)
+
+
+def cached(
+    rpc: RPC, by: str, args: list[str], build: Callable[[], Response]
+) -> Response:
+    """Return the cached response of an RPC request, or build it.
+
+    :param rpc: RPC instance handling the request
+    :param by: RPC `by` argument
+    :param args: RPC arguments
+    :param build: Callable handling the request with `rpc`
+    :return: Response
+    """
+    if not config.getboolean("rpc", "response_cache"):
+        return build()
+
+    key = cache_key(rpc, by, args)
+    if response := get(key):
+        RPC_RESPONSES.labels(cache="hit").inc()
+        return response
+
+    RPC_RESPONSES.labels(cache="miss").inc()
+    counters = _values([GENERATION_KEY, version.GLOBAL_KEY])
+    response = build()
+    put(key, rpc, counters, response)
+    return response
@@ -9,6 +9,7 @@ from sqlalchemy import (
     CHAR,
     TIMESTAMP,
     Column,
+    Float,
     ForeignKey,
     Index,
     MetaData,
@@ -17,7 +18,7 @@ from sqlalchemy import (
     Text,
     text,
 )
-from sqlalchemy.dialects.mysql import BIGINT, DECIMAL, INTEGER, TINYINT
+from sqlalchemy.dialects.mysql import BIGINT, DECIMAL, DOUBLE, INTEGER, TINYINT
 from sqlalchemy.ext.compiler import compiles
 
 import aurweb.config
@@ -183,6 +184,13 @@ PackageBases = Table(
         nullable=False,
         server_default=text("'1970-01-01 00:00:01.000000'"),
     ),
+    # Popularity at a fixed reference time, see aurweb.pkgbase.popularity.
+    Column(
+        "PopularityScore",
+        DOUBLE(asdecimal=False) if db_backend == "mysql" else Float,
+        nullable=False,
+        server_default=text("0"),
+    ),
     Column("OutOfDateTS", BIGINT(unsigned=True)),
     Column("FlaggerComment", Text, nullable=False),
     Column("SubmittedTS", BIGINT(unsigned=True), nullable=False),
@@ -639,3 +647,24 @@ ApiRateLimit = Table(
     mysql_charset="utf8mb4",
     mysql_collate="utf8mb4_general_ci",
 )
+
+
+# Queued notifications, see aurweb.outbox
+NotificationQueue = Table(
+    "NotificationQueue",
+    metadata,
+    Column("ID", BIGINT(unsigned=True), primary_key=True),
+    Column("Type", String(64), nullable=False),
+    Column("Payload", Text, nullable=False),
+    Column(
+        "Attempts", INTEGER(unsigned=True), nullable=False, server_default=text("0")
+    ),
+    Column("AvailableTS", BIGINT(unsigned=True), nullable=False),
+    Column("ClaimToken", String(32)),
+    Column("Error", Text),
+    Column("Failed", TINYINT(1), nullable=False, server_default=text("0")),
+    Index("NotificationQueueAvailable", "Failed", "AvailableTS"),
+    mysql_engine="InnoDB",
+    mysql_charset="utf8mb4",
+    mysql_collate="utf8mb4_general_ci",
+)
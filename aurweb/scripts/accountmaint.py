@@ -23,7 +23,8 @@ from datetime import UTC, datetime, timedelta
 
 from sqlalchemy import delete, or_
 
-from aurweb import aur_logging, config, db, util
+from aurweb import aur_logging, config, db
+from aurweb.auth import cache
 from aurweb.models import User
 from aurweb.models.account_type import USER_ID
 from aurweb.scripts import notify
@@ -146,7 +147,7 @@ def _warn(now: datetime, dry_run: bool) -> int:
     notifs = [
         notify.VerificationReminderNotification(user.ID, days_left) for user in users
     ]
-    util.apply_all(notifs, lambda n: n.send())
+    notify.send_all(notifs)
 
     logger.info("Warned %d unverified accounts.", len(users))
     return len(users)
@@ -170,6 +171,7 @@ def _delete(now: datetime, dry_run: bool) -> int:
                 .where(User.ID.in_(batch))
                 .execution_options(synchronize_session=False)
             )
+        cache.invalidate(user_ids=batch)
         deleted += result.rowcount
         logger.debug("Deleted %d/%d.", deleted, len(uids))
 
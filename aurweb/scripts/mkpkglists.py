@@ -18,25 +18,38 @@ on the following, right-hand side fields are added to each item.
 
 """
 
-import gzip
+import contextlib
 import hashlib
 import io
 import os
+import queue
 import shutil
 import sys
+import threading
 from collections import defaultdict
+from collections.abc import Iterable, Iterator
 from typing import Any
 
 import orjson
-from sqlalchemy import literal, orm
+from sqlalchemy import column, literal, orm
+from sqlalchemy.engine import Row
 
 import aurweb.config
 from aurweb import aur_logging, db, filters, models, util
+from aurweb.archives import delta, segment, variants
 from aurweb.benchmark import Benchmark
 from aurweb.models import Package, PackageBase, User
 
 logger = aur_logging.get_logger("aurweb.scripts.mkpkglists")
 
+# Number of records fetched from the database at a time.
+CHUNK_SIZE = 1000
+
+# Number of bytes buffered before they are handed to an archive worker,
+# and the number of such chunks which may be queued per worker.
+BUFFER_SIZE = 1 << 16
+QUEUE_SIZE = 16
+
 
 TYPE_MAP = {
     "depends": "Depends",
@@ -49,41 +62,42 @@ TYPE_MAP = {
 }
 
 
-def get_extended_dict(query: orm.Query):
+def merge_extended(
+    packages: Iterable[Row], extended: Iterable[Row]
+) -> Iterator[tuple[Row, dict[str, list[str]]]]:
     """
-    Produce data in the form in a single bulk SQL query:
+    Pair each package record with its extended fields in the form:
 
     {
-        <integer_package_id>: {
-            "Depends": [...],
-            "Conflicts": [...],
-            "License": [...]
-        }
+        "Depends": [...],
+        "Conflicts": [...],
+        "License": [...]
     }
 
-    The caller can then use this data to populate a dataset of packages.
+    Both `packages` and `extended` must be ordered by package ID, which
+    allows us to merge them as they are streamed from the database.
 
-    output = produce_base_output_data()
-    data = get_extended_dict(query)
-    for i in range(len(output)):
-        package_id = output[i].get("ID")
-        output[i].update(data.get(package_id))
+    :param packages: Package records
+    :param extended: Extended field records, see get_extended_fields()
+    :return: Iterator of (package, extended fields) tuples
     """
-
-    data = defaultdict(lambda: defaultdict(list))
-
-    for result in query:
-        pkgid = result[0]
-        key = TYPE_MAP.get(result[1], result[1])
-        output = result[2]
-        if result[3]:
-            output += result[3]
-        data[pkgid][key].append(output)
-
-    return data
-
-
-def get_extended_fields():
+    extended = iter(extended)
+    record = next(extended, None)
+
+    for package in packages:
+        data = defaultdict(list)
+        while record is not None and record.ID <= package.ID:
+            if record.ID == package.ID:
+                key = TYPE_MAP.get(record.Type, record.Type)
+                output = record.Name
+                if record.Cond:
+                    output += record.Cond
+                data[key].append(output)
+            record = next(extended, None)
+        yield package, data
+
+
+def get_extended_fields() -> orm.Query:
     subqueries = [
         # PackageDependency
         db.query(models.PackageDependency)
@@ -156,7 +170,7 @@ def get_extended_fields():
         .order_by("Name"),
     ]
     query = subqueries[0].union_all(*subqueries[1:])
-    return get_extended_dict(query)
+    return query.order_by("ID", "Name")
 
 
 EXTENDED_FIELD_HANDLERS = {"--extended": get_extended_fields}
@@ -181,35 +195,180 @@ def as_dict(package: Package) -> dict[str, Any]:
     }
 
 
-def sha256sum(file_path: str) -> str:
-    hash = hashlib.sha256()
-    with open(file_path, "rb") as f:
-        while chunk := f.read(io.DEFAULT_BUFFER_SIZE):
-            hash.update(chunk)
-    return hash.hexdigest()
+class HashingWriter:
+    """A file object wrapper hashing all data written through it."""
 
+    def __init__(self, fileobj: io.BufferedWriter, hash: "hashlib._Hash") -> None:
+        self.fileobj = fileobj
+        self.hash = hash
 
-def _main():
-    archivedir = aurweb.config.get("mkpkglists", "archivedir")
-    os.makedirs(archivedir, exist_ok=True)
+    def write(self, data: bytes) -> int:
+        self.hash.update(data)
+        return self.fileobj.write(data)
 
-    PACKAGES = aurweb.config.get("mkpkglists", "packagesfile")
-    META = aurweb.config.get("mkpkglists", "packagesmetafile")
-    META_EXT = aurweb.config.get("mkpkglists", "packagesmetaextfile")
-    PKGBASE = aurweb.config.get("mkpkglists", "pkgbasefile")
-    USERS = aurweb.config.get("mkpkglists", "userfile")
+    def flush(self) -> None:
+        self.fileobj.flush()
 
-    bench = Benchmark()
-    logger.warning("%s is deprecated and will be soon be removed", sys.argv[0])
-    logger.info("Started re-creating archives, wait a while...")
 
+class Archive(threading.Thread):
+    """An archive compressed by a worker thread.
+
+    Data passed to write() is buffered and handed over to the worker in
+    chunks. Compressors release the GIL while compressing, so archives
+    are compressed in parallel to each other and to the database reads.
+    The SHA-256 checksum of the archive is computed while it is written.
+
+    The archive is written to `path`.tmp; publish() moves it into place.
+    """
+
+    def __init__(self, path: str, format: str = "gz") -> None:
+        super().__init__(name=os.path.basename(path))
+        self.path = path
+        self.format = format
+        self.tmp = f"{path}.tmp"
+        self.sha256 = hashlib.sha256()
+        self.error = None
+
+        self._buffer = []
+        self._size = 0
+        self._queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.start()
+
+    def run(self) -> None:
+        try:
+            with open(self.tmp, "wb") as f:
+                fileobj = HashingWriter(f, self.sha256)
+                compressor = variants.compressor(self.format, fileobj, self.path)
+                with contextlib.closing(compressor):
+                    while (chunk := self._queue.get()) is not None:
+                        compressor.write(chunk)
+        except Exception as exc:
+            self.error = exc
+            # Keep consuming so that the producer never blocks on us.
+            while self._queue.get() is not None:
+                pass
+
+    def write(self, data: bytes) -> None:
+        self._buffer.append(data)
+        self._size += len(data)
+        if self._size >= BUFFER_SIZE:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._buffer:
+            self._queue.put(b"".join(self._buffer))
+            self._buffer = []
+            self._size = 0
+
+    def close(self) -> None:
+        """Wait for the worker to finish writing the archive."""
+        self._flush()
+        self._queue.put(None)
+        self.join()
+        if self.error:
+            raise self.error
+
+    def publish(self) -> None:
+        """Write the checksum file and move the archive into place."""
+        base = os.path.basename(self.path)
+        with open(f"{self.path}.sha256", "w") as f:
+            f.write(f"SHA256 ({base}) = {self.sha256.hexdigest()}")
+
+        # Move the new archive into its rightful place.
+        shutil.move(self.tmp, self.path)
+
+
+class Variants:
+    """A gzip archive published along with its variants.
+
+    Each format is compressed by its own Archive worker.
+    """
+
+    def __init__(self, path: str, formats: Iterable[str] = ()) -> None:
+        self.path = path
+        self.archives = [
+            Archive(variants.path(path, fmt), fmt) for fmt in ("gz", *formats)
+        ]
+
+    @property
+    def sha256(self) -> "hashlib._Hash":
+        return self.archives[0].sha256
+
+    def write(self, data: bytes) -> None:
+        for archive in self.archives:
+            archive.write(data)
+
+    def close(self) -> None:
+        close_all(self.archives)
+
+    def publish(self) -> None:
+        util.apply_all(self.archives, lambda archive: archive.publish())
+
+
+def close_all(archives: Iterable[Archive | Variants]) -> None:
+    """Close all `archives`, raising the first error encountered."""
+    errors = []
+    for archive in archives:
+        try:
+            archive.close()
+        except Exception as exc:
+            errors.append(exc)
+
+    if errors:
+        raise errors[0]
+
+
+def render(
+    results: Iterable[tuple[Row, dict[str, list[str]]]], extended: bool
+) -> Iterator[segment.Entry]:
+    """Render package records into segment entries.
+
+    Each entry holds the package name, its packages-meta-v1 JSON object
+    and, if `extended`, its packages-meta-ext-v1 JSON object.
+
+    :param results: Iterator of (package, extended fields) tuples
+    :param extended: Whether to render extended JSON objects
+    :return: Iterator of entries keyed by package ID
+    """
+    snapshot_uri = aurweb.config.get("options", "snapshot_uri")
+    for result, data in results:
+        # Construct our result JSON dictionary.
+        item = as_dict(result)
+        item["URLPath"] = snapshot_uri % result.Name
+        meta = orjson.dumps(item)
+
+        meta_ext = b""
+        if extended:
+            item.update(data)
+            meta_ext = orjson.dumps(item)
+
+        key = f"{result.ID:012d}"
+        fields = (result.Name.encode(), meta, meta_ext)
+        yield segment.Entry(key, result.PackageBaseID, fields)
+
+
+def package_entries(
+    extended: bool, session: orm.Session, previous: segment.Segment | None
+) -> Iterator[segment.Entry]:
+    """Produce entries of all packages, ordered by package ID.
+
+    :param extended: Whether to include extended fields
+    :param session: Session used to stream extended fields
+    :param previous: Previous segment for an incremental run, or None
+    :return: Iterator of entries
+    """
     Submitter = orm.aliased(User)
 
+    criteria = []
+    if previous:
+        criteria.append(segment.changed_since(previous.state))
+
     query = (
         db.query(Package)
         .join(PackageBase, PackageBase.ID == Package.PackageBaseID)
         .join(User, PackageBase.MaintainerUID == User.ID, isouter=True)
         .join(Submitter, PackageBase.SubmitterUID == Submitter.ID, isouter=True)
+        .filter(*criteria)
         .with_entities(
             Package.ID,
             Package.Name,
@@ -226,108 +385,198 @@ def _main():
             PackageBase.SubmittedTS.label("FirstSubmitted"),
             PackageBase.ModifiedTS.label("LastModified"),
         )
-        .order_by("Name")
+        .order_by(Package.ID)
+        .yield_per(CHUNK_SIZE)
     )
 
-    # Produce packages-meta-v1.json.gz
-    output = []
-    snapshot_uri = aurweb.config.get("options", "snapshot_uri")
+    data = []
+    if extended:
+        # Extended records are streamed alongside package records;
+        # use a separate connection so both cursors can stay open.
+        f = EXTENDED_FIELD_HANDLERS.get(sys.argv[1])
+        data = f().with_session(session)
+        if criteria:
+            ids = db.query(Package.ID).join(PackageBase).filter(*criteria)
+            data = data.filter(column("ID").in_(ids.statement))
+        data = data.yield_per(CHUNK_SIZE)
+
+    entries = render(merge_extended(query, data), extended)
+    if not previous:
+        return entries
+
+    # Splice re-rendered entries of changed package bases into the
+    # entries of the previous run.
+    changed = {row.ID for row in db.query(PackageBase.ID).filter(*criteria)}
+    existing = {row.ID for row in db.query(PackageBase.ID)}
+    return segment.splice(previous.entries, entries, changed, existing)
+
+
+def write_packages(
+    archives: dict[str, Variants],
+    entries: Iterable[segment.Entry],
+    writer: segment.Writer | None,
+) -> None:
+    """Write package entries to their archives and to `writer`."""
+    extended = "meta_ext" in archives
+
+    # Append list opening to the meta/meta_ext files.
+    archives.get("meta").write(b"[\n")
+    if extended:
+        archives.get("meta_ext").write(b"[\n")
 
-    tmp_packages = f"{PACKAGES}.tmp"
-    tmp_meta = f"{META}.tmp"
-    tmp_metaext = f"{META_EXT}.tmp"
-    gzips = {
-        "packages": gzip.GzipFile(
-            filename=PACKAGES, mode="wb", fileobj=open(tmp_packages, "wb")
-        ),
-        "meta": gzip.GzipFile(filename=META, mode="wb", fileobj=open(tmp_meta, "wb")),
-    }
+    count = 0
+    for count, entry in enumerate(entries, 1):
+        name, meta, meta_ext = entry.fields
 
-    # Append list opening to the metafile.
-    gzips["meta"].write(b"[\n")
+        # Append to packages.gz.
+        archives.get("packages").write(name + b"\n")
 
-    # Produce packages.gz + packages-meta-ext-v1.json.gz
-    extended = False
-    if len(sys.argv) > 1 and sys.argv[1] in EXTENDED_FIELD_HANDLERS:
-        gzips["meta_ext"] = gzip.GzipFile(
-            filename=META_EXT, mode="wb", fileobj=open(tmp_metaext, "wb")
-        )
-        # Append list opening to the meta_ext file.
-        gzips.get("meta_ext").write(b"[\n")
-        f = EXTENDED_FIELD_HANDLERS.get(sys.argv[1])
-        data = f()
-        extended = True
-
-    results = query.all()
-    n = len(results) - 1
-    with io.TextIOWrapper(gzips.get("packages")) as p:
-        for i, result in enumerate(results):
-            # Append to packages.gz.
-            p.write(f"{result.Name}\n")
-
-            # Construct our result JSON dictionary.
-            item = as_dict(result)
-            item["URLPath"] = snapshot_uri % result.Name
-
-            # We stream out package json objects line per line, so
-            # we also need to include the ',' character at the end
-            # of package lines (excluding the last package).
-            suffix = b",\n" if i < n else b"\n"
-
-            # Write out to packagesmetafile
-            output.append(item)
-            gzips.get("meta").write(orjson.dumps(output[-1]) + suffix)
-
-            if extended:
-                # Write out to packagesmetaextfile.
-                data_ = data.get(result.ID, {})
-                output[-1].update(data_)
-                gzips.get("meta_ext").write(orjson.dumps(output[-1]) + suffix)
-
-    # Append the list closing to meta/meta_ext.
-    gzips.get("meta").write(b"]")
+        # We stream out package json objects line per line, so
+        # we also need to include the ',' character at the end
+        # of the previous package line (excluding the first package).
+        prefix = b",\n" if count > 1 else b""
+
+        # Write out to packagesmetafile
+        archives.get("meta").write(prefix + meta)
+
+        if extended:
+            # Write out to packagesmetaextfile.
+            archives.get("meta_ext").write(prefix + meta_ext)
+
+        if writer:
+            writer.add(entry)
+
+    # Append the list closing to meta/meta_ext, terminating the last
+    # package line if there was one.
+    closing = b"\n]" if count else b"]"
+    archives.get("meta").write(closing)
     if extended:
-        gzips.get("meta_ext").write(b"]")
+        archives.get("meta_ext").write(closing)
 
-    # Close gzip files.
-    util.apply_all(gzips.values(), lambda gz: gz.close())
+
+def write_archives(
+    archives: dict[str, Variants],
+    entries: Iterable[segment.Entry],
+    writer: segment.Writer | None,
+) -> None:
+    """Write all archives, with package entries taken from `entries`."""
+    # Produce packages.gz + packages-meta-v1.json.gz
+    # + packages-meta-ext-v1.json.gz
+    write_packages(archives, entries, writer)
 
     # Produce pkgbase.gz
-    query = db.query(PackageBase.Name).all()
-    tmp_pkgbase = f"{PKGBASE}.tmp"
-    pkgbase_gzip = gzip.GzipFile(
-        filename=PKGBASE, mode="wb", fileobj=open(tmp_pkgbase, "wb")
-    )
-    with io.TextIOWrapper(pkgbase_gzip) as f:
-        f.writelines([f"{base.Name}\n" for i, base in enumerate(query)])
+    for base in db.query(PackageBase.Name).yield_per(CHUNK_SIZE):
+        archives.get("pkgbase").write(f"{base.Name}\n".encode())
 
     # Produce users.gz
-    query = db.query(User.Username).all()
-    tmp_users = f"{USERS}.tmp"
-    users_gzip = gzip.GzipFile(filename=USERS, mode="wb", fileobj=open(tmp_users, "wb"))
-    with io.TextIOWrapper(users_gzip) as f:
-        f.writelines([f"{user.Username}\n" for i, user in enumerate(query)])
-
-    files = [
-        (tmp_packages, PACKAGES),
-        (tmp_meta, META),
-        (tmp_pkgbase, PKGBASE),
-        (tmp_users, USERS),
-    ]
-    if len(sys.argv) > 1 and sys.argv[1] in EXTENDED_FIELD_HANDLERS:
-        files.append((tmp_metaext, META_EXT))
+    for user in db.query(User.Username).yield_per(CHUNK_SIZE):
+        archives.get("users").write(f"{user.Username}\n".encode())
 
-    for src, dst in files:
-        checksum = sha256sum(src)
-        base = os.path.basename(dst)
-        checksum_formatted = f"SHA256 ({base}) = {checksum}"
 
-        checksum_file = f"{dst}.sha256"
-        with open(checksum_file, "w") as f:
-            f.write(checksum_formatted)
+def track_deltas(
+    path: str, options: dict[str, Any]
+) -> tuple[list[dict], delta.Tracker | None]:
+    """Prepare comparing new entries against those of the segment at `path`.
 
-        # Move the new archive into its rightful place.
-        shutil.move(src, dst)
+    :param path: Segment file path
+    :param options: Generator options
+    :return: Tuple of the generation history and a Tracker, or None if
+             there is no previous segment to compare against
+    """
+    old = segment.read(path)
+    if not old or old.state.get("options") != options:
+        return [], None
+
+    generations = delta.load(f"{path}.history", options)
+    names = set().union(*(gen.get("changed") for gen in generations))
+    return generations, delta.Tracker(old.entries, names)
+
+
+def publish_deltas(
+    path: str,
+    options: dict[str, Any],
+    generations: list[dict],
+    tracker: delta.Tracker | None,
+    archives: dict[str, Variants],
+) -> None:
+    """Publish deltas of the JSON archives, see aurweb.archives.delta."""
+    # Entry field holding the objects of each JSON archive.
+    fields = {"meta": 1, "meta_ext": 2}
+    json_archives = {
+        archives.get(key).path: (archives.get(key).sha256.hexdigest(), index)
+        for key, index in fields.items()
+        if key in archives
+    }
+    limit = aurweb.config.getint("mkpkglists", "delta-generations")
+    history = f"{path}.history"
+    delta.publish(history, options, generations, tracker, json_archives, limit)
+
+
+def _main():
+    archivedir = aurweb.config.get("mkpkglists", "archivedir")
+    os.makedirs(archivedir, exist_ok=True)
+
+    PACKAGES = aurweb.config.get("mkpkglists", "packagesfile")
+    META = aurweb.config.get("mkpkglists", "packagesmetafile")
+    META_EXT = aurweb.config.get("mkpkglists", "packagesmetaextfile")
+    PKGBASE = aurweb.config.get("mkpkglists", "pkgbasefile")
+    USERS = aurweb.config.get("mkpkglists", "userfile")
+    SEGMENT = aurweb.config.get("mkpkglists", "segmentfile")
+    DELTAS = SEGMENT and aurweb.config.getint("mkpkglists", "delta-generations")
+
+    bench = Benchmark()
+    logger.warning("%s is deprecated and will be soon be removed", sys.argv[0])
+    logger.info("Started re-creating archives, wait a while...")
+
+    extended = len(sys.argv) > 1 and sys.argv[1] in EXTENDED_FIELD_HANDLERS
+    options = {"extended": extended}
+
+    # With a segment file, only re-render packages changed since the
+    # previous run, unless a full run is due.
+    writer, previous = None, None
+    generations, tracker = [], None
+    if SEGMENT:
+        interval = aurweb.config.getint("mkpkglists", "full-interval")
+        if DELTAS:
+            generations, tracker = track_deltas(SEGMENT, options)
+        state, previous = segment.prepare(SEGMENT, options, interval)
+        writer = segment.Writer(SEGMENT, state)
+        logger.info("Performing %s run.", "an incremental" if previous else "a full")
+
+    formats = variants.validate()
+    archives = {
+        "packages": Variants(PACKAGES, formats),
+        "meta": Variants(META, formats),
+        "pkgbase": Variants(PKGBASE, formats),
+        "users": Variants(USERS, formats),
+    }
+    if extended:
+        archives["meta_ext"] = Variants(META_EXT, formats)
+
+    # Session streaming extended records, see package_entries().
+    session = orm.Session(bind=db.get_engine())
+    try:
+        try:
+            entries = package_entries(extended, session, previous)
+            if tracker:
+                entries = tracker.track(entries)
+            write_archives(archives, entries, writer)
+        finally:
+            # Wait for all workers, even if producing records failed.
+            close_all(archives.values())
+
+        util.apply_all(archives.values(), lambda archive: archive.publish())
+        if DELTAS:
+            publish_deltas(SEGMENT, options, generations, tracker, archives)
+    except Exception:
+        if writer:
+            writer.abort()
+        raise
+    finally:
+        session.close()
+
+    if writer:
+        writer.commit()
 
     seconds = filters.number_format(bench.end(), 4)
     logger.info("Completed in %s seconds.", seconds)
@@ -6,6 +6,7 @@ import smtplib
 import subprocess
 import sys
 import textwrap
+from collections import defaultdict
 
 from sqlalchemy import and_, or_
 
@@ -13,7 +14,7 @@ import aurweb.config
 import aurweb.db
 import aurweb.filters
 import aurweb.l10n
-from aurweb import aur_logging, db
+from aurweb import aur_logging, db, outbox
 from aurweb.models import PackageBase, User
 from aurweb.models.package_comaintainer import PackageComaintainer
 from aurweb.models.package_comment import PackageComment
@@ -36,6 +37,23 @@ def headers_reply(thread_id):
 
 
 class Notification:
+    @classmethod
+    def from_attrs(cls, attrs: dict) -> "Notification":
+        """Return a notification with resolved attributes `attrs`.
+
+        Used to rebuild queued notifications and by batch constructors,
+        which resolve the attributes of many notifications at once.
+        """
+        notification = cls.__new__(cls)
+        notification.__dict__.update(attrs)
+        return notification
+
+    def get_args(self) -> list | None:
+        """Return the constructor arguments to queue this notification
+        with, or None to queue its resolved attributes; see aurweb.outbox.
+        """
+        return None
+
     def get_refs(self):
         return ()
 
@@ -59,69 +77,64 @@ class Notification:
             body += "\n" + "[%d] %s" % (i + 1, ref)
         return body.rstrip()
 
-    def _send(self) -> None:
+    def get_messages(self):
+        """Yield (recipients, message) tuples of this notification.
+
+        Subjects and bodies are rendered once per language.
+        """
         sender = aurweb.config.get("notifications", "sender")
         reply_to = aurweb.config.get("notifications", "reply-to")
         reason = self.__class__.__name__
         if reason.endswith("Notification"):
             reason = reason[: -len("Notification")]
+        cc, bcc = self.get_cc(), self.get_bcc()
+        headers = self.get_headers()
 
+        rendered = {}
         for recipient in self.get_recipients():
             to, lang = recipient
-            msg = email.mime.text.MIMEText(self.get_body_fmt(lang), "plain", "utf-8")
-            msg["Subject"] = self.get_subject(lang)
+            if lang not in rendered:
+                rendered[lang] = (self.get_subject(lang), self.get_body_fmt(lang))
+            subject, body = rendered[lang]
+
+            msg = email.mime.text.MIMEText(body, "plain", "utf-8")
+            msg["Subject"] = subject
             msg["From"] = sender
             msg["Reply-to"] = reply_to
             msg["To"] = to
-            if self.get_cc():
-                msg["Cc"] = ", ".join(self.get_cc())
+            if cc:
+                msg["Cc"] = ", ".join(cc)
             msg["X-AUR-Reason"] = reason
             msg["Date"] = email.utils.formatdate(localtime=True)
 
-            for key, value in self.get_headers().items():
+            for key, value in headers.items():
                 msg[key] = value
 
-            sendmail = aurweb.config.get("notifications", "sendmail")
-            if sendmail:
-                # send email using the sendmail binary specified in the
-                # configuration file
-                subprocess.run([sendmail, "-t", "-oi"], input=msg.as_bytes())
-            else:
-                # send email using smtplib; no local MTA required
-                server_addr = aurweb.config.get("notifications", "smtp-server")
-                server_port = aurweb.config.getint("notifications", "smtp-port")
-                use_ssl = aurweb.config.getboolean("notifications", "smtp-use-ssl")
-                use_starttls = aurweb.config.getboolean(
-                    "notifications", "smtp-use-starttls"
-                )
-                user = aurweb.config.get("notifications", "smtp-user")
-                passwd = aurweb.config.get("notifications", "smtp-password")
+            yield [to] + cc + bcc, msg
 
-                classes = {
-                    False: smtplib.SMTP,
-                    True: smtplib.SMTP_SSL,
-                }
-                smtp_timeout = aurweb.config.getint("notifications", "smtp-timeout")
-                server = classes[use_ssl](
-                    server_addr, server_port, timeout=smtp_timeout
-                )
+    def deliver(self, mailer: "Mailer") -> None:
+        """Deliver this notification through `mailer`, raising any errors."""
+        for deliver_to, msg in self.get_messages():
+            mailer.send(deliver_to, msg)
 
-                if use_starttls:
-                    server.ehlo()
-                    server.starttls()
-                    server.ehlo()
+    def send(self, mailer: "Mailer | None" = None) -> None:
+        """Send this notification.
 
-                if user and passwd:
-                    server.login(user, passwd)
+        Without a mailer, the notification is queued instead when
+        [notifications] queue is enabled; see aurweb.outbox.
 
-                server.set_debuglevel(0)
-                deliver_to = [to] + self.get_cc() + self.get_bcc()
-                server.sendmail(sender, deliver_to, msg.as_bytes())
-                server.quit()
+        :param mailer: Mailer to deliver through, a new one by default
+        """
+        if mailer is None and outbox.enabled():
+            outbox.enqueue([self])
+            return
 
-    def send(self) -> None:
         try:
-            self._send()
+            if mailer:
+                self.deliver(mailer)
+            else:
+                with Mailer() as mailer:
+                    self.deliver(mailer)
         except OSError as exc:
             logger.error(
                 "Unable to emit notification due to an "
@@ -130,6 +143,105 @@ class Notification:
             logger.error(str(exc))
 
 
+class Mailer:
+    """Delivers messages of notifications.
+
+    With SMTP, one connection is reused for up to [notifications]
+    smtp-batch-size messages before it is closed and a new one is
+    opened; 0 reuses it until the Mailer is closed. Otherwise, the
+    configured sendmail binary is run for every message.
+    """
+
+    def __init__(self) -> None:
+        self._server = None
+        self._count = 0
+        self._batch_size = aurweb.config.getint("notifications", "smtp-batch-size")
+
+    def __enter__(self) -> "Mailer":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _connect(self):
+        server_addr = aurweb.config.get("notifications", "smtp-server")
+        server_port = aurweb.config.getint("notifications", "smtp-port")
+        use_ssl = aurweb.config.getboolean("notifications", "smtp-use-ssl")
+        use_starttls = aurweb.config.getboolean("notifications", "smtp-use-starttls")
+        user = aurweb.config.get("notifications", "smtp-user")
+        passwd = aurweb.config.get("notifications", "smtp-password")
+
+        classes = {
+            False: smtplib.SMTP,
+            True: smtplib.SMTP_SSL,
+        }
+        smtp_timeout = aurweb.config.getint("notifications", "smtp-timeout")
+        server = classes[use_ssl](server_addr, server_port, timeout=smtp_timeout)
+
+        if use_starttls:
+            server.ehlo()
+            server.starttls()
+            server.ehlo()
+
+        if user and passwd:
+            server.login(user, passwd)
+
+        server.set_debuglevel(0)
+        return server
+
+    def send(self, deliver_to: list[str], msg) -> None:
+        """Deliver `msg` to the addresses in `deliver_to`."""
+        sendmail = aurweb.config.get("notifications", "sendmail")
+        if sendmail:
+            # send email using the sendmail binary specified in the
+            # configuration file
+            subprocess.run([sendmail, "-t", "-oi"], input=msg.as_bytes())
+            return
+
+        # send email using smtplib; no local MTA required
+        sender = aurweb.config.get("notifications", "sender")
+        reused = self._server is not None
+        try:
+            if not reused:
+                self._server = self._connect()
+            self._server.sendmail(sender, deliver_to, msg.as_bytes())
+        except smtplib.SMTPServerDisconnected:
+            # Servers close connections which have been idle for too
+            # long; retry once on a new one.
+            self._server = None
+            if not reused:
+                raise
+            self._server = self._connect()
+            self._server.sendmail(sender, deliver_to, msg.as_bytes())
+        except OSError:
+            self._server = None
+            raise
+
+        self._count += 1
+        if self._batch_size and self._count >= self._batch_size:
+            self.close()
+
+    def close(self) -> None:
+        """Close the SMTP connection, if any."""
+        server, self._server, self._count = self._server, None, 0
+        if server is not None:
+            try:
+                server.quit()
+            except OSError as exc:
+                logger.warning("Unable to close SMTP connection: %s", exc)
+
+
+def send_all(notifications: list[Notification]) -> None:
+    """Send `notifications` through a single Mailer, or queue them."""
+    if outbox.enabled():
+        outbox.enqueue(notifications)
+        return
+
+    with Mailer() as mailer:
+        for notification in notifications:
+            notification.send(mailer)
+
+
 class ResetKeyNotification(Notification):
     def __init__(self, uid):
         user = (
@@ -146,6 +258,7 @@ class ResetKeyNotification(Notification):
             .first()
         )
 
+        self._uid = uid
         self._username = user.Username
         self._to = user.Email
         self._backup = user.BackupEmail
@@ -154,6 +267,10 @@ class ResetKeyNotification(Notification):
 
         super().__init__()
 
+    def get_args(self):
+        # Keep the reset key out of the queue; it is read at delivery.
+        return [self._uid]
+
     def get_recipients(self):
         if self._backup:
             return [(self._to, self._lang), (self._backup, self._lang)]
@@ -208,6 +325,7 @@ class VerificationNotification(Notification):
             .first()
         )
 
+        self._uid = uid
         self._username = user.Username
         self._to = user.Email
         self._backup = user.BackupEmail
@@ -216,6 +334,10 @@ class VerificationNotification(Notification):
 
         super().__init__()
 
+    def get_args(self):
+        # Keep the token out of the queue; it is read at delivery.
+        return [self._uid]
+
     def get_recipients(self):
         if self._backup:
             return [(self._to, self._lang), (self._backup, self._lang)]
@@ -249,6 +371,9 @@ class VerificationReminderNotification(VerificationNotification):
         self._days_left = days_left
         super().__init__(uid)
 
+    def get_args(self):
+        return [self._uid, self._days_left]
+
     def get_subject(self, lang):
         return aurweb.l10n.translator.translate("AUR Account Pending Deletion", lang)
 
@@ -719,11 +844,20 @@ class RequestOpenNotification(Notification):
 
 class RequestCloseNotification(Notification):
     def __init__(self, uid, reqid, reason):
-        user = db.query(User.Username).filter(User.ID == uid).first()
-        self._user = user.Username if user else None
+        (notification,) = self.batch(uid, [reqid], reason)
+        self.__dict__.update(vars(notification))
 
-        self._to = aurweb.config.get("options", "aur_request_ml")
+    @classmethod
+    def batch(cls, uid, reqids, reason) -> list["RequestCloseNotification"]:
+        """Return notifications of `uid` closing the requests `reqids`.
+
+        Recipients and requests are resolved in one query each.
+        """
+        user = db.query(User.Username).filter(User.ID == uid).first()
+        username = user.Username if user else None
+        to = aurweb.config.get("options", "aur_request_ml")
 
+        reqids = [int(reqid) for reqid in reqids]
         query = (
             db.query(PackageRequest)
             .join(PackageBase)
@@ -740,31 +874,43 @@ class RequestCloseNotification(Notification):
                     User.ID == PackageComaintainer.UsersID,
                 ),
             )
-            .filter(and_(PackageRequest.ID == reqid, User.Suspended == 0))
-            .with_entities(User.Email, User.HideEmail)
+            .filter(and_(PackageRequest.ID.in_(reqids), User.Suspended == 0))
+            .with_entities(PackageRequest.ID, User.Email, User.HideEmail)
             .distinct()
         )
-        self._cc = [u.Email for u in query if u.HideEmail == 0]
-        self._bcc = [u.Email for u in query if u.HideEmail == 1]
+        cc, bcc = defaultdict(list), defaultdict(list)
+        for row in query:
+            (bcc if row.HideEmail == 1 else cc)[row.ID].append(row.Email)
 
-        pkgreq = (
+        query = (
             db.query(PackageRequest)
             .join(RequestType)
-            .filter(PackageRequest.ID == reqid)
+            .filter(PackageRequest.ID.in_(reqids))
             .with_entities(
+                PackageRequest.ID,
                 PackageRequest.ClosureComment,
                 RequestType.Name,
                 PackageRequest.PackageBaseName,
             )
-            .first()
         )
-
-        self._text = pkgreq.ClosureComment
-        self._reqtype = pkgreq.Name
-        self._pkgbase = pkgreq.PackageBaseName
-
-        self._reqid = int(reqid)
-        self._reason = reason
+        pkgreqs = {pkgreq.ID: pkgreq for pkgreq in query}
+
+        return [
+            cls.from_attrs(
+                {
+                    "_user": username,
+                    "_to": to,
+                    "_cc": cc[reqid],
+                    "_bcc": bcc[reqid],
+                    "_text": pkgreqs[reqid].ClosureComment,
+                    "_reqtype": pkgreqs[reqid].Name,
+                    "_pkgbase": pkgreqs[reqid].PackageBaseName,
+                    "_reqid": reqid,
+                    "_reason": reason,
+                }
+            )
+            for reqid in reqids
+        ]
 
     def get_recipients(self):
         return [(self._to, "en")]
@@ -815,23 +961,42 @@ class RequestCloseNotification(Notification):
 
 class VoteReminderNotification(Notification):
     def __init__(self, vote_id):
-        self._vote_id = int(vote_id)
+        (notification,) = self.batch([vote_id])
+        self.__dict__.update(vars(notification))
+
+    @classmethod
+    def batch(cls, vote_ids) -> list["VoteReminderNotification"]:
+        """Return reminders of the votes `vote_ids`.
 
-        subquery = db.query(Vote.UserID).filter(Vote.VoteID == vote_id)
+        Package Maintainers and their votes are resolved in one query
+        each, rather than once per vote.
+        """
+        vote_ids = [int(vote_id) for vote_id in vote_ids]
         query = (
             db.query(User)
-            .filter(
-                and_(
-                    User.AccountTypeID.in_((2, 4)),
-                    ~User.ID.in_(subquery),
-                    User.Suspended == 0,
-                )
-            )
-            .with_entities(User.Email, User.LangPreference)
+            .filter(and_(User.AccountTypeID.in_((2, 4)), User.Suspended == 0))
+            .with_entities(User.ID, User.Email, User.LangPreference)
         )
-        self._recipients = [(u.Email, u.LangPreference) for u in query]
-
-        super().__init__()
+        maintainers = query.all()
+
+        voted = defaultdict(set)
+        query = db.query(Vote).filter(Vote.VoteID.in_(vote_ids))
+        for vote_id, user_id in query.with_entities(Vote.VoteID, Vote.UserID):
+            voted[vote_id].add(user_id)
+
+        return [
+            cls.from_attrs(
+                {
+                    "_vote_id": vote_id,
+                    "_recipients": [
+                        (u.Email, u.LangPreference)
+                        for u in maintainers
+                        if u.ID not in voted[vote_id]
+                    ],
+                }
+            )
+            for vote_id in vote_ids
+        ]
 
     def get_recipients(self):
         return self._recipients
@@ -852,27 +1017,30 @@ class VoteReminderNotification(Notification):
         return (aur_location + "/package-maintainer/?id=" + str(self._vote_id),)
 
 
+# Notifications by notify-cmd action.
+ACTIONS = {
+    "send-resetkey": ResetKeyNotification,
+    "welcome": WelcomeNotification,
+    "comment": CommentNotification,
+    "update": UpdateNotification,
+    "flag": FlagNotification,
+    "adopt": AdoptNotification,
+    "disown": DisownNotification,
+    "comaintainer-add": ComaintainerAddNotification,
+    "comaintainer-remove": ComaintainerRemoveNotification,
+    "delete": DeleteNotification,
+    "request-open": RequestOpenNotification,
+    "request-close": RequestCloseNotification,
+    "vote-reminder": VoteReminderNotification,
+}
+
+
 def main() -> None:
     db.get_engine()
     action = sys.argv[1]
-    action_map = {
-        "send-resetkey": ResetKeyNotification,
-        "welcome": WelcomeNotification,
-        "comment": CommentNotification,
-        "update": UpdateNotification,
-        "flag": FlagNotification,
-        "adopt": AdoptNotification,
-        "disown": DisownNotification,
-        "comaintainer-add": ComaintainerAddNotification,
-        "comaintainer-remove": ComaintainerRemoveNotification,
-        "delete": DeleteNotification,
-        "request-open": RequestOpenNotification,
-        "request-close": RequestCloseNotification,
-        "vote-reminder": VoteReminderNotification,
-    }
 
     with db.begin():
-        notification = action_map[action](*sys.argv[2:])
+        notification = ACTIONS[action](*sys.argv[2:])
     notification.send()
 
 
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""Deliver notifications queued in NotificationQueue, see aurweb.outbox."""
+
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from aurweb import aur_logging, config, db, outbox
+from aurweb.scripts import notify
+
+logger = aur_logging.get_logger(__name__)
+
+
+class Worker:
+    """Delivers claimed notifications concurrently.
+
+    Notifications are resolved on the calling thread, which owns the
+    database session, and delivered by [notifications]
+    queue-concurrency threads with a Mailer each.
+    """
+
+    def __init__(self, concurrency: int) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._local = threading.local()
+        self._mailers = []
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "Worker":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _deliver(self, notification: notify.Notification) -> None:
+        mailer = getattr(self._local, "mailer", None)
+        if mailer is None:
+            mailer = self._local.mailer = notify.Mailer()
+            with self._lock:
+                self._mailers.append(mailer)
+        notification.deliver(mailer)
+
+    def process(self, limit: int) -> int:
+        """Claim and deliver up to `limit` notifications.
+
+        :return: Number of notifications claimed
+        """
+        token, rows = outbox.claim(limit)
+
+        futures, failures = {}, []
+        for row in rows:
+            try:
+                with db.begin():
+                    notification = outbox.resolve(row.Type, row.Payload)
+            except Exception as exc:
+                failures.append((row, exc))
+                continue
+            futures[self._executor.submit(self._deliver, notification)] = row
+
+        delivered = []
+        for future in as_completed(futures):
+            row = futures[future]
+            if exc := future.exception():
+                failures.append((row, exc))
+            else:
+                delivered.append(row.ID)
+
+        for row, exc in failures:
+            logger.warning(
+                "Unable to deliver notification %d (%s, attempt %d): %r",
+                row.ID,
+                row.Type,
+                row.Attempts,
+                exc,
+            )
+        outbox.complete(token, delivered)
+        outbox.fail(token, [(row, repr(exc)) for row, exc in failures])
+        return len(rows)
+
+    def close(self) -> None:
+        self._executor.shutdown()
+        for mailer in self._mailers:
+            mailer.close()
+
+
+def run(once: bool = False) -> None:
+    """Deliver queued notifications until interrupted.
+
+    :param once: Return once the queue has no available notifications
+    """
+    concurrency = config.getint("notifications", "queue-concurrency")
+    batch_size = config.getint("notifications", "queue-batch-size")
+    poll_interval = float(config.get("notifications", "queue-poll-interval"))
+
+    with Worker(concurrency) as worker:
+        while True:
+            if worker.process(batch_size):
+                continue
+            if once:
+                return
+            time.sleep(poll_interval)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Deliver queued notifications.")
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help="exit once no queued notifications are available",
+    )
+    parser.add_argument(
+        "--requeue-failed",
+        action="store_true",
+        help="retry notifications which exhausted their attempts and exit",
+    )
+    args = parser.parse_args()
+
+    db.get_engine()
+    if args.requeue_failed:
+        print(f"Requeued {outbox.requeue_failed()} notifications.")
+        return
+    run(args.once)
+
+
+if __name__ == "__main__":
+    main()
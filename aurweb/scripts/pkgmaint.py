@@ -4,6 +4,7 @@ from sqlalchemy import and_
 
 from aurweb import db, time
 from aurweb.models import PackageBase
+from aurweb.packages.index import bump_generation
 
 
 def _main() -> None:
@@ -26,6 +27,7 @@ def main() -> None:
     db.get_engine()
     with db.begin():
         _main()
+    bump_generation()
 
 
 if __name__ == "__main__":
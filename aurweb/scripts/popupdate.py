@@ -1,72 +1,44 @@
 #!/usr/bin/env python3
+import argparse
+import sys
 from datetime import datetime
 
-from sqlalchemy import and_, func
-from sqlalchemy.sql.functions import coalesce
-from sqlalchemy.sql.functions import sum as _sum
-
 from aurweb import config, db, time
-from aurweb.models import PackageBase, PackageVote
+from aurweb.models import PackageBase
+from aurweb.pkgbase import popularity, version
 
 
 def run_variable(pkgbases: list[PackageBase] = []) -> None:
     """
     Update popularity on a list of PackageBases.
 
-    If no PackageBase is included, we update the popularity
-    of every PackageBase in the database.
+    If no PackageBase is included, we rescale the popularity of every
+    PackageBase which was not updated during the last popularity
+    interval. Its score is maintained incrementally as votes change,
+    so only the decay since the last update has to be applied. Package
+    bases are updated in chunks, see popularity.update_chunked().
+
+    If PackageBases are given, their votes and popularity are
+    recomputed from their PackageVote records.
 
     :param pkgbases: List of PackageBase instances
     """
     now = time.utcnow()
 
-    # NumVotes subquery.
-    votes_subq = (
-        db.get_session()
-        .query(func.count("*"))
-        .select_from(PackageVote)
-        .filter(PackageVote.PackageBaseID == PackageBase.ID)
-    )
-
-    # Popularity subquery.
-    pop_subq = (
-        db.get_session()
-        .query(
-            coalesce(_sum(func.pow(0.98, (now - PackageVote.VoteTS) / 86400)), 0.0),
-        )
-        .select_from(PackageVote)
-        .filter(
-            and_(
-                PackageVote.PackageBaseID == PackageBase.ID,
-                PackageVote.VoteTS.isnot(None),
-            )
-        )
-    )
-
-    with db.begin():
-        query = db.query(PackageBase)
-
-        ids = set()
-        if pkgbases:
-            # If `pkgbases` were given, we should forcefully update the given
-            # package base records' popularities.
-            ids = {pkgbase.ID for pkgbase in pkgbases}
-            query = query.filter(PackageBase.ID.in_(ids))
-        else:
-            # Otherwise, we should only update popularities which have exceeded
-            # the popularity interval length.
-            interval = config.getint("git-archive", "popularity-interval")
-            query = query.filter(
-                PackageBase.PopularityUpdated
-                <= datetime.fromtimestamp((now - interval))
-            )
-
-        query.update(
-            {
-                "NumVotes": votes_subq.scalar_subquery(),
-                "Popularity": pop_subq.scalar_subquery(),
-                "PopularityUpdated": datetime.fromtimestamp(now),
-            }
+    if pkgbases:
+        # If `pkgbases` were given, we should forcefully update the given
+        # package base records' popularities.
+        ids = {pkgbase.ID for pkgbase in pkgbases}
+        popularity.recompute(ids, now)
+
+        # Bulk updates bypass the ORM, so bump package base versions here.
+        version.bump(*ids)
+    else:
+        # Otherwise, we should only update popularities which have exceeded
+        # the popularity interval length.
+        interval = config.getint("git-archive", "popularity-interval")
+        popularity.rescale(
+            PackageBase.PopularityUpdated <= datetime.fromtimestamp(now - interval)
         )
 
 
@@ -82,8 +54,44 @@ def run_single(pkgbase: PackageBase) -> None:
     db.refresh(pkgbase)
 
 
+def check(fix: bool = False) -> int:
+    """Compare incremental popularity against popularity computed from votes.
+
+    :param fix: Recompute package bases which differ
+    :return: Number of package bases which differ
+    """
+    now = time.utcnow()
+    mismatches = popularity.check(now)
+    for pkgbase_id, num_votes, score, votes, expected in mismatches:
+        print(
+            f"PackageBase {pkgbase_id}: NumVotes {num_votes}, "
+            f"popularity {score:.6f}; expected {votes}, {expected:.6f}"
+        )
+
+    if fix and mismatches:
+        ids = {pkgbase_id for pkgbase_id, *_ in mismatches}
+        popularity.recompute(ids, now)
+        version.bump(*ids)
+    return len(mismatches)
+
+
 def main() -> None:
+    parser = argparse.ArgumentParser(description="Update package popularity.")
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="compare incremental popularity against the votes table",
+    )
+    parser.add_argument(
+        "--fix",
+        action="store_true",
+        help="with --check, recompute package bases which differ",
+    )
+    args = parser.parse_args()
+
     db.get_engine()
+    if args.check:
+        sys.exit(1 if check(args.fix) else 0)
     run_variable()
 
 
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-from aurweb import config, db, time, util
+from aurweb import config, db, time
 from aurweb.models import PackageRequest
 from aurweb.models.package_request import PENDING_ID, REJECTED_ID
 from aurweb.models.request_type import ADOPTION_ID
@@ -17,7 +17,7 @@ def _main() -> list[notify.Notification]:
         PackageRequest.RequestTS < limit_to,
     )
 
-    notifs = []
+    reqids = []
     for pkgreq in query:
         pkgreq.Status = REJECTED_ID
         pkgreq.ClosedTS = now
@@ -25,9 +25,12 @@ def _main() -> list[notify.Notification]:
             f"[Autogenerated] Rejected adoption for {pkgreq.PackageBaseName}: "
             "no Package Maintainer acted on this request in time."
         )
-        notifs.append(notify.RequestCloseNotification(0, pkgreq.ID, "rejected"))
+        reqids.append(pkgreq.ID)
 
-    return notifs
+    # Notifications are resolved from the database; include the closure
+    # comments set above.
+    db.get_session().flush()
+    return notify.RequestCloseNotification.batch(0, reqids, "rejected")
 
 
 def main() -> None:
@@ -35,7 +38,7 @@ def main() -> None:
     with db.begin():
         notifs = _main()
 
-    util.apply_all(notifs, lambda n: n.send())
+    notify.send_all(notifs)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+"""Refresh the cached statistics snapshot, see aurweb.statistics.
+
+Run more often than [cache] expiry_time_statistics, so that request
+handlers never have to compute the statistics themselves.
+"""
+
+from aurweb import db, statistics
+
+
+def main() -> None:
+    db.get_engine()
+    statistics.Statistics(statistics.cache_expire).refresh()
+
+
+if __name__ == "__main__":
+    main()
@@ -26,9 +26,8 @@ def main() -> None:
     query = db.query(VoteInfo.ID).filter(
         and_(VoteInfo.End >= filter_from, VoteInfo.End <= filter_to)
     )
-    for voteinfo in query:
-        notif = notify.VoteReminderNotification(voteinfo.ID)
-        notif.send()
+    notifs = notify.VoteReminderNotification.batch(voteinfo.ID for voteinfo in query)
+    notify.send_all(notifs)
 
 
 if __name__ == "__main__":
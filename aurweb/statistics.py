@@ -1,7 +1,10 @@
-from sqlalchemy import func
+import asyncio
 
-from aurweb import config, db, time
-from aurweb.cache import db_count_cache, db_query_cache
+import orjson
+from sqlalchemy import and_, case, func, orm
+
+from aurweb import aur_logging, config, db, time
+from aurweb.cache import cached, db_query_cache, store
 from aurweb.models import PackageBase, PackageRequest, RequestType, User
 from aurweb.models.account_type import (
     PACKAGE_MAINTAINER_AND_DEV_ID,
@@ -16,6 +19,8 @@ from aurweb.models.package_request import (
 )
 from aurweb.prometheus import PACKAGES, REQUESTS, USERS
 
+logger = aur_logging.get_logger(__name__)
+
 cache_expire = config.getint("cache", "expiry_time_statistics", 300)
 
 HOMEPAGE_COUNTERS = [
@@ -45,106 +50,126 @@ PROMETHEUS_PACKAGE_COUNTERS = [
     ("updated_packages", "updated"),
 ]
 
+# Counters computed by a single scan of each table.
+PACKAGE_BASE_COUNTERS = [
+    "package_count",
+    "orphan_count",
+    "seven_days_old_added",
+    "seven_days_old_updated",
+    "year_old_updated",
+    "never_updated",
+    "updated_packages",
+]
+USER_COUNTERS = [
+    "user_count",
+    "package_maintainer_count",
+    "regular_user_count",
+]
+
+# Cache key of the snapshot of all counters.
+SNAPSHOT_KEY = "statistics"
+
+
+def _count(condition=None):
+    if condition is None:
+        return func.count()
+    return func.count(case([(condition, 1)]))
+
 
 class Statistics:
     seven_days = 86400 * 7
     one_hour = 3600
     year = seven_days * 52
 
-    def __init__(self, cache_expire: int | None = None) -> None:
+    def __init__(
+        self, cache_expire: int | None = None, session: orm.Session | None = None
+    ) -> None:
         self.expiry_time = cache_expire
-        self.now = time.utcnow()
-        self.seven_days_ago = self.now - self.seven_days
-        self.year_ago = self.now - self.year
-
-        self.user_query = db.query(User)
-        self.bases_query = db.query(PackageBase)
-        self.updated_query = db.query(PackageBase).filter(
-            PackageBase.ModifiedTS - PackageBase.SubmittedTS >= self.one_hour
+        self.session = session or db.get_session()
+
+    def _compute(self) -> dict[str, int]:
+        """Compute all counters with one query per table."""
+        now = time.utcnow()
+        seven_days_ago = now - self.seven_days
+        year_ago = now - self.year
+
+        age = PackageBase.ModifiedTS - PackageBase.SubmittedTS
+        updated = age >= self.one_hour
+        orphan = PackageBase.MaintainerUID.is_(None)
+        package_bases = self.session.query(PackageBase).with_entities(
+            _count(),
+            _count(orphan),
+            _count(PackageBase.SubmittedTS >= seven_days_ago),
+            _count(and_(updated, PackageBase.ModifiedTS >= seven_days_ago)),
+            _count(and_(updated, PackageBase.ModifiedTS >= year_ago)),
+            _count(age < self.one_hour),
+            _count(and_(age > self.one_hour, ~orphan)),
         )
-        self.request_query = db.query(PackageRequest)
-
-    def get_count(self, counter: str) -> int:  # noqa: C901
-        query = None
-        match counter:
-            # Packages
-            case "package_count":
-                query = self.bases_query
-            case "orphan_count":
-                query = self.bases_query.filter(PackageBase.MaintainerUID.is_(None))
-            case "seven_days_old_added":
-                query = self.bases_query.filter(
-                    PackageBase.SubmittedTS >= self.seven_days_ago
-                )
-            case "seven_days_old_updated":
-                query = self.updated_query.filter(
-                    PackageBase.ModifiedTS >= self.seven_days_ago
-                )
-            case "year_old_updated":
-                query = self.updated_query.filter(
-                    PackageBase.ModifiedTS >= self.year_ago
-                )
-            case "never_updated":
-                query = self.bases_query.filter(
-                    PackageBase.ModifiedTS - PackageBase.SubmittedTS < self.one_hour
-                )
-            case "updated_packages":
-                query = self.bases_query.filter(
-                    PackageBase.ModifiedTS - PackageBase.SubmittedTS > self.one_hour,
-                    ~PackageBase.MaintainerUID.is_(None),
-                )
-            # Users
-            case "user_count":
-                query = self.user_query
-            case "package_maintainer_count":
-                query = self.user_query.filter(
-                    User.AccountTypeID.in_(
-                        (
-                            PACKAGE_MAINTAINER_ID,
-                            PACKAGE_MAINTAINER_AND_DEV_ID,
-                        )
-                    )
-                )
-            case "regular_user_count":
-                query = self.user_query.filter(User.AccountTypeID == USER_ID)
-
-            # Requests
-            case "total_requests":
-                query = self.request_query
-            case "pending_requests":
-                query = self.request_query.filter(PackageRequest.Status == PENDING_ID)
-            case "closed_requests":
-                query = self.request_query.filter(PackageRequest.Status == CLOSED_ID)
-            case "accepted_requests":
-                query = self.request_query.filter(PackageRequest.Status == ACCEPTED_ID)
-            case "rejected_requests":
-                query = self.request_query.filter(PackageRequest.Status == REJECTED_ID)
-            case _:
-                return -1
-
-        return db_count_cache(counter, query, expire=self.expiry_time)
-
-
-def update_prometheus_metrics() -> None:
-    stats = Statistics(cache_expire)
+
+        maintainer_types = (PACKAGE_MAINTAINER_ID, PACKAGE_MAINTAINER_AND_DEV_ID)
+        users = self.session.query(User).with_entities(
+            _count(),
+            _count(User.AccountTypeID.in_(maintainer_types)),
+            _count(User.AccountTypeID == USER_ID),
+        )
+
+        requests = self.session.query(PackageRequest).with_entities(
+            _count(),
+            _count(PackageRequest.Status == PENDING_ID),
+            _count(PackageRequest.Status == CLOSED_ID),
+            _count(PackageRequest.Status == ACCEPTED_ID),
+            _count(PackageRequest.Status == REJECTED_ID),
+        )
+
+        snapshot = {}
+        for counters, query in (
+            (PACKAGE_BASE_COUNTERS, package_bases),
+            (USER_COUNTERS, users),
+            (REQUEST_COUNTERS, requests),
+        ):
+            snapshot.update(zip(counters, (int(n or 0) for n in query.one())))
+        return snapshot
+
+    def snapshot(self) -> dict[str, int]:
+        """Return all counters from cache, computing them when missing."""
+        result = cached(
+            SNAPSHOT_KEY,
+            lambda: orjson.dumps(self._compute()),
+            self.expiry_time,
+            local=True,
+        )
+        return orjson.loads(result)
+
+    def refresh(self) -> dict[str, int]:
+        """Compute all counters and store them in the cache."""
+        snapshot = self._compute()
+        store(SNAPSHOT_KEY, orjson.dumps(snapshot), self.expiry_time)
+        return snapshot
+
+    def get_count(self, counter: str) -> int:
+        return self.snapshot().get(counter, -1)
+
+
+def update_prometheus_metrics(session: orm.Session | None = None) -> None:
+    session = session or db.get_session()
+    snapshot = Statistics(cache_expire, session).snapshot()
     # Users gauge
     for counter, utype in PROMETHEUS_USER_COUNTERS:
-        count = stats.get_count(counter)
-        USERS.labels(utype).set(count)
+        USERS.labels(utype).set(snapshot[counter])
 
     # Packages gauge
     for counter, state in PROMETHEUS_PACKAGE_COUNTERS:
-        count = stats.get_count(counter)
-        PACKAGES.labels(state).set(count)
+        PACKAGES.labels(state).set(snapshot[counter])
 
     # Requests gauge
     query = (
-        db.get_session()
-        .query(PackageRequest, func.count(PackageRequest.ID), RequestType.Name)
+        session.query(PackageRequest, func.count(PackageRequest.ID), RequestType.Name)
         .join(RequestType)
         .group_by(RequestType.Name, PackageRequest.Status)
     )
-    results = db_query_cache("request_metrics", query, cache_expire)
+    results = db_query_cache(
+        "request_metrics", query, cache_expire, local=True, namespace="statistics"
+    )
     for record in results:
         status = record[0].status_display()
         count = record[1]
@@ -152,13 +177,33 @@ def update_prometheus_metrics() -> None:
         REQUESTS.labels(type=rtype, status=status).set(count)
 
 
-def _get_counts(counters: list[str]) -> dict[str, int]:
-    stats = Statistics(cache_expire)
-    result = {}
-    for counter in counters:
-        result[counter] = stats.get_count(counter)
+def _update_metrics() -> None:
+    # The global session belongs to the event loop's thread.
+    session = orm.Session(bind=db.get_engine())
+    try:
+        update_prometheus_metrics(session)
+    finally:
+        session.close()
+
 
-    return result
+async def collect_metrics(interval: float) -> None:
+    """Update the statistics gauges every `interval` seconds until
+    cancelled, so that scrapes of /metrics do not have to.
+
+    Updates run in a thread with a session of their own, keeping their
+    queries off the event loop.
+    """
+    while True:
+        try:
+            await asyncio.to_thread(_update_metrics)
+        except Exception:
+            logger.exception("Unable to update statistics metrics.")
+        await asyncio.sleep(interval)
+
+
+def _get_counts(counters: list[str]) -> dict[str, int]:
+    snapshot = Statistics(cache_expire).snapshot()
+    return {counter: snapshot[counter] for counter in counters}
 
 
 def get_homepage_counts() -> dict[str, int]:
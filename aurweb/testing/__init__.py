@@ -1,5 +1,5 @@
 import aurweb.db
-from aurweb import models
+from aurweb import cache, models, schema
 
 
 def setup_test_db(*args):
@@ -48,6 +48,7 @@ def setup_test_db(*args):
             models.PackageRequest.__tablename__,
             models.PackageSource.__tablename__,
             models.PackageVote.__tablename__,
+            schema.NotificationQueue.name,
             models.Session.__tablename__,
             models.SSHPubKey.__tablename__,
             models.Term.__tablename__,
@@ -61,3 +62,6 @@ def setup_test_db(*args):
         aurweb.db.get_session().execute(f"DELETE FROM {table}")
     aurweb.db.get_session().execute("SET FOREIGN_KEY_CHECKS = 1")
     aurweb.db.get_session().expunge_all()
+
+    # Forget values computed from the records deleted above.
+    cache.clear_local()
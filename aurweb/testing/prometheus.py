@@ -2,7 +2,10 @@ from aurweb import prometheus
 
 
 def clear_metrics() -> None:
+    prometheus.CACHE_REQUESTS.clear()
+    prometheus.CACHE_SECONDS.clear()
     prometheus.PACKAGES.clear()
     prometheus.REQUESTS.clear()
+    prometheus.RPC_STAGE_SECONDS.clear()
     prometheus.SEARCH_REQUESTS.clear()
     prometheus.USERS.clear()
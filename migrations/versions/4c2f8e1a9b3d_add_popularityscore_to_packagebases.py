@@ -0,0 +1,55 @@
+"""Add PopularityScore to PackageBases
+
+Revision ID: 4c2f8e1a9b3d
+Revises: d9b3f27c8e51
+Create Date: 2026-10-18 12:00:00.000000
+
+Scores are initialized from existing votes at the reference time of
+aurweb.pkgbase.popularity, whose constants are repeated here so that
+this revision does not depend on how the application evolves.
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.exc import OperationalError
+
+from aurweb.models.package_base import PackageBase
+
+# revision identifiers, used by Alembic.
+revision = "4c2f8e1a9b3d"
+down_revision = "d9b3f27c8e51"
+branch_labels = None
+depends_on = None
+
+table = PackageBase.__table__
+
+# Daily decay of vote weights, seconds a day and the reference time.
+DECAY = 0.98
+DAY = 86400
+EPOCH = 1577836800
+
+
+def upgrade():
+    try:
+        op.add_column(table.name, table.c.PopularityScore)
+    except OperationalError:
+        print(
+            f"Column PopularityScore already exists in '{table.name}',"
+            f" skipping migration."
+        )
+        return
+
+    # Initialize scores from existing votes. VoteTS is unsigned, so it is
+    # cast before being subtracted from EPOCH.
+    op.execute(
+        sa.text(
+            f"UPDATE `{table.name}` SET `PopularityScore` = COALESCE(("
+            "SELECT SUM(POW(:decay, (:epoch - CAST(`VoteTS` AS SIGNED)) / :day)) "
+            "FROM `PackageVotes` "
+            f"WHERE `PackageVotes`.`PackageBaseID` = `{table.name}`.`ID`), 0)"
+        ).bindparams(decay=DECAY, epoch=EPOCH, day=DAY)
+    )
+
+
+def downgrade():
+    op.drop_column(table.name, "PopularityScore")
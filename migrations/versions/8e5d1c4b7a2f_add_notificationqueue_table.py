@@ -0,0 +1,25 @@
+"""Add NotificationQueue table
+
+Revision ID: 8e5d1c4b7a2f
+Revises: 4c2f8e1a9b3d
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+
+from alembic import op
+
+from aurweb.schema import NotificationQueue
+
+# revision identifiers, used by Alembic.
+revision = "8e5d1c4b7a2f"
+down_revision = "4c2f8e1a9b3d"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    NotificationQueue.create(op.get_bind())
+
+
+def downgrade():
+    op.drop_table(NotificationQueue.name)
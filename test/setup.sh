@@ -44,6 +44,7 @@ commit_uri = https://aur.archlinux.org/cgit/aur.git/log/?h=%s&id=%s
 localedir = $TOPLEVEL/web/locale/
 snapshot_uri = /cgit/aur.git/snapshot/%s.tar.gz
 pkgctl_executable = /usr/bin/pkgctl
+cache = none
 
 [notifications]
 notify-cmd = $NOTIFY
@@ -60,14 +60,14 @@ test_expect_success 'Test update hook on an updated repository.' '
 	AUR_USER=user AUR_PKGBASE=foobar AUR_PRIVILEGED=0 \
 	cover "$GIT_UPDATE" refs/heads/master "$old" "$new" 2>&1 &&
 	cat >expected <<-EOF &&
+	1|1|foobar|1-2|aurweb test package.|https://aur.archlinux.org/
 	2|2|foobar2|1-1|aurweb test package.|https://aur.archlinux.org/
-	3|1|foobar|1-2|aurweb test package.|https://aur.archlinux.org/
 	1|GPL
 	2|MIT
+	1|1
 	2|2
-	3|1
+	1|1|python-pygit2|||
 	2|1|python-pygit2|||
-	3|1|python-pygit2|||
 	1|1
 	2|1
 	EOF
@@ -79,14 +79,14 @@ test_expect_success 'Test restore mode.' '
 	AUR_USER=user AUR_PKGBASE=foobar AUR_PRIVILEGED=0 \
 	cover "$GIT_UPDATE" restore 2>&1 &&
 	cat >expected <<-EOF &&
+	1|1|foobar|1-2|aurweb test package.|https://aur.archlinux.org/
 	2|2|foobar2|1-1|aurweb test package.|https://aur.archlinux.org/
-	3|1|foobar|1-2|aurweb test package.|https://aur.archlinux.org/
 	1|GPL
 	2|MIT
+	1|1
 	2|2
-	3|1
+	1|1|python-pygit2|||
 	2|1|python-pygit2|||
-	3|1|python-pygit2|||
 	1|1
 	2|1
 	EOF
@@ -489,8 +489,8 @@ test_expect_success 'Pushing .SRCINFO with epoch.' '
 	AUR_USER=user AUR_PKGBASE=foobar AUR_PRIVILEGED=0 \
 	cover "$GIT_UPDATE" refs/heads/master "$old" "$new" 2>&1 &&
 	cat >expected <<-EOF &&
+	1|1|foobar|1:1-2|aurweb test package.|https://aur.archlinux.org/
 	2|2|foobar2|1-1|aurweb test package.|https://aur.archlinux.org/
-	3|1|foobar|1:1-2|aurweb test package.|https://aur.archlinux.org/
 	EOF
 	echo "SELECT * FROM Packages;" | sqlite3 aur.db >actual &&
 	test_cmp expected actual
@@ -241,3 +241,26 @@ def test_internal_server_error_post(
 
     expr = r"FATAL\[.{7}\]"
     assert re.search(expr, caplog.text)
+
+
+def test_asgi_metrics_collector(tmpdir):
+    env = {"PROMETHEUS_MULTIPROC_DIR": str(tmpdir)}
+    interval = aurweb.config.getint("options", "metrics_update_interval")
+    collect = mock.AsyncMock()
+    with (
+        mock.patch.dict(os.environ, env),
+        mock.patch("aurweb.statistics.collect_metrics", new=collect),
+    ):
+        with TestClient(app=aurweb.asgi.app):
+            pass
+    collect.assert_called_once_with(interval)
+
+    # Without metrics, there is nothing to collect.
+    collect = mock.AsyncMock()
+    with (
+        mock.patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": str()}),
+        mock.patch("aurweb.statistics.collect_metrics", new=collect),
+    ):
+        with TestClient(app=aurweb.asgi.app):
+            pass
+    collect.assert_not_called()
@@ -3,14 +3,17 @@ from collections.abc import Generator
 import fastapi
 import pytest
 from fastapi import HTTPException
+from sqlalchemy import event
 from sqlalchemy.exc import IntegrityError
 
 from aurweb import config, db, time
+from aurweb.aur_redis import redis_connection
 from aurweb.auth import (
     AnonymousUser,
     BasicAuthBackend,
     _auth_required,
     account_type_required,
+    cache,
 )
 from aurweb.models.account_type import USER, USER_ID
 from aurweb.models.session import Session
@@ -107,6 +110,73 @@ async def test_expired_session(backend: BasicAuthBackend, user: User):
     assert session is None
 
 
+@pytest.fixture
+def statements() -> Generator[list[str]]:
+    output = []
+
+    def count(conn, cursor, statement, *args) -> None:
+        output.append(statement)
+
+    engine = db.get_engine()
+    event.listen(engine, "before_cursor_execute", count)
+    yield output
+    event.remove(engine, "before_cursor_execute", count)
+
+
+@pytest.mark.asyncio
+async def test_auth_backend_cached(
+    user: User, backend: BasicAuthBackend, statements: list[str]
+):
+    request = Request()
+    request.cookies["AURSID"] = user.login(Request(), "testPassword")
+    _, result = await backend.authenticate(request)
+    assert result == user
+
+    # The second request is served from the cache.
+    db.get_session().expire_all()
+    statements.clear()
+    _, result = await backend.authenticate(request)
+    assert result.is_authenticated()
+    assert (result.ID, result.Username) == (user.ID, "test")
+    assert statements == []
+
+    # Password hashes are not cached, but loaded when used.
+    cached = redis_connection().get(cache.KEY % request.cookies["AURSID"])
+    assert user.Passwd.encode() not in cached
+    assert result.valid_password("testPassword")
+
+
+@pytest.mark.asyncio
+async def test_auth_backend_cache_invalidation(user: User, backend: BasicAuthBackend):
+    request = Request()
+    request.cookies["AURSID"] = user.login(Request(), "testPassword")
+    await backend.authenticate(request)
+
+    with db.begin():
+        user.RealName = "Changed"
+    assert cache.get(request.cookies["AURSID"]) is None
+
+    _, result = await backend.authenticate(request)
+    assert result.RealName == "Changed"
+
+    user.logout(request)
+    _, result = await backend.authenticate(request)
+    assert not result.is_authenticated()
+
+
+@pytest.mark.asyncio
+async def test_auth_backend_cache_invalidate_user(
+    user: User, backend: BasicAuthBackend
+):
+    request = Request()
+    request.cookies["AURSID"] = sid = user.login(Request(), "testPassword")
+    await backend.authenticate(request)
+    assert cache.get(sid) is not None
+
+    cache.invalidate(user_ids=[user.ID])
+    assert cache.get(sid) is None
+
+
 @pytest.mark.asyncio
 async def test_auth_required_redirection_bad_referrer() -> None:
     # Create a fake route function which can be wrapped by auth_required.
@@ -1,3 +1,4 @@
+import time
 from collections.abc import Generator
 from unittest import mock
 
@@ -7,6 +8,9 @@ from aurweb import cache, config, db
 from aurweb.models.account_type import USER_ID
 from aurweb.models.user import User
 
+# Save the original config.getint; it is mocked below.
+config_getint = config.getint
+
 
 @pytest.fixture(autouse=True)
 def setup(db_test):
@@ -81,15 +85,139 @@ def test_db_query_cache(user):
 
     assert cache._redis.ttl("key2") == 100
 
-    # Test "max_search_entries" options
-    def mock_max_search_entries(section: str, key: str, fallback: int) -> str:
-        if section == "cache" and key == "max_search_entries":
-            return 1
-        return config.getint(section, key)
 
-    with mock.patch("aurweb.config.getint", side_effect=mock_max_search_entries):
-        # Try to add another entry (we already have 2)
-        cache.db_query_cache("key3", query)
+class Values:
+    """Counts the values computed for a key."""
+
+    def __init__(self) -> None:
+        self.count = 0
+
+    def __call__(self) -> bytes:
+        self.count += 1
+        return b"%d" % self.count
+
+
+def test_cached_local():
+    values = Values()
+    assert cache.cached("value", values, 100, local=True) == b"1"
+    assert cache._redis.ttl("value") == 100
+
+    # The value is served by this worker until local_ttl passes, even
+    # once it was removed from Redis.
+    cache._redis.delete("value")
+    assert cache.cached("value", values, 100, local=True) == b"1"
+    assert cache.cached("value", values, 100) == b"2"
+
+    local_ttl = config.getint("cache", "local_ttl")
+    with mock.patch("time.time", return_value=time.time() + local_ttl):
+        assert cache.cached("value", values, 100, local=True) == b"2"
+    assert values.count == 2
+
+
+def test_cached_local_entries():
+    def mock_getint(section: str, key: str, fallback=None) -> int:
+        if section == "cache" and key == "local_entries":
+            return 2
+        return config_getint(section, key, fallback)
+
+    values = Values()
+    with mock.patch("aurweb.config.getint", side_effect=mock_getint):
+        for key in ("key1", "key2", "key1", "key3"):
+            cache.cached(key, values, local=True)
+    cache._redis.flushall()
+
+    # key2 was the least recently used.
+    assert cache.cached("key1", values, local=True) == b"1"
+    assert cache.cached("key3", values, local=True) == b"3"
+    assert cache.cached("key2", values, local=True) == b"4"
+
+
+def test_cached_refresh():
+    values = Values()
+    cache.cached("value", values, 100)
+    cache._redis.expire("value", 50)
+    assert cache.cached("value", values, 100) == b"1"
+
+    # Values about to expire are recomputed by the worker taking the lock.
+    cache._redis.expire("value", 5)
+    cache._redis.set(cache.LOCK_KEY % "value", "other")
+    assert cache.cached("value", values, 100) == b"1"
+    cache._redis.delete(cache.LOCK_KEY % "value")
+    assert cache.cached("value", values, 100) == b"2"
+    assert cache._redis.ttl("value") == 100
+
+
+def test_cached_lock():
+    """Workers never wait for the holder of the lock of a missing value."""
+    values = Values()
+    cache._redis.set(cache.LOCK_KEY % "value", "other")
+    assert cache.cached("value", values, 100) == b"1"
+    assert cache._redis.get(cache.LOCK_KEY % "value") == b"other"
+
+    # Workers holding an expired copy serve it instead.
+    cache._redis.delete("value")
+    local_ttl = config.getint("cache", "local_ttl")
+    assert cache.cached("value", values, 100, local=True) == b"2"
+    cache._redis.delete("value")
+    with mock.patch("time.time", return_value=time.time() + local_ttl):
+        assert cache.cached("value", values, 100, local=True) == b"2"
+    assert values.count == 2
 
-        # Make sure it was not added because it exceeds our max.
-        assert cache._redis.get("key3") is None
+    cache._redis.delete(cache.LOCK_KEY % "value")
+    with mock.patch("time.time", return_value=time.time() + local_ttl):
+        assert cache.cached("value", values, 100, local=True) == b"3"
+
+
+def hydrate(ids: list[int]) -> list[User]:
+    return db.query(User).filter(User.ID.in_(ids)).all()
+
+
+def test_db_ids_cache(user: User):
+    with db.begin():
+        other = db.create(
+            User,
+            Username="other",
+            Email="other@example.org",
+            Passwd="testPassword",
+            AccountTypeID=USER_ID,
+        )
+    query = db.query(User).order_by(User.Username.desc())
+    assert cache.db_ids_cache("key1", query, hydrate, 100) == [user, other]
+    assert cache._redis.ttl("key1") == 100
+
+    # Only the IDs are stored; cached rows are looked up, in order.
+    assert len(cache._redis.get("key1")) == 8
+    hydrated = mock.Mock(side_effect=hydrate)
+    assert cache.db_ids_cache("key1", query, hydrated) == [user, other]
+    hydrated.assert_called_once_with([user.ID, other.ID])
+
+    # Rows of deleted records are left out.
+    with db.begin():
+        db.delete(other)
+    assert cache.db_ids_cache("key1", query, hydrate) == [user]
+
+    # Empty results are cached without a lookup.
+    empty = db.query(User).filter(User.ID == 0)
+    assert cache.db_ids_cache("key2", empty, hydrate) == []
+    assert cache.db_ids_cache("key2", query, hydrated) == []
+    assert hydrated.call_count == 1
+
+
+def test_db_ids_cache_eviction(user: User):
+    def mock_getint(section: str, key: str, fallback=None) -> int:
+        if section == "cache" and key == "max_search_entries":
+            return 2
+        return config_getint(section, key, fallback)
+
+    query = db.query(User)
+    with mock.patch("aurweb.config.getint", side_effect=mock_getint):
+        cache.db_ids_cache("key1", query, hydrate)
+        cache.db_ids_cache("key2", query, hydrate)
+        # Using key1 makes key2 the least recently used.
+        cache.db_ids_cache("key1", query, hydrate)
+        cache.db_ids_cache("key3", query, hydrate)
+
+    assert cache._redis.get("key2") is None
+    assert cache._redis.get("key1") is not None
+    assert cache._redis.get("key3") is not None
+    assert cache._redis.zcard(cache.IDS_INDEX) == 2
@@ -3,12 +3,15 @@ from http import HTTPStatus
 from typing import Tuple
 from unittest import mock
 
+import orjson
 import py
 import pygit2
 import pytest
 from fastapi.testclient import TestClient
 
-from aurweb import asgi, config, db
+from aurweb import asgi, config, db, time
+from aurweb.archives import segment
+from aurweb.archives.spec import metadata as metadata_spec
 from aurweb.archives.spec.base import GitInfo, SpecBase
 from aurweb.models import Package, PackageBase, User
 from aurweb.scripts import git_archive
@@ -225,6 +228,61 @@ def test_metadata_delete(client: TestClient, metadata: py.path.local, package: P
     assert commit_count(repo) == 2
 
 
+@pytest.fixture
+def metadata_segments(metadata: py.path.local, tmp_path: py.path.local):
+    segmentdir = tmp_path / "segments"
+
+    get_ = config.get
+
+    def mock_config(section: str, option: str) -> str:
+        if section == "git-archive" and option == "metadata-segmentdir":
+            return str(segmentdir)
+        return get_(section, option)
+
+    with mock.patch("aurweb.config.get", side_effect=mock_config):
+        yield segmentdir
+
+
+def test_metadata_incremental(
+    metadata: py.path.local,
+    metadata_segments: py.path.local,
+    user: User,
+    package: Package,
+):
+    def outputs() -> dict[str, bytes]:
+        spec = metadata_spec.Spec()
+        spec.outputs = []
+        return {output.filename: output.data for output in spec.generate()}
+
+    full = outputs()
+    assert (metadata_segments / "pkgname.seg").exists()
+    assert (metadata_segments / "pkgbase.seg").exists()
+
+    # Without segments, the same data is produced.
+    with mock.patch("aurweb.archives.segment.read", return_value=None):
+        assert outputs() == full
+
+    with db.begin():
+        package.Description = "Changed"
+        package.PackageBase.ModifiedTS = time.utcnow()
+        pkgbase = db.create(
+            PackageBase, Name="other", Packager=user, ModifiedTS=time.utcnow()
+        )
+        db.create(Package, PackageBase=pkgbase, Name="other")
+
+    with mock.patch("aurweb.archives.segment.splice", wraps=segment.splice) as splice:
+        incremental = outputs()
+    assert splice.call_count == 2
+
+    # The spliced outputs match those of a full run.
+    with mock.patch("aurweb.archives.segment.read", return_value=None):
+        assert outputs() == incremental
+
+    pkgnames = orjson.loads(incremental.get("pkgname.json"))
+    assert list(pkgnames) == ["other", "test"]
+    assert pkgnames["test"]["Description"] == "Changed"
+
+
 def test_users(users: py.path.local, user: User):
     assert git_archive.main() == 0
     repo = pygit2.Repository(users)
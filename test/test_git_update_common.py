@@ -0,0 +1,105 @@
+from collections.abc import Generator
+
+import pytest
+
+from aurweb import db
+from aurweb.git.update_common import PackageInfo, save_packages
+from aurweb.models.account_type import USER_ID
+from aurweb.models.package_base import PackageBase
+from aurweb.models.user import User
+
+
+@pytest.fixture(autouse=True)
+def setup(db_test):
+    return
+
+
+@pytest.fixture
+def pkgbase() -> Generator[PackageBase]:
+    with db.begin():
+        user = db.create(
+            User,
+            Username="test",
+            Email="test@example.org",
+            Passwd="testPassword",
+            AccountTypeID=USER_ID,
+        )
+        pkgbase = db.create(PackageBase, Name="pkgbase", Maintainer=user)
+    yield pkgbase
+
+
+def package(name: str, version: str = "1.0-1", **kwargs) -> PackageInfo:
+    fields = {
+        "description": f"{name} package",
+        "url": None,
+        "sources": [("source.tar.gz", None)],
+        "depends": [("depends", "glibc", "", ">=2", None)],
+        "relations": [("provides", f"{name}-virtual", "", None)],
+        "licenses": ["MIT"],
+        "groups": [],
+    }
+    fields.update(kwargs)
+    return PackageInfo(name=name, version=version, **fields)
+
+
+def save(pkgbase_id: int, packages: list[PackageInfo]) -> dict:
+    conn = db.Connection()
+    save_packages(conn, pkgbase_id, packages)
+    conn.commit()
+
+    cur = conn.execute(
+        "SELECT Name, ID, Version FROM Packages WHERE PackageBaseID = ?",
+        [pkgbase_id],
+    )
+    result = {name: {"id": pkgid, "version": ver} for name, pkgid, ver in cur}
+    for name, info in result.items():
+        cur = conn.execute(
+            "SELECT DepName, DepCondition FROM PackageDepends WHERE PackageID = ?",
+            [info["id"]],
+        )
+        info["depends"] = sorted(cur.fetchall())
+        cur = conn.execute(
+            "SELECT Licenses.Name FROM PackageLicenses "
+            + "INNER JOIN Licenses ON Licenses.ID = PackageLicenses.LicenseID "
+            + "WHERE PackageID = ?",
+            [info["id"]],
+        )
+        info["licenses"] = sorted(row[0] for row in cur.fetchall())
+    conn.close()
+    return result
+
+
+def test_save_packages(pkgbase: PackageBase):
+    first = save(pkgbase.ID, [package("foo"), package("bar")])
+    assert first.keys() == {"foo", "bar"}
+    assert first["foo"]["depends"] == [("glibc", ">=2")]
+    assert first["foo"]["licenses"] == ["MIT"]
+
+    # Packages keep their IDs across pushes.
+    second = save(
+        pkgbase.ID,
+        [
+            package("foo", "1.0-2", depends=[("depends", "musl", "", "", None)]),
+            package("baz", licenses=["GPL", "MIT"]),
+        ],
+    )
+    assert second.keys() == {"foo", "baz"}
+    assert second["foo"]["id"] == first["foo"]["id"]
+    assert second["foo"]["version"] == "1.0-2"
+    assert second["foo"]["depends"] == [("musl", "")]
+    assert second["baz"]["licenses"] == ["GPL", "MIT"]
+
+    # Pushing the same packages again leaves them in place.
+    third = save(pkgbase.ID, [package("foo"), package("bar")])
+    assert third == save(pkgbase.ID, [package("foo"), package("bar")])
+    assert third["foo"] == first["foo"]
+
+
+def test_save_packages_duplicate_details(pkgbase: PackageBase):
+    depends = [("depends", "glibc", "", "", None)] * 2
+    result = save(pkgbase.ID, [package("foo", depends=depends, licenses=["MIT"] * 2)])
+    assert result["foo"]["depends"] == [("glibc", ""), ("glibc", "")]
+    assert result["foo"]["licenses"] == ["MIT"]
+
+    result = save(pkgbase.ID, [package("foo", depends=depends[:1])])
+    assert result["foo"]["depends"] == [("glibc", "")]
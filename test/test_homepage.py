@@ -69,6 +69,7 @@ def redis():
             "year_old_updated",
             "never_updated",
             "package_updates",
+            "statistics",
         ):
             if redis.get(key) is not None:
                 redis.delete(key)
@@ -19,6 +19,9 @@ from aurweb.models.user import User
 from aurweb.testing.html import get_errors, get_successes, parse_root
 from aurweb.testing.requests import Request
 
+# Save the original config.getint; it is mocked below.
+config_getint = config.getint
+
 
 @pytest.fixture(autouse=True)
 def setup(db_test):
@@ -148,6 +151,67 @@ def test_archive_sig(client: TestClient):
     assert resp.text == hash_value
 
 
+def test_archive_sig_links(client: TestClient):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        archive = os.path.join(tmpdir, "packages-meta-v1.json.gz")
+        for path in (f"{archive}.sha256", archive.replace(".gz", ".zst")):
+            with open(path, "w") as f:
+                f.write("test")
+        with open(f"{archive}.deltas", "w") as f:
+            f.write('{"abc": "packages-meta-v1.json.delta-def.gz"}')
+
+        config_get = config.get
+
+        def mock_config(section: str, key: str):
+            if key == "archivedir":
+                return tmpdir
+            if key == "variants":
+                return "zst br"
+            return config_get(section, key)
+
+        with mock.patch("aurweb.config.get", side_effect=mock_config):
+            with client as request:
+                resp = request.get("/packages-meta-v1.json.gz.sha256")
+                delta_resp = request.get(
+                    "/packages-meta-v1.json.gz.sha256", params={"from": "abc"}
+                )
+
+    assert resp.status_code == int(HTTPStatus.OK)
+    assert resp.text == "test"
+    zst = '</packages-meta-v1.json.zst>; rel="alternate"; type="application/zstd"'
+    assert resp.headers.get("Link") == zst
+
+    delta = '</packages-meta-v1.json.delta-def.gz>; rel="delta"'
+    assert delta_resp.headers.get("Link") == f"{zst}, {delta}"
+
+
+def test_archive_sig_unsupported_variant(client: TestClient):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        archive = os.path.join(tmpdir, "packages-meta-v1.json.gz")
+        for path in (f"{archive}.sha256", archive.replace(".gz", ".zst")):
+            with open(path, "w") as f:
+                f.write("test")
+
+        config_get = config.get
+
+        def mock_config(section: str, key: str):
+            if key == "archivedir":
+                return tmpdir
+            if key == "variants":
+                return "rar zst"
+            return config_get(section, key)
+
+        with mock.patch("aurweb.config.get", side_effect=mock_config):
+            with client as request:
+                resp = request.get("/packages-meta-v1.json.gz.sha256")
+
+    # Unsupported variants are skipped rather than failing the request.
+    assert resp.status_code == int(HTTPStatus.OK)
+    assert resp.text == "test"
+    zst = '</packages-meta-v1.json.zst>; rel="alternate"; type="application/zstd"'
+    assert resp.headers.get("Link") == zst
+
+
 def test_archive_sig_404(client: TestClient):
     with client as request:
         resp = request.get("/blah.gz.sha256")
@@ -164,6 +228,30 @@ def test_metrics(client: TestClient):
     assert resp.headers.get("Content-Type").startswith("text/plain")
 
 
+def test_metrics_update_interval(client: TestClient):
+    def mock_getint(section: str, key: str, fallback=None) -> int:
+        if section == "options" and key == "metrics_update_interval":
+            return 0
+        return config_getint(section, key, fallback)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        env = {"PROMETHEUS_MULTIPROC_DIR": tmpdir}
+        with (
+            mock.patch.dict(os.environ, env),
+            mock.patch("aurweb.statistics.collect_metrics", new=mock.AsyncMock()),
+            mock.patch("aurweb.statistics.update_prometheus_metrics") as update,
+        ):
+            with client as request:
+                request.get("/metrics")
+            # Gauges are updated in the background.
+            update.assert_not_called()
+
+            with mock.patch("aurweb.config.getint", side_effect=mock_getint):
+                with client as request:
+                    request.get("/metrics")
+            update.assert_called_once()
+
+
 def test_disabled_metrics(client: TestClient):
     env = {"PROMETHEUS_MULTIPROC_DIR": str()}
     with mock.patch.dict(os.environ, env):
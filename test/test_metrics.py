@@ -4,7 +4,7 @@ import pytest
 from prometheus_client import REGISTRY, generate_latest
 
 from aurweb import db
-from aurweb.cache import db_query_cache
+from aurweb.cache import db_count_cache, db_ids_cache
 from aurweb.models.account_type import USER_ID
 from aurweb.models.user import User
 
@@ -30,8 +30,9 @@ def user() -> Generator[User]:
 
 def test_search_cache_metrics(user: User):
     # Fire off 3 identical queries for caching
+    query = db.query(User)
     for _ in range(3):
-        db_query_cache("key", db.query(User))
+        db_ids_cache("key", query, lambda ids: query.filter(User.ID.in_(ids)))
 
     # Get metrics
     metrics = str(generate_latest(REGISTRY))
@@ -39,3 +40,16 @@ def test_search_cache_metrics(user: User):
     # We should have 1 miss and 2 hits
     assert 'search_requests_total{cache="miss"} 1.0' in metrics
     assert 'search_requests_total{cache="hit"} 2.0' in metrics
+
+
+def test_cache_metrics(user: User):
+    query = db.query(User)
+    for _ in range(2):
+        db_count_cache("stats:users", query, local=True)
+    db_count_cache("other", query)
+
+    metrics = str(generate_latest(REGISTRY))
+    assert 'aur_cache_requests_total{cache="miss",namespace="stats"} 1.0' in metrics
+    assert 'aur_cache_requests_total{cache="local",namespace="stats"} 1.0' in metrics
+    assert 'aur_cache_requests_total{cache="miss",namespace="other"} 1.0' in metrics
+    assert 'aur_cache_seconds_count{cache="local",namespace="stats"} 1.0' in metrics
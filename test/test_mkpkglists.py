@@ -1,13 +1,20 @@
 import gzip
+import hashlib
+import io
 import json
+import lzma
 import os
+import sys
+from collections import namedtuple
 from collections.abc import Generator
 from unittest import mock
 
+import orjson
 import py
 import pytest
 
-from aurweb import config, db
+from aurweb import config, db, time
+from aurweb.archives import delta, segment, variants
 from aurweb.models import (
     License,
     Package,
@@ -240,3 +247,231 @@ def test_mkpkglists_extended(config_mock: None, user: User, packages: list[Packa
             expected_prefix = f"SHA256 ({os.path.basename(file)}) = "
             assert file_sig_content.startswith(expected_prefix)
             assert len(file_sig_content) == len(expected_prefix) + 64
+
+
+@pytest.fixture
+def segment_mock(tmpdir: py.path.local, config_mock: None) -> Generator[str]:
+    config_get = config.get
+    path = str(tmpdir / "packages.seg")
+
+    def mock_config(section: str, key: str) -> str:
+        if section == "mkpkglists" and key == "segmentfile":
+            return path
+        return config_get(section, key)
+
+    with mock.patch("aurweb.config.get", side_effect=mock_config):
+        yield path
+
+
+def test_mkpkglists_incremental(segment_mock: str, user: User, packages: list[Package]):
+    from aurweb.scripts import mkpkglists
+
+    PACKAGES = config.get("mkpkglists", "packagesfile")
+    META = config.get("mkpkglists", "packagesmetafile")
+
+    def archives() -> tuple[bytes, bytes]:
+        mkpkglists.main()
+        with gzip.open(PACKAGES) as f, gzip.open(META) as g:
+            return f.read(), g.read()
+
+    archives()
+    assert os.path.exists(segment_mock)
+
+    # Change, delete and add packages.
+    with db.begin():
+        packages[1].Description = "Changed"
+        packages[1].PackageBase.ModifiedTS = time.utcnow()
+        db.delete(packages[3].PackageBase)
+        pkgbase = db.create(
+            PackageBase, Name="pkgbase_5", Packager=user, ModifiedTS=time.utcnow()
+        )
+        db.create(Package, PackageBase=pkgbase, Name="pkg_5")
+
+    with mock.patch("aurweb.archives.segment.splice", wraps=segment.splice) as splice:
+        incremental = archives()
+    splice.assert_called_once()
+
+    # The spliced archives match those of a full run.
+    os.remove(segment_mock)
+    assert archives() == incremental
+
+    names, meta = incremental
+    assert names == b"pkg_0\npkg_1\npkg_2\npkg_4\npkg_5\n"
+    metadata = json.loads(meta)
+    assert metadata[1]["Description"] == "Changed"
+
+
+@pytest.fixture
+def deltas_mock(segment_mock: str) -> Generator[str]:
+    config_getint = config.getint
+
+    def mock_config(section: str, key: str, fallback: int = None) -> int:
+        if section == "mkpkglists" and key == "delta-generations":
+            return 2
+        return config_getint(section, key, fallback)
+
+    with mock.patch("aurweb.config.getint", side_effect=mock_config):
+        yield segment_mock
+
+
+def test_mkpkglists_deltas(deltas_mock: str, user: User, packages: list[Package]):
+    from aurweb.scripts import mkpkglists
+
+    META = config.get("mkpkglists", "packagesmetafile")
+    INDEX = delta.index_path(META)
+
+    def run() -> str:
+        mkpkglists.main()
+        with open(META, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def load(base: str) -> dict:
+        with open(INDEX, "rb") as f:
+            name = orjson.loads(f.read()).get(base)
+        with gzip.open(os.path.join(os.path.dirname(META), name)) as f:
+            return orjson.loads(f.read())
+
+    # The first generation has nothing to be compared against.
+    first = run()
+    with open(INDEX, "rb") as f:
+        assert orjson.loads(f.read()) == {}
+
+    with db.begin():
+        packages[1].Description = "Changed"
+        packages[1].PackageBase.ModifiedTS = time.utcnow()
+    second = run()
+
+    data = load(first)
+    assert (data["from"], data["to"]) == (first, second)
+    assert [pkg["Name"] for pkg in data["packages"]] == ["pkg_1"]
+    assert data["packages"][0]["Description"] == "Changed"
+    assert data["removed"] == []
+
+    with db.begin():
+        db.delete(packages[3].PackageBase)
+    third = run()
+
+    # Deltas are published for each previous generation.
+    data = load(second)
+    assert (data["from"], data["to"]) == (second, third)
+    assert (data["packages"], data["removed"]) == ([], ["pkg_3"])
+
+    data = load(first)
+    assert (data["from"], data["to"]) == (first, third)
+    assert [pkg["Name"] for pkg in data["packages"]] == ["pkg_1"]
+    assert data["removed"] == ["pkg_3"]
+
+    # Deltas from generations dropped from the history are removed.
+    with db.begin():
+        packages[0].Description = "Changed"
+        packages[0].PackageBase.ModifiedTS = time.utcnow()
+    run()
+
+    with open(INDEX, "rb") as f:
+        assert set(orjson.loads(f.read())) == {second, third}
+    prefix = os.path.basename(META).removesuffix(".gz") + ".delta-"
+    files = [f for f in os.listdir(os.path.dirname(META)) if f.startswith(prefix)]
+    assert len(files) == 2
+
+
+def test_variants(tmpdir: py.path.local):
+    from aurweb.scripts import mkpkglists
+
+    def compressor(fmt: str, fileobj, filename: str):
+        if fmt == "zst":
+            return lzma.LZMAFile(fileobj, "wb")
+        return variants_compressor(fmt, fileobj, filename)
+
+    variants_compressor = variants.compressor
+    path = os.path.join(str(tmpdir), "test.gz")
+    with mock.patch("aurweb.archives.variants.compressor", side_effect=compressor):
+        archive = mkpkglists.Variants(path, ["zst"])
+        archive.write(b"data")
+        archive.close()
+        archive.publish()
+
+    with gzip.open(path) as f:
+        assert f.read() == b"data"
+    with lzma.open(os.path.join(str(tmpdir), "test.zst")) as f:
+        assert f.read() == b"data"
+    assert os.path.exists(os.path.join(str(tmpdir), "test.zst.sha256"))
+
+
+def test_variants_unsupported():
+    config_get = config.get
+
+    def mock_config(section: str, key: str) -> str:
+        if key == "variants":
+            return "zst rar"
+        return config_get(section, key)
+
+    with mock.patch("aurweb.config.get", side_effect=mock_config):
+        with pytest.raises(ValueError):
+            variants.validate()
+        assert variants.enabled() == ["zst"]
+
+
+def test_variants_levels():
+    zstandard = mock.MagicMock()
+    brotli = mock.MagicMock()
+    with mock.patch.dict(sys.modules, zstandard=zstandard, brotli=brotli):
+        variants.compressor("zst", io.BytesIO(), "test.gz")
+        variants.compressor("br", io.BytesIO(), "test.gz")
+    zstandard.ZstdCompressor.assert_called_once_with(
+        level=config.getint("mkpkglists", "zstd-level")
+    )
+    brotli.Compressor.assert_called_once_with(
+        quality=config.getint("mkpkglists", "brotli-quality")
+    )
+
+
+def test_merge_extended():
+    from aurweb.scripts import mkpkglists
+
+    Record = namedtuple("Record", ["ID", "Type", "Name", "Cond"])
+    packages = [Record(1, None, "a", None), Record(3, None, "c", None)]
+    extended = [
+        Record(1, "depends", "dep", ">=1"),
+        Record(1, "License", "GPL", str()),
+        Record(2, "depends", "orphan", str()),
+        Record(3, "Keywords", "kw", str()),
+        Record(4, "depends", "gone", str()),
+    ]
+
+    merged = list(mkpkglists.merge_extended(packages, extended))
+    assert [(pkg.ID, dict(data)) for pkg, data in merged] == [
+        (1, {"Depends": ["dep>=1"], "License": ["GPL"]}),
+        (3, {"Keywords": ["kw"]}),
+    ]
+
+
+def test_archive(tmpdir: py.path.local):
+    from aurweb.scripts import mkpkglists
+
+    path = os.path.join(str(tmpdir), "test.gz")
+    lines = [f"line {i}\n".encode() for i in range(50000)]
+
+    archive = mkpkglists.Archive(path)
+    for line in lines:
+        archive.write(line)
+    archive.close()
+    archive.publish()
+
+    with gzip.open(path) as f:
+        assert f.read() == b"".join(lines)
+
+    # The inline checksum matches the file written.
+    with open(path, "rb") as f:
+        checksum = hashlib.sha256(f.read()).hexdigest()
+    with open(f"{path}.sha256") as f:
+        assert f.read() == f"SHA256 (test.gz) = {checksum}"
+
+
+def test_archive_error(tmpdir: py.path.local):
+    from aurweb.scripts import mkpkglists
+
+    path = os.path.join(str(tmpdir), "missing", "test.gz")
+    archive = mkpkglists.Archive(path)
+    archive.write(b"data" * mkpkglists.BUFFER_SIZE)
+    with pytest.raises(FileNotFoundError):
+        archive.close()
@@ -1,3 +1,4 @@
+import smtplib
 from collections.abc import Generator
 from logging import ERROR
 from unittest import mock
@@ -606,6 +607,8 @@ def mock_smtp_config(cls):
                 return cls(0)
             elif key == "smtp-use-starttls":
                 return cls(0)
+            elif key == "queue":
+                return cls(0)
             elif key == "smtp-user":
                 return cls()
             elif key == "smtp-password":
@@ -642,6 +645,8 @@ def mock_smtp_starttls_config(cls):
                 return cls(0)
             elif key == "smtp-use-starttls":
                 return cls(1)
+            elif key == "queue":
+                return cls(0)
             elif key == "smtp-user":
                 return cls("test")
             elif key == "smtp-password":
@@ -689,6 +694,8 @@ def mock_smtp_ssl_config(cls):
                 return cls(1)
             elif key == "smtp-use-starttls":
                 return cls(0)
+            elif key == "queue":
+                return cls(0)
             elif key == "smtp-user":
                 return cls("test")
             elif key == "smtp-password":
@@ -717,6 +724,103 @@ def test_smtp_ssl(user: User):
     assert smtp.passwd
 
 
+class BulkNotification(notify.Notification):
+    """A notification to a number of recipients which counts renders."""
+
+    def __init__(self, recipients: list[tuple[str, str]]) -> None:
+        self._recipients = recipients
+        self.rendered = []
+
+    def get_recipients(self):
+        return self._recipients
+
+    def get_subject(self, lang):
+        self.rendered.append(lang)
+        return f"Subject ({lang})"
+
+    def get_body(self, lang):
+        return f"Body ({lang})"
+
+
+def recipients(count: int) -> list[tuple[str, str]]:
+    return [(f"user{i}@example.org", ("en", "de")[i % 2]) for i in range(count)]
+
+
+def mock_smtp_batch_config(batch_size: int):
+    get = mock_smtp_config(str)
+    config_getint = config.getint
+
+    def getint(section: str, key: str, fallback=None):
+        if section == "notifications" and key == "smtp-batch-size":
+            return batch_size
+        return config_getint(section, key, fallback)
+
+    return get, getint
+
+
+@pytest.mark.parametrize("batch_size, connections", [(0, 1), (2, 3), (5, 1)])
+def test_smtp_batch(batch_size: int, connections: int):
+    get, getint = mock_smtp_batch_config(batch_size)
+    smtp = FakeSMTP()
+    notif = BulkNotification(recipients(5))
+
+    with (
+        mock.patch("aurweb.config.get", side_effect=get),
+        mock.patch("aurweb.config.getint", side_effect=getint),
+        mock.patch("smtplib.SMTP", side_effect=smtp) as connect,
+    ):
+        notif.send()
+
+    assert [to for _, to, _ in smtp.emails] == [[to] for to, _ in recipients(5)]
+    assert connect.call_count == connections
+    assert smtp.quit_count == connections
+
+    # Subjects and bodies are rendered once per language.
+    assert sorted(notif.rendered) == ["de", "en"]
+    assert "Subject: Subject (de)" in smtp.emails[1][2]
+
+
+def test_smtp_send_all():
+    get, getint = mock_smtp_batch_config(0)
+    smtp = FakeSMTP()
+    notifs = [BulkNotification(recipients(2)), BulkNotification(recipients(3))]
+
+    with (
+        mock.patch("aurweb.config.get", side_effect=get),
+        mock.patch("aurweb.config.getint", side_effect=getint),
+        mock.patch("smtplib.SMTP", side_effect=smtp) as connect,
+    ):
+        notify.send_all(notifs)
+
+    assert smtp.count == 5
+    assert connect.call_count == 1
+
+
+class DisconnectingSMTP(FakeSMTP):
+    """Drops the connection before its second message."""
+
+    def sendmail(self, sender: str, to: str, msg: bytes) -> None:
+        if self.count == 1:
+            self.count += 1
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        super().sendmail(sender, to, msg)
+
+
+def test_smtp_reconnect():
+    get, getint = mock_smtp_batch_config(0)
+    smtp = DisconnectingSMTP()
+
+    with (
+        mock.patch("aurweb.config.get", side_effect=get),
+        mock.patch("aurweb.config.getint", side_effect=getint),
+        mock.patch("smtplib.SMTP", side_effect=smtp) as connect,
+    ):
+        BulkNotification(recipients(3)).send()
+
+    assert len(smtp.emails) == 3
+    assert connect.call_count == 2
+
+
 def test_notification_defaults() -> None:
     notif = notify.Notification()
     assert notif.get_refs() == ()
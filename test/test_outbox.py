@@ -0,0 +1,250 @@
+import json
+from collections.abc import Generator
+from unittest import mock
+
+import pytest
+from sqlalchemy import insert, select, update
+from sqlalchemy.engine import Row
+
+from aurweb import config, db, outbox, time
+from aurweb.models import PackageBase, PackageNotification, User
+from aurweb.models.account_type import USER_ID
+from aurweb.scripts import notify, notify_worker
+from aurweb.testing.email import Email
+from aurweb.testing.smtp import FakeSMTP
+
+# Save the original config functions; they are mocked below.
+config_get = config.get
+config_getboolean = config.getboolean
+config_getint = config.getint
+
+
+@pytest.fixture(autouse=True)
+def setup(db_test):
+    return
+
+
+@pytest.fixture
+def queue() -> Generator[None]:
+    def mock_getboolean(section: str, key: str, fallback=None) -> bool:
+        if section == "notifications" and key == "queue":
+            return True
+        return config_getboolean(section, key, fallback)
+
+    def mock_getint(section: str, key: str, fallback=None) -> int:
+        if section == "notifications" and key == "queue-max-attempts":
+            return 2
+        return config_getint(section, key, fallback)
+
+    with (
+        mock.patch("aurweb.config.getboolean", side_effect=mock_getboolean),
+        mock.patch("aurweb.config.getint", side_effect=mock_getint),
+    ):
+        yield
+
+
+def create_user(username: str) -> User:
+    with db.begin():
+        user = db.create(
+            User,
+            Username=username,
+            Email=f"{username}@example.org",
+            Passwd=str(),
+            AccountTypeID=USER_ID,
+        )
+    return user
+
+
+@pytest.fixture
+def user() -> Generator[User]:
+    yield create_user("test")
+
+
+@pytest.fixture
+def user2() -> Generator[User]:
+    yield create_user("test2")
+
+
+@pytest.fixture
+def pkgbase(user: User) -> Generator[PackageBase]:
+    with db.begin():
+        user.UpdateNotify = 1
+        pkgbase = db.create(PackageBase, Name="pkgbase", Maintainer=user)
+        db.create(PackageNotification, PackageBase=pkgbase, User=user)
+    yield pkgbase
+
+
+NotificationQueue = outbox.NotificationQueue
+
+
+def queued() -> list[Row]:
+    return (
+        db.get_session()
+        .execute(select(NotificationQueue).order_by(NotificationQueue.c.ID))
+        .fetchall()
+    )
+
+
+def insert_rows(*payloads: tuple[str, str]) -> None:
+    rows = [
+        {"Type": type_, "Payload": payload, "AvailableTS": time.utcnow()}
+        for type_, payload in payloads
+    ]
+    with db.begin():
+        db.get_session().execute(insert(NotificationQueue), rows)
+
+
+def make_available() -> None:
+    with db.begin():
+        db.get_session().execute(update(NotificationQueue).values(AvailableTS=0))
+
+
+def test_send(queue: None, user: User, user2: User, pkgbase: PackageBase):
+    notify.UpdateNotification(user2.ID, pkgbase.ID).send()
+    assert Email.count() == 0
+
+    (row,) = queued()
+    assert row.Type == "UpdateNotification"
+    assert json.loads(row.Payload)["_recipients"] == [[user.Email, "en"]]
+
+    notify_worker.run(once=True)
+    assert Email.count() == 1
+    assert Email(1).parse().headers.get("To") == user.Email
+    assert queued() == []
+
+
+def test_send_all(queue: None, user: User, user2: User, pkgbase: PackageBase):
+    notifs = [notify.UpdateNotification(user2.ID, pkgbase.ID) for _ in range(5)]
+    notify.send_all(notifs)
+    assert len(queued()) == 5
+
+    def mock_get(section: str, key: str) -> str:
+        if section == "notifications" and key == "sendmail":
+            return str()
+        return config_get(section, key)
+
+    smtp = FakeSMTP()
+    with (
+        mock.patch("aurweb.config.get", side_effect=mock_get),
+        mock.patch("smtplib.SMTP", side_effect=smtp) as connect,
+    ):
+        notify_worker.run(once=True)
+
+    assert len(smtp.emails) == 5
+    # Every delivery thread keeps a connection open until the worker stops.
+    concurrency = config.getint("notifications", "queue-concurrency")
+    assert connect.call_count <= concurrency
+    assert smtp.quit_count == connect.call_count
+    assert queued() == []
+
+
+def test_send_secrets(queue: None, user: User):
+    """Reset keys are read at delivery rather than stored in the queue."""
+    with db.begin():
+        user.ResetKey = "oldkey"
+    notify.ResetKeyNotification(user.ID).send()
+
+    (row,) = queued()
+    assert row.Type == "ResetKeyNotification"
+    assert json.loads(row.Payload) == [user.ID]
+
+    with db.begin():
+        user.ResetKey = "newkey"
+    notify_worker.run(once=True)
+    assert Email.count() == 1
+    assert "resetkey=newkey" in Email(1).parse().body
+
+
+def test_send_deleted(queue: None, user: User, user2: User, pkgbase: PackageBase):
+    """Queued notifications do not depend on records deleted later on."""
+    notify.DeleteNotification(user2.ID, pkgbase.ID).send()
+    with db.begin():
+        db.delete(pkgbase)
+
+    notify_worker.run(once=True)
+    assert Email.count() == 1
+    assert "pkgbase" in Email(1).parse().headers.get("Subject")
+
+
+def test_send_transaction(queue: None, user: User, user2: User, pkgbase: PackageBase):
+    """Notifications sent in a transaction are only queued if it commits."""
+    notif = notify.UpdateNotification(user2.ID, pkgbase.ID)
+    with pytest.raises(RuntimeError):
+        with db.begin():
+            notif.send()
+            raise RuntimeError("rollback")
+    assert queued() == []
+
+
+def test_notify(queue: None, user: User, user2: User, pkgbase: PackageBase):
+    outbox.notify("update", user2.ID, pkgbase.ID)
+
+    (row,) = queued()
+    assert row.Type == "UpdateNotification"
+    assert json.loads(row.Payload) == [str(user2.ID), str(pkgbase.ID)]
+
+    notify_worker.run(once=True)
+    assert Email.count() == 1
+
+
+def test_notify_disabled():
+    with mock.patch("subprocess.run") as run:
+        outbox.notify("update", 1, 2)
+    notify_cmd = config.get("notifications", "notify-cmd")
+    run.assert_called_once_with((notify_cmd, "update", "1", "2"))
+    assert queued() == []
+
+
+def test_claim():
+    insert_rows(*[("UpdateNotification", "[]")] * 3)
+
+    token, rows = outbox.claim(2)
+    assert [row.Attempts for row in rows] == [1, 1]
+    other, others = outbox.claim(2)
+    assert len(others) == 1
+    assert outbox.claim(2)[1] == []
+
+    # Rows of expired leases are claimed again; the former claim can
+    # no longer complete them.
+    make_available()
+    _, rows = outbox.claim(3)
+    assert len(rows) == 3
+    outbox.complete(token, [row.ID for row in rows])
+    assert len(queued()) == 3
+
+
+def test_retry(queue: None, user: User, user2: User, pkgbase: PackageBase):
+    notify.UpdateNotification(user2.ID, pkgbase.ID).send()
+
+    with mock.patch.object(notify.Mailer, "send", side_effect=OSError("refused")):
+        notify_worker.run(once=True)
+    (row,) = queued()
+    assert row.Attempts == 1
+    assert row.Failed == 0
+    assert row.ClaimToken is None
+    assert "refused" in row.Error
+    assert row.AvailableTS > time.utcnow()
+
+    # Notifications are kept once they exhausted their attempts.
+    make_available()
+    with mock.patch.object(notify.Mailer, "send", side_effect=OSError("refused")):
+        notify_worker.run(once=True)
+    (row,) = queued()
+    assert row.Attempts == 2
+    assert row.Failed == 1
+
+    with mock.patch("sys.argv", ["aurweb-notify-worker", "--requeue-failed"]):
+        notify_worker.main()
+    notify_worker.run(once=True)
+    assert Email.count() == 1
+    assert queued() == []
+
+
+def test_unresolvable(queue: None):
+    insert_rows(("Mailer", "[]"), ("UpdateNotification", '["1", "1"]'))
+
+    notify_worker.run(once=True)
+    rows = queued()
+    assert "Unknown notification type" in rows[0].Error
+    assert rows[1].Error
+    assert all(row.Attempts == 1 for row in rows)
@@ -0,0 +1,290 @@
+from collections.abc import Generator
+from unittest import mock
+
+import pytest
+from redis.exceptions import ConnectionError
+
+from aurweb import config, db, rpc
+from aurweb.aur_redis import redis_connection
+from aurweb.models.account_type import USER_ID
+from aurweb.models.package import Package
+from aurweb.models.package_base import PackageBase
+from aurweb.models.user import User
+from aurweb.packages import index
+from aurweb.packages.search import RPCSearch
+
+
+@pytest.fixture(autouse=True)
+def setup(db_test):
+    index.reset()
+    yield
+    index.reset()
+
+
+@pytest.fixture
+def enabled() -> Generator[None]:
+    config_getboolean = config.getboolean
+
+    config_getint = config.getint
+
+    def mock_getboolean(section: str, key: str, fallback=None) -> bool:
+        if section == "rpc" and key in ("search_index", "suggest_index"):
+            return True
+        return config_getboolean(section, key, fallback)
+
+    def mock_getint(section: str, key: str, fallback=None) -> int:
+        if section == "rpc" and key == "suggest_index_refresh":
+            return 0
+        return config_getint(section, key, fallback)
+
+    with mock.patch("aurweb.config.getboolean", side_effect=mock_getboolean):
+        with mock.patch("aurweb.config.getint", side_effect=mock_getint):
+            yield
+
+
+@pytest.fixture
+def user() -> Generator[User]:
+    with db.begin():
+        user = db.create(
+            User,
+            Username="test",
+            Email="test@example.org",
+            Passwd="testPassword",
+            AccountTypeID=USER_ID,
+        )
+    yield user
+
+
+@pytest.fixture
+def packages(user: User) -> Generator[list[Package]]:
+    output = []
+    with db.begin():
+        for name, desc in [
+            ("python-chungus", "Big chungus bindings"),
+            ("chungy", "A café for chungi"),
+            ("other", "Nothing to see here"),
+        ]:
+            pkgbase = db.create(PackageBase, Name=name, Maintainer=user)
+            pkg = db.create(Package, PackageBase=pkgbase, Name=name, Description=desc)
+            output.append(pkg)
+    yield output
+
+
+def test_normalize():
+    assert index.normalize("Café") == "cafe"
+    assert index.normalize(None) == str()
+
+
+def test_trigram_index():
+    idx = index.TrigramIndex()
+    idx.add(1, "chungus")
+    idx.add(2, "big chungy")
+    assert len(idx) == 2
+
+    assert idx.search("chung") == {1, 2}
+    assert idx.search("CHUNGUS") == {1}
+    assert idx.search("gus chung") == set()
+    assert idx.search("nope") == set()
+
+    # Keywords which cannot be answered by the index.
+    assert idx.search("ch") is None
+    assert idx.search("chung_s") is None
+    assert idx.search("chung%") is None
+
+    # Re-adding replaces the previous text.
+    idx.add(1, "other")
+    assert idx.search("chung") == {2}
+
+    idx.remove(2)
+    idx.remove(3)
+    assert idx.search("chung") == set()
+    assert len(idx) == 1
+
+
+def test_prefix_index():
+    idx = index.PrefixIndex(["python-b", "python_a", "pythona", "ruby", "PYTHON"])
+    assert len(idx) == 5
+
+    # Ordered like utf8mb4_general_ci: "_" sorts after letters.
+    assert idx.lookup("py") == ["PYTHON", "python-b", "pythona", "python_a"]
+    assert idx.lookup("python-") == ["python-b"]
+    assert idx.lookup("py", limit=2) == ["PYTHON", "python-b"]
+    assert idx.lookup("zzz") == []
+    assert idx.lookup(str()) == idx.lookup(str(), limit=5)
+
+    # Prefixes containing LIKE wildcards cannot be answered.
+    assert idx.lookup("python_") is None
+
+
+def test_search_index_disabled():
+    assert index.search_index() is None
+    assert index.suggest_index() is None
+
+
+def test_search_index(enabled: None, packages: list[Package]):
+    idx = index.search_index()
+    assert idx is index.search_index()
+
+    ids = idx.search("nd", "chung")
+    assert ids == {packages[0].ID, packages[1].ID}
+    assert idx.search("n", "bindings") == set()
+    assert idx.search("nd", "cafe") == {packages[1].ID}
+    assert idx.search("nd", "ch") is None
+
+
+def test_search_index_refresh(enabled: None, user: User, packages: list[Package]):
+    idx = index.search_index()
+    idx.refresh()
+
+    # Replace the packages of a base, as a git push does.
+    pkgbase = packages[2].PackageBase
+    with db.begin():
+        db.delete(packages[2])
+        pkgbase.ModifiedTS = idx.modified + 1
+        pkg = db.create(Package, PackageBase=pkgbase, Name="other-chungus")
+
+    idx.refresh()
+    assert idx.search("n", "other") == {pkg.ID}
+    assert idx.search("nd", "nothing to see") == set()
+
+
+def test_search_index_refresh_late_commit(
+    enabled: None, user: User, packages: list[Package]
+):
+    idx = index.search_index()
+    idx.refresh()
+    modified = idx.modified
+
+    # A push stamped before the high-water mark, but committed after it
+    # was reached, is still indexed within the margin.
+    with db.begin():
+        pkgbase = db.create(
+            PackageBase, Name="late", Maintainer=user, ModifiedTS=modified - 1
+        )
+        pkg = db.create(Package, PackageBase=pkgbase, Name="late-chungus")
+
+    idx.refresh()
+    assert idx.modified == modified
+    assert idx.search("n", "late") == {pkg.ID}
+
+
+def test_search_index_refresh_prune(enabled: None, packages: list[Package]):
+    idx = index.search_index()
+    idx.refresh()
+    assert idx.search("n", "other") == {packages[2].ID}
+
+    with db.begin():
+        db.delete(packages[2].PackageBase)
+
+    # Without a generation bump, deleted bases are kept until the
+    # prune interval elapses.
+    idx.refresh()
+    assert idx.search("n", "other") == {packages[2].ID}
+
+    index.bump_generation()
+    idx.refresh()
+    assert idx.search("n", "other") == set()
+    assert len(idx.names) == 2
+
+
+def test_search_index_prune_interval(enabled: None, packages: list[Package]):
+    idx = index.search_index()
+    idx.refresh()
+
+    with db.begin():
+        db.delete(packages[2].PackageBase)
+
+    interval = config.getint("rpc", "search_index_prune_interval")
+    with mock.patch("time.monotonic", return_value=idx._pruned + interval):
+        idx.refresh()
+    assert idx.search("n", "other") == set()
+
+
+def test_search_index_prune_redis_error(enabled: None, packages: list[Package]):
+    index.bump_generation()
+    idx = index.search_index()
+    idx.refresh()
+    assert idx.generation is not None
+
+    with db.begin():
+        db.delete(packages[2].PackageBase)
+
+    with mock.patch(
+        "aurweb.packages.index.redis_connection", side_effect=ConnectionError
+    ):
+        idx.refresh()
+    assert idx.search("n", "other") == set()
+
+
+def test_rpc_search_index(enabled: None, packages: list[Package]):
+    data = rpc.RPC(version=5, type="search").handle(by="name-desc", args=["chungus"])
+    assert [pkg.get("Name") for pkg in data.get("results")] == ["python-chungus"]
+
+    data = rpc.RPC(version=5, type="search").handle(by="name", args=["chung"])
+    names = sorted(pkg.get("Name") for pkg in data.get("results"))
+    assert names == ["chungy", "python-chungus"]
+
+    # Too short for the index; falls back to LIKE only.
+    data = rpc.RPC(version=5, type="search").handle(by="name", args=["ot"])
+    assert [pkg.get("Name") for pkg in data.get("results")] == ["other"]
+
+
+def test_rpc_search_index_max_candidates(enabled: None, packages: list[Package]):
+    search = RPCSearch()
+    search.search_by("n", "chung")
+    assert "IN (__[POSTCOMPILE" in str(search.query)
+
+    config_getint = config.getint
+
+    def mock_getint(section: str, key: str, fallback=None) -> int:
+        if section == "rpc" and key == "search_index_max_candidates":
+            return 1
+        return config_getint(section, key, fallback)
+
+    # Two candidates exceed the limit; the plain LIKE is used.
+    with mock.patch("aurweb.config.getint", side_effect=mock_getint):
+        search = RPCSearch()
+        search.search_by("n", "chung")
+        assert "IN (__[POSTCOMPILE" not in str(search.query)
+
+        data = rpc.RPC(version=5, type="search").handle(by="name", args=["chung"])
+    names = sorted(pkg.get("Name") for pkg in data.get("results"))
+    assert names == ["chungy", "python-chungus"]
+
+
+def test_suggest_index_generation(enabled: None, packages: list[Package]):
+    idx = index.suggest_index()
+    assert idx.suggest("chung") == ["chungy"]
+    assert idx.suggest_pkgbase("python") == ["python-chungus"]
+
+    with db.begin():
+        pkgbase = db.create(PackageBase, Name="chungus-extra")
+        db.create(Package, PackageBase=pkgbase, Name="chungus-extra")
+
+    # Without a generation bump, the previous names are served.
+    assert idx.suggest("chung") == ["chungy"]
+
+    index.bump_generation()
+    assert idx.generation != redis_connection().get(index.GENERATION_KEY)
+    assert idx.suggest("chung") == ["chungus-extra", "chungy"]
+    assert idx.generation == redis_connection().get(index.GENERATION_KEY)
+
+
+def test_bump_generation_redis_error(caplog: pytest.LogCaptureFixture):
+    with mock.patch(
+        "aurweb.packages.index.redis_connection", side_effect=ConnectionError
+    ):
+        index.bump_generation()
+    assert "Unable to bump the package name generation." in caplog.text
+
+
+def test_rpc_suggest_index(enabled: None, packages: list[Package]):
+    data = rpc.RPC(version=5, type="suggest").handle(args=["chung"])
+    assert data == ["chungy"]
+
+    data = rpc.RPC(version=5, type="suggest-pkgbase").handle(args=["oth"])
+    assert data == ["other"]
+
+    # Wildcards fall back to the database.
+    data = rpc.RPC(version=5, type="suggest").handle(args=["chung_"])
+    assert data == ["chungy"]
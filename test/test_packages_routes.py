@@ -31,6 +31,7 @@ from aurweb.models.relation_type import (
 from aurweb.models.request_type import ADOPTION_ID, DELETION_ID, RequestType
 from aurweb.models.user import User
 from aurweb.packages import util as pkgutil
+from aurweb.packages.search import PackageSearch
 from aurweb.testing.html import get_errors, get_successes, parse_root
 from aurweb.testing.requests import Request
 
@@ -1172,6 +1173,78 @@ def test_packages_search_with_only_spaces(
     assert len(rows) == 0
 
 
+def search_key(*args, user: User | None = None, **kwargs) -> str:
+    search = PackageSearch(user)
+    for search_by, keywords in args:
+        search.search_by(search_by, keywords)
+    if "outdated" in kwargs:
+        search.filter_outdated(kwargs["outdated"])
+    if kwargs.get("orphans"):
+        search.filter_orphans()
+    if "sort" in kwargs:
+        search.sort_by(*kwargs["sort"])
+    return search.cache_key()
+
+
+def test_packages_search_cache_key(user: User):
+    key = search_key(("nd", "foo"), ("nd", "bar"))
+    assert key.startswith("search:")
+
+    # Equivalent searches share their key.
+    assert search_key(("nd", "bar"), ("nd", "foo"), ("nd", "foo")) == key
+    assert search_key(("k", {"foo", "bar"})) == search_key(("k", {"bar", "foo"}))
+    assert search_key(("x", "foo")) == search_key(("nd", "foo"))
+    assert search_key(sort=("x", "x")) == search_key(sort=("p", "d"))
+
+    others = {
+        search_key(("nd", "foo")),
+        search_key(("n", "foo"), ("n", "bar")),
+        search_key(("k", {"foo", "bar"})),
+        search_key(("nd", "foo bar")),
+        search_key(("nd", "foo"), ("nd", "bar"), outdated=True),
+        search_key(("nd", "foo"), ("nd", "bar"), outdated=False),
+        search_key(("nd", "foo"), ("nd", "bar"), orphans=True),
+        search_key(("nd", "foo"), ("nd", "bar"), sort=("n", "a")),
+    }
+    assert len(others) == 8
+    assert key not in others
+
+    # The user only matters when sorting by their votes or notifications.
+    assert search_key(("nd", "foo"), ("nd", "bar"), user=user) == key
+    assert search_key(sort=("w", "d"), user=user) != search_key(
+        sort=("w", "d"), user=User(ID=user.ID + 1)
+    )
+
+
+def test_packages_search_cache_user(
+    client: TestClient, maintainer: User, package: Package
+):
+    with db.begin():
+        db.create(
+            PackageVote,
+            PackageBase=package.PackageBase,
+            User=maintainer,
+            VoteTS=time.utcnow(),
+        )
+
+    def voted(cookies: dict[str, str]) -> str:
+        with client as request:
+            request.cookies = cookies
+            response = request.get("/packages", params={"K": package.Name})
+        assert response.status_code == int(HTTPStatus.OK)
+        root = parse_root(response.text)
+        rows = root.xpath('//table[@class="results"]/tbody/tr')
+        return rows[0].xpath("./td")[5].text.strip()
+
+    cookies = {"AURSID": maintainer.login(Request(), "testPassword")}
+    assert voted(cookies) == "Yes"
+
+    # Cached results are looked up with the votes of the viewing user.
+    user = create_user("other")
+    cookies = {"AURSID": user.login(Request(), "testPassword")}
+    assert voted(cookies) == str()
+
+
 def test_packages_sort_by_name(client: TestClient, packages: list[Package]):
     with client as request:
         response = request.get(
@@ -3,7 +3,7 @@ from collections.abc import Generator
 import pytest
 from fastapi.testclient import TestClient
 
-from aurweb import asgi, config, db, time
+from aurweb import asgi, cache, config, db, time
 from aurweb.aur_redis import kill_redis
 from aurweb.models.account_type import USER_ID
 from aurweb.models.dependency_type import DEPENDS_ID
@@ -75,6 +75,7 @@ def test_updated_packages(maintainer: User, package: Package):
     }
 
     kill_redis()  # Kill it here to ensure we're on a fake instance.
+    cache._redis.delete("package_updates")
     assert util.updated_packages(1, 0) == [expected]
     assert util.updated_packages(1, 600) == [expected]
     kill_redis()  # Kill it again, in case other tests use a real instance.
@@ -0,0 +1,174 @@
+from collections.abc import Generator
+from http import HTTPStatus
+from typing import Any
+from unittest import mock
+
+import pytest
+from fastapi.testclient import TestClient
+
+from aurweb import asgi, config, db
+from aurweb.models.account_type import USER_ID
+from aurweb.models.package import Package
+from aurweb.models.package_base import PackageBase
+from aurweb.models.user import User
+from aurweb.packages.index import bump_generation
+from aurweb.pkgbase import fragments, version
+from aurweb.templates import make_context
+from aurweb.testing.html import parse_root
+from aurweb.testing.requests import Request
+
+TEMPLATE = "partials/packages/pkgbase_metadata.html"
+
+# Save the original config.getint; it is mocked below.
+config_getint = config.getint
+
+
+@pytest.fixture(autouse=True)
+def setup(db_test):
+    return
+
+
+def create_user(username: str) -> User:
+    with db.begin():
+        user = db.create(
+            User,
+            Username=username,
+            Email=f"{username}@example.org",
+            Passwd="testPassword",
+            AccountTypeID=USER_ID,
+        )
+    return user
+
+
+@pytest.fixture
+def user() -> Generator[User]:
+    yield create_user("test")
+
+
+@pytest.fixture
+def pkgbase(user: User) -> Generator[PackageBase]:
+    with db.begin():
+        pkgbase = db.create(PackageBase, Name="pkgbase", Maintainer=user)
+        for name in ("pkg1", "pkg2"):
+            db.create(Package, PackageBase=pkgbase, Name=name)
+    yield pkgbase
+
+
+class Updates:
+    """Counts calls of a fragment's update callable."""
+
+    def __init__(self, pkgbase: PackageBase) -> None:
+        self.pkgbase = pkgbase
+        self.count = 0
+
+    def __call__(self, context: dict[str, Any]) -> None:
+        self.count += 1
+        context["packages"] = self.pkgbase.packages.all()
+        context["packages_count"] = len(context["packages"])
+
+
+def render(pkgbase: PackageBase, update: Updates, *args, **kwargs) -> str:
+    request = Request(**kwargs)
+    context = make_context(request, pkgbase.Name)
+    return fragments.render(
+        request, TEMPLATE, context, pkgbase.ID, *args, update=update
+    )
+
+
+def test_render(pkgbase: PackageBase):
+    update = Updates(pkgbase)
+    html = render(pkgbase, update)
+    assert "Packages (2)" in html
+    assert update.count == 1
+
+    assert render(pkgbase, update) == html
+    assert update.count == 1
+
+    # Other arguments are cached separately.
+    render(pkgbase, update, "other")
+    assert update.count == 2
+
+
+def test_render_version(pkgbase: PackageBase):
+    update = Updates(pkgbase)
+    render(pkgbase, update)
+
+    with db.begin():
+        db.create(Package, PackageBase=pkgbase, Name="pkg3")
+    assert "Packages (3)" in render(pkgbase, update)
+    assert update.count == 2
+
+    bump_generation()
+    render(pkgbase, update)
+    assert update.count == 3
+
+    version.bump(pkgbase.ID + 1)
+    render(pkgbase, update)
+    assert update.count == 3
+
+
+def test_render_language(pkgbase: PackageBase):
+    update = Updates(pkgbase)
+    render(pkgbase, update)
+    render(pkgbase, update, cookies={"AURLANG": "de"})
+    render(pkgbase, update, query_params={"timezone": "Europe/Berlin"})
+    assert update.count == 3
+
+
+def test_render_disabled(pkgbase: PackageBase):
+    def mock_getint(section: str, key: str, fallback=None) -> int:
+        if section == "cache" and key == "expiry_time_fragment":
+            return 0
+        return config_getint(section, key, fallback)
+
+    update = Updates(pkgbase)
+    with mock.patch("aurweb.config.getint", side_effect=mock_getint):
+        render(pkgbase, update)
+        render(pkgbase, update)
+    assert update.count == 2
+
+
+def maintainer(client: TestClient, pkgbase: PackageBase) -> str:
+    with client as request:
+        resp = request.get(f"/pkgbase/{pkgbase.Name}")
+    assert resp.status_code == int(HTTPStatus.OK)
+
+    root = parse_root(resp.text)
+    return root.xpath('//tr[@class="pkgmaint"]/td')[0].text.strip()
+
+
+def test_pkgbase_details(user: User, pkgbase: PackageBase):
+    client = TestClient(app=asgi.app)
+    assert maintainer(client, pkgbase) == user.Username
+
+    with mock.patch(
+        "aurweb.pkgbase.fragments.render_raw_template",
+        side_effect=AssertionError("not cached"),
+    ):
+        assert maintainer(client, pkgbase) == user.Username
+
+    other = create_user("other")
+    with db.begin():
+        pkgbase.Maintainer = other
+    assert maintainer(client, pkgbase) == other.Username
+
+
+def test_package_metadata_query(pkgbase: PackageBase):
+    client = TestClient(app=asgi.app)
+    with client as request:
+        resp = request.get("/packages/pkg1")
+    assert resp.status_code == int(HTTPStatus.OK)
+
+    render_raw_template = fragments.render_raw_template
+
+    def mock_render(request, template: str, context: dict[str, Any]) -> str:
+        assert template != "partials/packages/package_metadata.html"
+        return render_raw_template(request, template, context)
+
+    # Query parameters other than the listing ones share a fragment.
+    with mock.patch(
+        "aurweb.pkgbase.fragments.render_raw_template", side_effect=mock_render
+    ):
+        with client as request:
+            resp = request.get("/packages/pkg1", params={"x": "random"})
+    assert resp.status_code == int(HTTPStatus.OK)
@@ -0,0 +1,245 @@
+import logging
+from collections.abc import Generator
+from datetime import datetime
+from unittest import mock
+
+import pytest
+from sqlalchemy import true
+from sqlalchemy.exc import OperationalError
+
+from aurweb import config, db, time
+from aurweb.models.account_type import USER_ID
+from aurweb.models.package_base import PackageBase
+from aurweb.models.package_vote import PackageVote
+from aurweb.models.user import User
+from aurweb.pkgbase import popularity
+from aurweb.scripts import popupdate
+
+DAY = popularity.DAY
+
+
+@pytest.fixture(autouse=True)
+def setup(db_test):
+    return
+
+
+def create_user(username: str) -> User:
+    with db.begin():
+        user = db.create(
+            User,
+            Username=username,
+            Email=f"{username}@example.org",
+            Passwd="testPassword",
+            AccountTypeID=USER_ID,
+        )
+    return user
+
+
+@pytest.fixture
+def users() -> Generator[list[User]]:
+    yield [create_user(f"test{i}") for i in range(3)]
+
+
+@pytest.fixture
+def pkgbases(users: list[User]) -> Generator[list[PackageBase]]:
+    with db.begin():
+        pkgbases = [
+            db.create(PackageBase, Name=f"pkgbase{i}", Maintainer=users[0])
+            for i in range(2)
+        ]
+    yield pkgbases
+
+
+def vote(user: User, pkgbase: PackageBase, vote_ts: int) -> PackageVote:
+    with db.begin():
+        return db.create(PackageVote, User=user, PackageBase=pkgbase, VoteTS=vote_ts)
+
+
+def expected(votes: list[int], now: int) -> float:
+    return sum(popularity.DECAY ** ((now - vote_ts) / DAY) for vote_ts in votes)
+
+
+def test_weight():
+    now = time.utcnow()
+    assert popularity.weight(now) * popularity.factor(now) == pytest.approx(1.0)
+    assert popularity.weight(now - 10 * DAY) * popularity.factor(now) == pytest.approx(
+        0.98**10
+    )
+
+
+def test_vote_unvote(users: list[User], pkgbases: list[PackageBase]):
+    pkgbase = pkgbases[0]
+    now = time.utcnow()
+
+    vote(users[0], pkgbase, now)
+    db.refresh(pkgbase)
+    assert pkgbase.NumVotes == 1
+    assert pkgbase.Popularity == pytest.approx(1.0)
+
+    old = vote(users[1], pkgbase, now - 30 * DAY)
+    db.refresh(pkgbase)
+    assert pkgbase.NumVotes == 2
+    assert pkgbase.Popularity == pytest.approx(expected([now, now - 30 * DAY], now))
+
+    with db.begin():
+        db.delete(old)
+    db.refresh(pkgbase)
+    assert pkgbase.NumVotes == 1
+    assert pkgbase.Popularity == pytest.approx(1.0)
+    assert popularity.check(now) == []
+
+
+def test_last_unvote(users: list[User], pkgbases: list[PackageBase]):
+    pkgbase = pkgbases[0]
+    record = vote(users[0], pkgbase, time.utcnow() - 1000 * DAY)
+    with db.begin():
+        db.delete(record)
+
+    db.refresh(pkgbase)
+    assert pkgbase.NumVotes == 0
+    assert pkgbase.Popularity == 0.0
+    assert pkgbase.PopularityScore == 0.0
+
+
+def test_move_votes(users: list[User], pkgbases: list[PackageBase]):
+    now = time.utcnow()
+    records = [vote(user, pkgbases[0], now - i * DAY) for i, user in enumerate(users)]
+
+    with db.begin():
+        records[1].PackageBase = pkgbases[1]
+
+    for pkgbase in pkgbases:
+        db.refresh(pkgbase)
+    assert pkgbases[0].NumVotes == 2
+    assert pkgbases[0].Popularity == pytest.approx(expected([now, now - 2 * DAY], now))
+    assert pkgbases[1].NumVotes == 1
+    assert pkgbases[1].Popularity == pytest.approx(0.98)
+
+
+def test_delete_user(users: list[User], pkgbases: list[PackageBase]):
+    now = time.utcnow()
+    for user in users:
+        vote(user, pkgbases[0], now)
+
+    with db.begin():
+        db.delete(users[1])
+
+    db.refresh(pkgbases[0])
+    assert pkgbases[0].NumVotes == 2
+    assert pkgbases[0].Popularity == pytest.approx(2.0)
+
+
+def test_update_votes(users: list[User], pkgbases: list[PackageBase]):
+    pkgbase = pkgbases[0]
+    now = time.utcnow()
+    vote(users[0], pkgbase, now)
+
+    conn = db.Connection()
+    popularity.update_votes(conn, pkgbase.ID, 1, popularity.weight(now - DAY), now)
+    conn.commit()
+    conn.close()
+
+    db.refresh(pkgbase)
+    assert pkgbase.NumVotes == 2
+    assert pkgbase.Popularity == pytest.approx(1.98)
+
+
+def test_rescale(users: list[User], pkgbases: list[PackageBase]):
+    pkgbase = pkgbases[0]
+    now = time.utcnow()
+    vote(users[0], pkgbase, now - 10 * DAY)
+
+    # Pretend the popularity was last updated when the vote was cast.
+    with db.begin():
+        pkgbase.Popularity = 1.0
+        pkgbase.PopularityUpdated = datetime.fromtimestamp(now - 10 * DAY)
+
+    popupdate.run_variable()
+    db.refresh(pkgbase)
+    assert pkgbase.Popularity == pytest.approx(0.98**10)
+    assert pkgbase.PopularityUpdated >= datetime.fromtimestamp(now)
+
+
+def test_check(users: list[User], pkgbases: list[PackageBase], capsys):
+    pkgbase = pkgbases[0]
+    vote(users[0], pkgbase, time.utcnow())
+    assert popularity.check(time.utcnow()) == []
+
+    with db.begin():
+        pkgbase.PopularityScore = 0
+
+    args = ["aurweb-popupdate", "--check"]
+    with mock.patch("sys.argv", args):
+        with pytest.raises(SystemExit) as exc:
+            popupdate.main()
+    assert exc.value.code == 1
+    assert f"PackageBase {pkgbase.ID}:" in capsys.readouterr().out
+
+    with mock.patch("sys.argv", args + ["--fix"]):
+        with pytest.raises(SystemExit):
+            popupdate.main()
+
+    assert popularity.check(time.utcnow()) == []
+    db.refresh(pkgbase)
+    assert pkgbase.Popularity == pytest.approx(1.0)
+
+
+@pytest.fixture
+def chunk_size() -> Generator[None]:
+    config_getint = config.getint
+
+    def mock_getint(section: str, key: str, fallback=None) -> int:
+        if section == "git-archive" and key == "popularity-chunk-size":
+            return 2
+        return config_getint(section, key, fallback)
+
+    with mock.patch("aurweb.config.getint", side_effect=mock_getint):
+        yield
+
+
+def test_rescale_chunked(
+    users: list[User], chunk_size: None, caplog: pytest.LogCaptureFixture
+):
+    now = time.utcnow()
+    with db.begin():
+        pkgbases = [
+            db.create(
+                PackageBase,
+                Name=f"chunked{i}",
+                Maintainer=users[0],
+                PopularityUpdated=datetime.fromtimestamp(now - 10 * DAY),
+            )
+            for i in range(5)
+        ]
+    for pkgbase in pkgbases[:3]:
+        vote(users[1], pkgbase, now - 10 * DAY)
+    with db.begin():
+        pkgbases[0].PopularityUpdated = datetime.fromtimestamp(now - 10 * DAY)
+
+    caplog.set_level(logging.INFO, logger=popularity.logger.name)
+    assert popularity.rescale(PackageBase.PopularityUpdated < datetime.now()) == 5
+    chunks = [r for r in caplog.records if "with IDs" in r.getMessage()]
+    assert len(chunks) == 3
+    assert sum(record.args[0] for record in chunks) == 5
+    assert "Updated 5 package bases in" in caplog.text
+
+    for pkgbase in pkgbases:
+        db.refresh(pkgbase)
+    assert pkgbases[0].Popularity == pytest.approx(0.98**10)
+    assert pkgbases[4].Popularity == 0.0
+
+
+def test_rescale_deadlock(users: list[User], pkgbases: list[PackageBase]):
+    session = db.get_session()
+    execute = session.execute
+    calls = []
+
+    def deadlock_once(statement, *args, **kwargs):
+        if not calls and statement.is_dml:
+            calls.append(statement)
+            raise OperationalError("Deadlock found", (), "")
+        return execute(statement, *args, **kwargs)
+
+    with mock.patch.object(session, "execute", side_effect=deadlock_once):
+        assert popularity.rescale(true()) == len(pkgbases)
+    assert calls
@@ -0,0 +1,125 @@
+from collections.abc import Generator
+from unittest import mock
+
+import pytest
+from redis.exceptions import ConnectionError
+
+from aurweb import db, time
+from aurweb.models.account_type import USER_ID
+from aurweb.models.package_base import PackageBase
+from aurweb.models.package_comaintainer import PackageComaintainer
+from aurweb.models.package_notification import PackageNotification
+from aurweb.models.package_vote import PackageVote
+from aurweb.models.user import User
+from aurweb.pkgbase import version
+from aurweb.scripts import popupdate
+
+
+@pytest.fixture(autouse=True)
+def setup(db_test):
+    return
+
+
+def create_user(username: str) -> User:
+    with db.begin():
+        user = db.create(
+            User,
+            Username=username,
+            Email=f"{username}@example.org",
+            Passwd="testPassword",
+            AccountTypeID=USER_ID,
+        )
+    return user
+
+
+@pytest.fixture
+def user() -> Generator[User]:
+    yield create_user("test")
+
+
+@pytest.fixture
+def pkgbase(user: User) -> Generator[PackageBase]:
+    with db.begin():
+        pkgbase = db.create(PackageBase, Name="test-package", Maintainer=user)
+    yield pkgbase
+
+
+def current(pkgbase: PackageBase) -> int:
+    return version.get([pkgbase.ID])[pkgbase.ID]
+
+
+def test_bump(pkgbase: PackageBase):
+    before = current(pkgbase)
+    version.bump(pkgbase.ID, pkgbase.ID)
+    assert current(pkgbase) == before + 1
+
+    version.bump()
+    assert version.get([]) == {}
+
+
+def test_bump_redis_error(pkgbase: PackageBase, caplog: pytest.LogCaptureFixture):
+    # The database change is already committed; it must not be undone.
+    with mock.patch(
+        "aurweb.pkgbase.version.redis_connection", side_effect=ConnectionError
+    ):
+        with db.begin():
+            pkgbase.Name = "renamed"
+    assert "Unable to bump package base versions." in caplog.text
+
+    db.refresh(pkgbase)
+    assert pkgbase.Name == "renamed"
+
+
+def test_pkgbase_modified(pkgbase: PackageBase):
+    before = current(pkgbase)
+    with db.begin():
+        pkgbase.OutOfDateTS = time.utcnow()
+    assert current(pkgbase) == before + 1
+
+
+def test_related_modified(user: User, pkgbase: PackageBase):
+    before = current(pkgbase)
+    with db.begin():
+        db.create(PackageVote, User=user, PackageBase=pkgbase, VoteTS=time.utcnow())
+    assert current(pkgbase) == before + 1
+
+    # Notifications do not affect package base data.
+    with db.begin():
+        db.create(PackageNotification, User=user, PackageBase=pkgbase)
+    assert current(pkgbase) == before + 1
+
+
+def test_rollback(pkgbase: PackageBase):
+    before = current(pkgbase)
+    with pytest.raises(ValueError):
+        with db.begin():
+            pkgbase.OutOfDateTS = time.utcnow()
+            db.get_session().flush()
+            raise ValueError
+    assert current(pkgbase) == before
+
+
+def test_user_renamed(user: User, pkgbase: PackageBase):
+    comaintained = create_user("other")
+    with db.begin():
+        other = db.create(PackageBase, Name="other-package", Maintainer=comaintained)
+        db.create(PackageComaintainer, User=user, PackageBase=other, Priority=1)
+
+    before = current(pkgbase), current(other)
+    with db.begin():
+        user.Email = "changed@example.org"
+    assert (current(pkgbase), current(other)) == before
+
+    with db.begin():
+        user.Username = "renamed"
+    assert (current(pkgbase), current(other)) == (before[0] + 1, before[1] + 1)
+
+
+def test_popupdate(pkgbase: PackageBase):
+    before = current(pkgbase)
+    popupdate.run_variable()
+    assert current(pkgbase) == before + 1
+
+    # Up-to-date package bases are left alone.
+    popupdate.run_variable()
+    assert current(pkgbase) == before + 1
@@ -1,3 +1,5 @@
+from unittest import mock
+
 import pytest
 
 from aurweb.scripts import popupdate
@@ -9,4 +11,5 @@ def setup(db_test):
 
 
 def test_popupdate() -> None:
-    popupdate.main()
+    with mock.patch("sys.argv", ["aurweb-popupdate"]):
+        popupdate.main()
@@ -1,12 +1,13 @@
+import importlib.util
 from unittest import mock
 
 import pytest
 from redis.client import Pipeline
 
-from aurweb import aur_logging, config, db
+from aurweb import aur_logging, config, db, ratelimit, time
 from aurweb.aur_redis import redis_connection
 from aurweb.models import ApiRateLimit
-from aurweb.ratelimit import check_ratelimit
+from aurweb.ratelimit import RateLimit, check_ratelimit, headers, limit_request
 from aurweb.testing.requests import Request
 
 logger = aur_logging.get_logger(__name__)
@@ -98,6 +99,13 @@ def test_ratelimit_redis(
     assert not check_ratelimit(request)
 
 
+@pytest.fixture
+def windows():
+    ratelimit._windows.clear()
+    yield
+    ratelimit._windows.clear()
+
+
 @mock.patch("aurweb.config.getint", side_effect=mock_config_getint)
 @mock.patch("aurweb.config.getboolean", side_effect=mock_config_getboolean(0))
 @mock.patch("aurweb.config.get", side_effect=mock_config_get("none"))
@@ -106,6 +114,7 @@ def test_ratelimit_db(
     getboolean: mock.MagicMock,
     getint: mock.MagicMock,
     pipeline: Pipeline,
+    windows: None,
 ):
     # We'll need a Request for everything here.
     request = Request()
@@ -117,9 +126,239 @@ def test_ratelimit_db(
     # This check_ratelimit should fail, being the 4001th request.
     assert check_ratelimit(request)
 
-    # Delete the ApiRateLimit record.
+    # Requests are only written to the database when flushed.
+    assert db.query(ApiRateLimit).count() == 0
+    assert ratelimit.flush() == 1
+    record = db.query(ApiRateLimit).one()
+    assert record.Requests == 5
+
+    # Once the window has expired, we should be good to go again.
+    now = time.utcnow() + 101
+    with mock.patch("aurweb.time.utcnow", return_value=now):
+        assert not check_ratelimit(request)
+        ratelimit.flush()
+    db.refresh(record)
+    assert (record.Requests, record.WindowStart) == (1, now)
+
+
+@mock.patch("aurweb.config.getint", side_effect=mock_config_getint)
+@mock.patch("aurweb.config.getboolean", side_effect=mock_config_getboolean(0))
+def test_ratelimit_db_workers(
+    getboolean: mock.MagicMock, getint: mock.MagicMock, windows: None
+):
+    request = Request()
+    host = request.client.host
+
+    # Another worker counted three requests of the same window.
     with db.begin():
-        db.delete(db.query(ApiRateLimit).first())
+        db.create(ApiRateLimit, IP=host, Requests=3, WindowStart=time.utcnow())
 
-    # Should be good to go again!
     assert not check_ratelimit(request)
+    ratelimit.flush()
+    assert db.query(ApiRateLimit).one().Requests == 4
+
+    # The flush read back the requests of the other worker.
+    assert check_ratelimit(request)
+
+
+@mock.patch("aurweb.config.getint", side_effect=mock_config_getint)
+def test_ratelimit_cleanup(getint: mock.MagicMock):
+    now = time.utcnow()
+    with db.begin():
+        db.create(ApiRateLimit, IP="127.0.0.2", Requests=1, WindowStart=now - 101)
+        db.create(ApiRateLimit, IP="127.0.0.3", Requests=1, WindowStart=now)
+
+    assert ratelimit.cleanup() == 1
+    assert [r.IP for r in db.query(ApiRateLimit)] == ["127.0.0.3"]
+
+
+requires_lua = pytest.mark.skipif(
+    importlib.util.find_spec("lupa") is None, reason="fakeredis needs lupa for Lua"
+)
+
+
+def mock_config_get_algorithm(algorithm: str):
+    def fn(section: str, key: str):
+        if section == "ratelimit" and key == "algorithm":
+            return algorithm
+        if section == "options" and key == "cache":
+            return "none"
+        return config_get(section, key)
+
+    return fn
+
+
+@requires_lua
+@pytest.mark.parametrize("algorithm", ["fixed-window", "sliding-log", "gcra"])
+@mock.patch("aurweb.config.getint", side_effect=mock_config_getint)
+@mock.patch("aurweb.config.getboolean", side_effect=mock_config_getboolean(1))
+def test_ratelimit_script(
+    getboolean: mock.MagicMock,
+    getint: mock.MagicMock,
+    algorithm: str,
+    pipeline: Pipeline,
+):
+    redis_connection().flushall()
+    request = Request()
+    with mock.patch(
+        "aurweb.config.get", side_effect=mock_config_get_algorithm(algorithm)
+    ):
+        results = [limit_request(request) for _ in range(5)]
+
+    assert [result.allowed for result in results] == [True] * 4 + [False]
+    assert [result.remaining for result in results] == [3, 2, 1, 0, 0]
+    assert all(0 < result.reset <= 100 for result in results)
+    assert all(result.limit == 4 for result in results)
+
+
+@requires_lua
+@mock.patch("aurweb.config.getint", side_effect=mock_config_getint)
+@mock.patch("aurweb.config.getboolean", side_effect=mock_config_getboolean(1))
+def test_ratelimit_gcra_replenish(
+    getboolean: mock.MagicMock, getint: mock.MagicMock, pipeline: Pipeline
+):
+    redis_connection().flushall()
+    request = Request()
+    now = 1_000_000.0
+    with mock.patch("aurweb.config.get", side_effect=mock_config_get_algorithm("gcra")):
+        with mock.patch("aurweb.ratelimit._time.time", return_value=now):
+            for _ in range(4):
+                assert limit_request(request).allowed
+            assert not limit_request(request).allowed
+
+        # One request is replenished every window_length / request_limit.
+        with mock.patch("aurweb.ratelimit._time.time", return_value=now + 25):
+            assert limit_request(request).allowed
+            assert not limit_request(request).allowed
+
+
+@mock.patch("aurweb.config.getint", side_effect=mock_config_getint)
+@mock.patch("aurweb.config.getboolean", side_effect=mock_config_getboolean(1))
+@mock.patch("aurweb.config.get", side_effect=mock_config_get("none"))
+def test_ratelimit_without_scripting(
+    get: mock.MagicMock,
+    getboolean: mock.MagicMock,
+    getint: mock.MagicMock,
+    pipeline: Pipeline,
+):
+    request = Request()
+    with mock.patch("aurweb.ratelimit._scripting_supported", return_value=False):
+        results = [limit_request(request) for _ in range(5)]
+    assert [result.remaining for result in results] == [3, 2, 1, 0, 0]
+    assert not results[-1].allowed
+
+
+def test_ratelimit_headers():
+    allowed = RateLimit(True, 4, 3, 100)
+    assert headers(allowed) == {
+        "X-RateLimit-Limit": "4",
+        "X-RateLimit-Remaining": "3",
+        "X-RateLimit-Reset": "100",
+    }
+    assert headers(RateLimit(False, 4, 0, 10))["Retry-After"] == "10"
+
+
+def mock_config_local(limit: int, interval: int = 60, budget: str = "0.1"):
+    values = {
+        "request_limit": limit,
+        "window_length": 100,
+        "local_sync_interval": interval,
+    }
+
+    def getint(section: str, key: str):
+        if section == "ratelimit" and key in values:
+            return values[key]
+        return config_getint(section, key)
+
+    def get(section: str, key: str):
+        if section == "ratelimit" and key == "local_error_budget":
+            return budget
+        return mock_config_get_algorithm("fixed-window")(section, key)
+
+    return getint, get
+
+
+@pytest.fixture
+def local_tier():
+    redis_connection().flushall()
+    ratelimit._buckets.clear()
+    yield
+    ratelimit._buckets.clear()
+
+
+@requires_lua
+@mock.patch("aurweb.config.getboolean", side_effect=mock_config_getboolean(1))
+def test_ratelimit_local(getboolean: mock.MagicMock, local_tier: None):
+    getint, get = mock_config_local(100)
+    request = Request()
+    with (
+        mock.patch("aurweb.config.getint", side_effect=getint),
+        mock.patch("aurweb.config.get", side_effect=get),
+        mock.patch(
+            "aurweb.ratelimit._limit_shared", wraps=ratelimit._limit_shared
+        ) as shared,
+    ):
+        results = [limit_request(request) for _ in range(12)]
+
+    # The first request fills the bucket with 10 tokens, the twelfth
+    # reconciles the 10 requests served locally along with itself.
+    assert all(result.allowed for result in results)
+    assert [result.remaining for result in results] == list(range(99, 87, -1))
+    assert [c.args[3] for c in shared.call_args_list] == [1, 11]
+    assert int(redis_connection().get(f"ratelimit:{request.client.host}")) == 12
+
+
+@requires_lua
+@mock.patch("aurweb.config.getboolean", side_effect=mock_config_getboolean(1))
+def test_ratelimit_local_exceeded(getboolean: mock.MagicMock, local_tier: None):
+    getint, get = mock_config_local(4)
+    request = Request()
+    with (
+        mock.patch("aurweb.config.getint", side_effect=getint),
+        mock.patch("aurweb.config.get", side_effect=get),
+        mock.patch(
+            "aurweb.ratelimit._limit_shared", wraps=ratelimit._limit_shared
+        ) as shared,
+    ):
+        results = [limit_request(request) for _ in range(7)]
+
+    # A bucket holds at least one token; denials are served locally.
+    assert [result.allowed for result in results] == [True] * 4 + [False] * 3
+    assert shared.call_count == 3
+    assert int(redis_connection().get(f"ratelimit:{request.client.host}")) == 5
+
+
+@requires_lua
+@mock.patch("aurweb.config.getboolean", side_effect=mock_config_getboolean(1))
+def test_ratelimit_local_stale(getboolean: mock.MagicMock, local_tier: None):
+    getint, get = mock_config_local(100, interval=10)
+    request = Request()
+    with (
+        mock.patch("aurweb.config.getint", side_effect=getint),
+        mock.patch("aurweb.config.get", side_effect=get),
+        mock.patch(
+            "aurweb.ratelimit._limit_shared", wraps=ratelimit._limit_shared
+        ) as shared,
+    ):
+        with mock.patch("aurweb.ratelimit._time.monotonic", return_value=1000.0):
+            limit_request(request)
+            limit_request(request)
+        with mock.patch("aurweb.ratelimit._time.monotonic", return_value=1010.0):
+            limit_request(request)
+
+    assert [c.args[3] for c in shared.call_args_list] == [1, 2]
+
+
+@requires_lua
+@pytest.mark.parametrize("algorithm", ["fixed-window", "sliding-log", "gcra"])
+def test_ratelimit_script_cost(algorithm: str, local_tier: None):
+    with mock.patch(
+        "aurweb.config.get", side_effect=mock_config_get_algorithm(algorithm)
+    ):
+        first = ratelimit._limit_shared("127.0.0.2", 100, 4, cost=3)
+        second = ratelimit._limit_shared("127.0.0.2", 100, 4, cost=3)
+        third = ratelimit._limit_shared("127.0.0.2", 100, 4)
+
+    assert first == RateLimit(True, 4, 1, first.reset)
+    assert not second.allowed and second.remaining == 0
+    assert not third.allowed
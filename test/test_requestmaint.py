@@ -7,7 +7,7 @@ from aurweb.models import PackageBase, PackageRequest, User
 from aurweb.models.account_type import USER_ID
 from aurweb.models.package_request import PENDING_ID, REJECTED_ID
 from aurweb.models.request_type import ADOPTION_ID, ORPHAN_ID
-from aurweb.scripts import requestmaint
+from aurweb.scripts import notify, requestmaint
 
 
 @pytest.fixture(autouse=True)
@@ -114,3 +114,44 @@ def test_requestmaint_leaves_closed_requests(user: User, pkgbase: PackageBase):
     requestmaint.main()
 
     assert pkgreq.ClosureComment == "Closed by a human."
+
+
+def test_requestmaint_batch(user: User):
+    idle_time = config.getint("options", "request_idle_time")
+    now = time.utcnow()
+    with db.begin():
+        maintainer = db.create(
+            User,
+            Username="maintainer",
+            Email="maintainer@example.org",
+            Passwd=str(),
+            AccountTypeID=USER_ID,
+            HideEmail=1,
+        )
+        pkgbases = [
+            db.create(
+                PackageBase,
+                Name=f"pkgbase{i}",
+                Maintainer=maintainer if i else None,
+                SubmittedTS=now,
+                ModifiedTS=now,
+            )
+            for i in range(3)
+        ]
+    pkgreqs = [
+        make_request(user, pkgbase, ADOPTION_ID, age=idle_time + 666)
+        for pkgbase in pkgbases
+    ]
+
+    with db.begin():
+        notifs = requestmaint._main()
+
+    assert [n.get_headers()["In-Reply-To"] for n in notifs] == [
+        f"<pkg-request-{pkgreq.ID}@aur.archlinux.org>" for pkgreq in pkgreqs
+    ]
+    assert [n.get_cc() for n in notifs] == [[user.Email]] * 3
+    assert [n.get_bcc() for n in notifs] == [[], [maintainer.Email], [maintainer.Email]]
+    assert "Rejected adoption for pkgbase1" in notifs[1].get_body("en")
+
+    single = notify.RequestCloseNotification(0, pkgreqs[1].ID, "rejected")
+    assert vars(single) == vars(notifs[1])
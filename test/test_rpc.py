@@ -1,16 +1,21 @@
+import os
 import re
+import time as _time
 from collections.abc import Generator
+from datetime import UTC, datetime
 from http import HTTPStatus
 from unittest import mock
 
 import orjson
 import pytest
 from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
 from redis.client import Pipeline
+from sqlalchemy import event
 
 import aurweb.models.dependency_type as dt
 import aurweb.models.relation_type as rt
-from aurweb import asgi, config, db, rpc, scripts, time
+from aurweb import asgi, config, db, rpc, rpc_cache, time
 from aurweb.aur_redis import redis_connection
 from aurweb.models.account_type import USER_ID
 from aurweb.models.dependency_type import DEPENDS_ID
@@ -29,6 +34,8 @@ from aurweb.models.package_vote import PackageVote
 from aurweb.models.relation_type import PROVIDES_ID
 from aurweb.models.request_type import DELETION_ID, RequestType
 from aurweb.models.user import User
+from aurweb.packages import index, info
+from aurweb.scripts import popupdate
 
 
 @pytest.fixture
@@ -178,7 +185,7 @@ def packages(user: User, user2: User, user3: User) -> Generator[list[Package]]:
             db.create(
                 PackageVote, User=user_, PackageBase=output[0].PackageBase, VoteTS=now
             )
-    scripts.popupdate.run_single(output[0].PackageBase)
+    popupdate.run_single(output[0].PackageBase)
 
     yield output
 
@@ -491,6 +498,38 @@ def test_rpc_multiinfo(client: TestClient, packages: list[Package]):
     assert request_packages == []
 
 
+def test_rpc_multiinfo_server_timing(client: TestClient, packages: list[Package]):
+    def observed(stage: str) -> float:
+        labels = {"stage": stage}
+        return REGISTRY.get_sample_value("aur_rpc_stage_seconds_count", labels) or 0
+
+    params = {"v": 5, "type": "info", "arg[]": ["big-chungus"]}
+    before = observed("packages")
+    with client as request:
+        response = request.get("/rpc", params=params)
+    assert observed("packages") == before + 1
+
+    # Stage timings are only exposed to clients when enabled.
+    assert "Server-Timing" not in response.headers
+
+    config_getboolean = config.getboolean
+
+    def mock_getboolean(section: str, key: str, fallback=None) -> bool:
+        if section == "rpc" and key == "server_timing":
+            return True
+        return config_getboolean(section, key, fallback)
+
+    with mock.patch("aurweb.config.getboolean", side_effect=mock_getboolean):
+        with client as request:
+            response = request.get("/rpc", params=params)
+
+    timings = response.headers["Server-Timing"].split(", ")
+    stages = [timing.split(";")[0] for timing in timings]
+    assert stages == ["packages", "extra_info", "assemble"]
+    for timing in timings:
+        assert re.match(r"^\w+;dur=\d+\.\d{3}$", timing)
+
+
 def test_rpc_mixedargs(client: TestClient, packages: list[Package]):
     # Make dummy request.
     response1_packages = ["gluggly-chungus"]
@@ -760,12 +799,15 @@ def test_rpc_suggest(client: TestClient, packages: list[Package]):
     assert data == []
 
 
+config_getint = config.getint
+
+
 def mock_config_getint(section: str, key: str):
     if key == "request_limit":
         return 4
     elif key == "window_length":
         return 100
-    return config.getint(section, key)
+    return config_getint(section, key)
 
 
 @mock.patch("aurweb.config.getint", side_effect=mock_config_getint)
@@ -782,11 +824,15 @@ def test_rpc_ratelimit(
         with client as request:
             response = request.get("/rpc", params=params)
         assert response.status_code == int(HTTPStatus.OK)
+        assert response.headers.get("X-RateLimit-Limit") == "4"
+        assert response.headers.get("X-RateLimit-Remaining") == str(3 - i)
 
     # The fifth request should be banned.
     with client as request:
         response = request.get("/rpc", params=params)
     assert response.status_code == int(HTTPStatus.TOO_MANY_REQUESTS)
+    assert response.headers.get("X-RateLimit-Remaining") == "0"
+    assert int(response.headers.get("Retry-After")) > 0
 
     # Delete the cached records.
     pipeline.delete("ratelimit-ws:testclient")
@@ -1266,3 +1312,227 @@ def test_rpc_openapi_suggest(client: TestClient, packages: list[Package]):
 
         data = resp.json()
         assert data == expected
+
+
+config_getboolean = config.getboolean
+
+
+def mock_info_store(section: str, key: str, fallback=None) -> bool:
+    if section == "rpc" and key == "info_store":
+        return True
+    return config_getboolean(section, key, fallback)
+
+
+@pytest.fixture
+def info_store() -> Generator[None]:
+    redis_connection().flushall()
+    with mock.patch("aurweb.config.getboolean", side_effect=mock_info_store):
+        yield
+
+
+def test_rpc_info_store(client: TestClient, packages: list[Package]):
+    params = {"v": 5, "type": "info", "arg[]": [p.Name for p in packages]}
+    with client as request:
+        expected = request.get("/rpc", params=params).json()
+    expected["results"].sort(key=lambda pkg: pkg.get("ID"))
+
+    redis_connection().flushall()
+    with mock.patch("aurweb.config.getboolean", side_effect=mock_info_store):
+        with client as request:
+            assert request.get("/rpc", params=params).json() == expected
+        assert redis_connection().exists(f"rpc-info:{packages[0].Name}")
+
+        # The second request is served without querying package data.
+        with mock.patch("aurweb.rpc.RPC.subquery") as subquery:
+            with client as request:
+                assert request.get("/rpc", params=params).json() == expected
+        subquery.assert_not_called()
+
+
+def test_rpc_info_store_outdated(
+    client: TestClient, info_store: None, user: User, packages: list[Package]
+):
+    params = {"v": 5, "type": "info", "arg": packages[1].Name}
+    with client as request:
+        data = request.get("/rpc", params=params).json()
+    assert data["results"][0]["NumVotes"] == 0
+
+    # Votes bump the version of the package base.
+    pkgbase = packages[1].PackageBase
+    with db.begin():
+        db.create(PackageVote, User=user, PackageBase=pkgbase, VoteTS=time.utcnow())
+        pkgbase.NumVotes = 1
+
+    with client as request:
+        data = request.get("/rpc", params=params).json()
+    assert data["results"][0]["NumVotes"] == 1
+
+
+def test_rpc_info_store_too_many_results(
+    client: TestClient, info_store: None, packages: list[Package]
+):
+    params = {"v": 5, "type": "info", "arg[]": [p.Name for p in packages]}
+    with client as request:
+        request.get("/rpc", params=params)
+
+    config_getint = config.getint
+
+    def mock_config(section: str, key: str):
+        if key == "max_rpc_results":
+            return 1
+        return config_getint(section, key)
+
+    # Stored documents count towards the limit as well.
+    with mock.patch("aurweb.config.getint", side_effect=mock_config):
+        with client as request:
+            resp = request.get("/rpc", params=params)
+    assert resp.json().get("error") == "Too many package results."
+
+
+def test_rpc_info_store_ttl():
+    now = time.utcnow()
+    updated = datetime.fromtimestamp(now - 86400 + 600, UTC).replace(tzinfo=None)
+
+    # The naive PopularityUpdated is UTC regardless of the local timezone.
+    with mock.patch.dict(os.environ, {"TZ": "Etc/GMT+5"}):
+        _time.tzset()
+        try:
+            assert info.ttl(updated, now) == 600
+        finally:
+            _time.tzset()
+
+    # Documents are kept no longer than info_store_ttl.
+    updated = datetime.fromtimestamp(now, UTC).replace(tzinfo=None)
+    assert info.ttl(updated, now) == config.getint("rpc", "info_store_ttl")
+
+
+def mock_response_cache(section: str, key: str, fallback=None) -> bool:
+    if section == "rpc" and key == "response_cache":
+        return True
+    return config_getboolean(section, key, fallback)
+
+
+@pytest.fixture
+def response_cache() -> Generator[None]:
+    redis_connection().flushall()
+    with mock.patch("aurweb.config.getboolean", side_effect=mock_response_cache):
+        yield
+
+
+def test_rpc_response_cache(
+    client: TestClient, response_cache: None, packages: list[Package]
+):
+    params = {"v": 5, "type": "search", "arg": "chungus"}
+    with client as request:
+        response1 = request.get("/rpc", params=params)
+    assert response1.json().get("resultcount") == 4
+
+    with mock.patch("aurweb.rpc.RPC.handle") as handle:
+        with client as request:
+            response2 = request.get("/rpc", params=params)
+        assert response2.content == response1.content
+        assert response2.headers.get("ETag") == response1.headers.get("ETag")
+
+        # Conditional requests are answered from the cache as well.
+        headers = {"If-None-Match": response1.headers.get("ETag")}
+        with client as request:
+            response3 = request.get("/rpc", params=params, headers=headers)
+        assert response3.status_code == int(HTTPStatus.NOT_MODIFIED)
+    handle.assert_not_called()
+
+
+def test_rpc_response_cache_outdated(
+    client: TestClient, response_cache: None, user: User, packages: list[Package]
+):
+    params = {"v": 5, "type": "search", "arg": packages[1].Name}
+    with client as request:
+        data = request.get("/rpc", params=params).json()
+    assert data["results"][0]["NumVotes"] == 0
+
+    pkgbase = packages[1].PackageBase
+    with db.begin():
+        db.create(PackageVote, User=user, PackageBase=pkgbase, VoteTS=time.utcnow())
+        pkgbase.NumVotes = 1
+
+    with client as request:
+        data = request.get("/rpc", params=params).json()
+    assert data["results"][0]["NumVotes"] == 1
+
+
+def test_rpc_response_cache_suggest(
+    client: TestClient, response_cache: None, user: User, packages: list[Package]
+):
+    params = {"v": 5, "type": "suggest", "arg": "other"}
+    with client as request:
+        assert request.get("/rpc", params=params).json() == ["other-pkg"]
+
+    with db.begin():
+        pkgbase = db.create(PackageBase, Name="other-new", Maintainer=user)
+        db.create(Package, PackageBase=pkgbase, Name="other-new")
+
+    # Suggestions only change along with the package name generation.
+    with client as request:
+        assert request.get("/rpc", params=params).json() == ["other-pkg"]
+
+    index.bump_generation()
+    with client as request:
+        data = request.get("/rpc", params=params).json()
+    assert data == ["other-new", "other-pkg"]
+
+
+def test_rpc_response_cache_key():
+    handler = rpc.RPC(version=5, type="info")
+    key = rpc_cache.cache_key(handler, "name-desc", ["b", "a", "b"])
+    assert key == rpc_cache.cache_key(handler, "name-desc", ["a", "b"])
+
+    search = rpc.RPC(version=5, type="search")
+    key = rpc_cache.cache_key(search, "name-desc", ["a", "b"])
+    assert key == rpc_cache.cache_key(search, "name-desc", ["a"])
+    assert key != rpc_cache.cache_key(search, "name", ["a"])
+
+
+@pytest.mark.parametrize("count", [1, 50, 200])
+def test_rpc_multiinfo_round_trips(user: User, count: int):
+    with db.begin():
+        for i in range(count):
+            pkgbase = db.create(PackageBase, Name=f"pkg-{i}", Maintainer=user)
+            pkg = db.create(Package, PackageBase=pkgbase, Name=pkgbase.Name)
+            db.create(
+                PackageDependency,
+                DepTypeID=DEPENDS_ID,
+                Package=pkg,
+                DepName=f"dep-{i}",
+            )
+            db.create(PackageComaintainer, User=user, PackageBase=pkgbase, Priority=1)
+            db.create(
+                PackageRequest,
+                ReqTypeID=DELETION_ID,
+                User=user,
+                PackageBase=pkgbase,
+                PackageBaseName=pkgbase.Name,
+                Comments=str(),
+                ClosureComment=str(),
+            )
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args) -> None:
+        statements.append(statement)
+
+    engine = db.get_engine()
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        handler = rpc.RPC(version=5, type="info")
+        data = handler.handle(args=[f"pkg-{i}" for i in range(count)])
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+    # Package rows and all of their extra info take one round-trip each.
+    assert len(statements) == 2
+    assert set(handler.timings) == {"packages", "extra_info", "assemble"}
+
+    assert data.get("resultcount") == count
+    for result in data.get("results"):
+        assert result.get("Depends") == [result.get("Name").replace("pkg", "dep")]
+        assert result.get("CoMaintainers") == [user.Username]
+        assert result.get("PendingRequests") == 1
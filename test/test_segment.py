@@ -0,0 +1,107 @@
+from unittest import mock
+
+import py
+import pytest
+
+from aurweb import db, time
+from aurweb.archives import segment
+from aurweb.models import PackageBase, User
+from aurweb.models.account_type import USER_ID
+
+
+@pytest.fixture(autouse=True)
+def setup(db_test):
+    return
+
+
+@pytest.fixture
+def pkgbase() -> PackageBase:
+    with db.begin():
+        user = db.create(
+            User,
+            Username="test",
+            Email="test@example.org",
+            Passwd="testPassword",
+            AccountTypeID=USER_ID,
+        )
+        pkgbase = db.create(PackageBase, Name="test", Packager=user, ModifiedTS=100)
+    yield pkgbase
+
+
+def entry(key: str, pkgbase_id: int) -> segment.Entry:
+    return segment.Entry(key, pkgbase_id, (key.encode(), b""))
+
+
+def test_segment_roundtrip(tmpdir: py.path.local):
+    path = str(tmpdir / "test.seg")
+    assert segment.read(path) is None
+
+    entries = [entry("a", 1), entry("b", 2)]
+    writer = segment.Writer(path, {"modified": 1})
+    for e in entries:
+        writer.add(e)
+
+    # Nothing is visible before commit().
+    assert segment.read(path) is None
+    writer.commit()
+
+    state, read = segment.read(path)
+    assert state == {"modified": 1}
+    assert list(read) == entries
+
+    # An aborted writer leaves the previous segment in place.
+    writer = segment.Writer(path, {"modified": 2})
+    writer.add(entry("c", 3))
+    writer.abort()
+    assert segment.read(path).state == {"modified": 1}
+
+
+def test_segment_read_invalid(tmpdir: py.path.local):
+    path = tmpdir / "test.seg"
+    path.write_binary(b"garbage\n")
+    assert segment.read(str(path)) is None
+
+
+def test_segment_splice():
+    old = [entry("a", 1), entry("b", 2), entry("c", 2), entry("d", 3)]
+    new = [entry("b", 2), entry("bb", 2), entry("e", 4)]
+
+    # Base 2 was changed, base 3 was deleted and base 4 was added.
+    spliced = segment.splice(old, new, changed={2, 4}, existing={1, 2, 4})
+    assert [e.key for e in spliced] == ["a", "b", "bb", "e"]
+
+
+def test_segment_prepare(tmpdir: py.path.local, pkgbase: PackageBase):
+    path = str(tmpdir / "test.seg")
+
+    # Without a previous segment, a full run is performed.
+    state, previous = segment.prepare(path, {"extended": True}, 3600)
+    assert previous is None
+    assert state.get("modified") == 100
+    segment.Writer(path, state).commit()
+
+    state, previous = segment.prepare(path, {"extended": True}, 3600)
+    assert previous.state.get("full") == state.get("full")
+
+    # Only package bases changed since the previous run match.
+    criterion = segment.changed_since(previous.state)
+    assert db.query(PackageBase).filter(criterion).count() == 0
+    with db.begin():
+        pkgbase.ModifiedTS = 200
+    assert db.query(PackageBase).filter(criterion).count() == 1
+
+    # Recent changes are matched again until they are older than MARGIN.
+    with db.begin():
+        pkgbase.ModifiedTS = time.utcnow()
+    state, _ = segment.prepare(path, {"extended": True}, 3600)
+    criterion = segment.changed_since(state)
+    assert db.query(PackageBase).filter(criterion).count() == 1
+
+    # Different options or an elapsed interval force a full run.
+    _, previous = segment.prepare(path, {"extended": False}, 3600)
+    assert previous is None
+
+    now = time.utcnow() + 3600
+    with mock.patch("aurweb.time.utcnow", return_value=now):
+        _, previous = segment.prepare(path, {"extended": True}, 3600)
+    assert previous is None
@@ -1,9 +1,12 @@
+import asyncio
 from collections.abc import Generator
+from unittest import mock
 
 import pytest
 from prometheus_client import REGISTRY, generate_latest
+from sqlalchemy import event
 
-from aurweb import cache, db, time
+from aurweb import cache, db, statistics, time
 from aurweb.models import Package, PackageBase, PackageRequest
 from aurweb.models.account_type import PACKAGE_MAINTAINER_ID, USER_ID
 from aurweb.models.package_request import (
@@ -14,7 +17,16 @@ from aurweb.models.package_request import (
 )
 from aurweb.models.request_type import DELETION_ID, ORPHAN_ID
 from aurweb.models.user import User
-from aurweb.statistics import Statistics, update_prometheus_metrics
+from aurweb.scripts import statsupdate
+from aurweb.statistics import (
+    SNAPSHOT_KEY,
+    Statistics,
+    cache_expire,
+    collect_metrics,
+    get_homepage_counts,
+    get_request_counts,
+    update_prometheus_metrics,
+)
 
 
 @pytest.fixture(autouse=True)
@@ -137,10 +149,44 @@ def test_get_count_change(stats: Statistics, test_data):
 
     # Let's clear the cache and check again
     cache._redis.flushall()
+    cache.clear_local()
     assert stats.get_count("package_count") != pkgs_before
     assert stats.get_count("package_maintainer_count") != pms_before
 
 
+def test_snapshot(stats: Statistics, test_data):
+    statements = []
+
+    def count(conn, cursor, statement, *args) -> None:
+        statements.append(statement)
+
+    engine = db.get_engine()
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        snapshot = stats.snapshot()
+        assert stats.snapshot() == snapshot
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+
+    # One scan of each of PackageBases, Users and PackageRequests.
+    assert len(statements) == 3
+    assert get_homepage_counts()["package_count"] == snapshot["package_count"] == 10
+    assert get_request_counts()["total_requests"] == 10
+
+
+def test_statsupdate(stats: Statistics, test_data):
+    stats.snapshot()
+    with db.begin():
+        db.delete(db.query(PackageBase).first())
+    assert stats.get_count("package_count") == 10
+
+    # Refreshed counters are served once workers drop their copy.
+    statsupdate.main()
+    assert cache._redis.ttl(SNAPSHOT_KEY) == cache_expire
+    cache.clear_local()
+    assert stats.get_count("package_count") == 9
+
+
 def test_update_prometheus_metrics(test_data):
     metrics = str(generate_latest(REGISTRY))
 
@@ -159,3 +205,28 @@ def test_update_prometheus_metrics(test_data):
     assert 'aur_requests{status="Accepted",type="orphan"} 1.0' in metrics
     assert 'aur_requests{status="Rejected",type="orphan"} 1.0' in metrics
     assert 'aur_requests{status="Pending",type="deletion"} 1.0' in metrics
+
+
+@pytest.mark.asyncio
+async def test_update_metrics_thread(test_data):
+    # Background updates use a session of their own in another thread.
+    await asyncio.to_thread(statistics._update_metrics)
+    metrics = str(generate_latest(REGISTRY))
+    assert 'aur_users{type="user"} 9.0' in metrics
+
+
+@pytest.mark.asyncio
+async def test_collect_metrics(test_data, caplog: pytest.LogCaptureFixture):
+    sleep = mock.AsyncMock(side_effect=[None, asyncio.CancelledError()])
+    update = mock.Mock(side_effect=[RuntimeError("unavailable"), None])
+    with (
+        mock.patch("asyncio.sleep", new=sleep),
+        mock.patch("aurweb.statistics._update_metrics", new=update),
+    ):
+        with pytest.raises(asyncio.CancelledError):
+            await collect_metrics(60)
+
+    # Failed updates are logged and retried after the interval.
+    assert update.call_count == 2
+    sleep.assert_called_with(60)
+    assert "Unable to update statistics metrics." in caplog.text
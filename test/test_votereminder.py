@@ -2,10 +2,12 @@ from collections.abc import Generator
 from typing import Tuple
 
 import pytest
+from sqlalchemy import event
 
 from aurweb import config, db, time
 from aurweb.models import User, Vote, VoteInfo
 from aurweb.models.account_type import PACKAGE_MAINTAINER_ID
+from aurweb.scripts import notify
 from aurweb.scripts import votereminder as reminder
 from aurweb.testing.email import Email
 
@@ -113,3 +115,41 @@ def test_vote_reminders_only_unvoted(
     subject, content = email_pieces(voteinfo)
     assert email.headers.get("Subject") == subject
     assert email.body == content
+
+
+def test_vote_reminders_batch(user: User, user2: User, user3: User, voteinfo: VoteInfo):
+    with db.begin():
+        voteinfo2 = db.create(
+            VoteInfo,
+            Agenda="Dolor sit amet.",
+            User=user.Username,
+            End=voteinfo.End,
+            Quorum=0.00,
+            Submitter=user,
+            Submitted=0,
+        )
+    create_vote(user2, voteinfo)
+    create_vote(user, voteinfo2)
+    create_vote(user3, voteinfo2)
+
+    vote_ids = [voteinfo.ID, voteinfo2.ID]
+    statements = []
+
+    def count(conn, cursor, statement, *args) -> None:
+        statements.append(statement)
+
+    engine = db.get_engine()
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        notifs = notify.VoteReminderNotification.batch(vote_ids)
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+
+    # Recipients of all votes are resolved in two queries.
+    assert len(statements) == 2
+    assert [n.get_recipients() for n in notifs] == [
+        [(user.Email, "en"), (user3.Email, "en")],
+        [(user2.Email, "en")],
+    ]
+    single = notify.VoteReminderNotification(voteinfo.ID)
+    assert single.get_recipients() == notifs[0].get_recipients()